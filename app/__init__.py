@@ -3,7 +3,10 @@ Flask应用初始化
 """
 
 import os
+import weakref
 import logging
+import functools
+from typing import Optional
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
@@ -12,12 +15,28 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
-# 初始化数据库
-db = SQLAlchemy()
+# 初始化数据库，统计等分析查询可以路由到只读引擎
+from app.utils.db_routing import RoutingSession, engine_config
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-def create_app():
+def _dispose_engines(app_ref):
+    """
+    丢弃从父进程继承的数据库连接池，子进程第一次查询时重新建立连接
+    """
+    app = app_ref()
+    if app is None:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False：不关闭父进程仍在使用的连接
+            engine.dispose(close=False)
+
+def create_app(bootstrap: Optional[bool] = None):
     """
     创建Flask应用实例
+
+    bootstrap 为True时初始化数据库（建表、迁移和种子数据），为空时由环境变量 DATABASE_BOOTSTRAP 决定；
+    gunicorn 在主进程中初始化一次后，worker创建应用时跳过这一步（见 app/bootstrap.py）
     """
     app = Flask(__name__, static_folder='static', static_url_path='')
 
@@ -29,6 +48,7 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:////data/app.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(engine_config(app.config['SQLALCHEMY_DATABASE_URI']))
     app.config['OPENAI_API_BASE_URL'] = os.getenv('OPENAI_API_BASE_URL', 'https://api.openai.com/v1')
     app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 会话有效期1小时
     
@@ -39,10 +59,17 @@ def create_app():
     CORS(app)
     
     # 创建数据库表和初始化种子数据
-    with app.app_context():
-        from app.utils.database import init_database, seed_database
-        init_database()
-        seed_database()
+    if bootstrap is None:
+        bootstrap = os.getenv('DATABASE_BOOTSTRAP', 'True').lower() == 'true'
+    if bootstrap:
+        with app.app_context():
+            from app.utils.database import init_database, seed_database
+            init_database()
+            seed_database()
+
+    # 预加载应用后fork出的worker不能共用父进程的数据库连接
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=functools.partial(_dispose_engines, weakref.ref(app)))
     
     # 注册蓝图
     from app.routes import key_routes, model_routes, chat_routes, stats_routes, auth_routes, health_routes
@@ -53,6 +80,10 @@ def create_app():
     app.register_blueprint(stats_routes.bp)
     app.register_blueprint(health_routes.bp)
     
+    # 注册命令行命令
+    from app.commands import register_commands
+    register_commands(app)
+    
     # 注册静态文件路由
     @app.route('/')
     def index():
@@ -63,6 +94,22 @@ def create_app():
     from app.services.heartbeat_service import heartbeat_service
     heartbeat_service.init_app(app)
     
+    # 初始化历史记录异步写入服务
+    from app.services.history_writer import history_writer
+    history_writer.init_app(app)
+
+    # 初始化请求日志（每个聊天请求一条汇总日志，由后台线程写入）
+    from app.services.request_log import request_logger
+    request_logger.init_app(app)
+    
+    # 初始化后台维护任务（聊天历史清理和数据库压缩）
+    from app.services.maintenance_service import maintenance_scheduler
+    maintenance_scheduler.init_app(app)
+
+    # 初始化优雅停机服务（统计正在进行的请求）
+    from app.services.drain_service import drain_service
+    drain_service.init_app(app)
+    
     # 注意：before_first_request 装饰器在 Flask 2.3+ 中已被移除
     # 心跳检测服务现在在 app/main.py 中应用启动时直接初始化
     
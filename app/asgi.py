@@ -0,0 +1,281 @@
+"""
+ASGI数据面
+
+/v1 下的OpenAI兼容接口由异步路由直接处理：等待上游和转发流式响应时不占用线程，
+一个worker可以同时保持大量流式连接。其他路径（管理界面和 /api 接口）交给挂载的Flask应用处理。
+模型注册表、别名路由、Key选择和使用统计与Flask路由使用同一套服务。
+
+启动方式: uvicorn app.asgi_main:app 或 hypercorn app.asgi_main:app
+"""
+
+import json
+import time
+import logging
+from typing import Dict, Optional
+from contextlib import asynccontextmanager, aclosing
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from app.utils.tokenizer import StreamUsageTracker
+
+logger = logging.getLogger(__name__)
+
+# httpx 默认为每个上游请求输出一条INFO日志
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+def _error(message: str, error_type: str, code: str, status_code: int,
+           headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """
+    OpenAI格式的错误响应
+    """
+    return JSONResponse({
+        'error': {
+            'message': message,
+            'type': error_type,
+            'code': code
+        }
+    }, status_code=status_code, headers=headers)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """
+    客户端的 If-None-Match 是否包含当前ETag
+    """
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags
+
+
+def create_asgi_app(flask_app=None) -> Starlette:
+    """
+    创建ASGI应用，flask_app 为空时创建新的Flask应用
+    """
+    from app import create_app
+    from app.routes.model_routes import v1_models_payload
+    from app.services.async_openai_service import async_openai_service
+    from app.services.drain_service import drain_service
+    from app.services.history_writer import history_writer, latency_fields
+    from app.services.maintenance_service import maintenance_scheduler
+    from app.services.model_router import model_router
+    from app.services.request_log import request_logger, new_request_id
+    from app.utils.model_registry import model_registry
+
+    flask_app = flask_app or create_app()
+    async_openai_service.init_app(flask_app)
+    run_sync = async_openai_service.run_sync
+
+    def record_chat(model_name, **fields):
+        """
+        提交聊天历史，model_id 为实际使用的上游模型的ID
+        """
+        entry = model_registry.get(model_name)
+        history_writer.submit_chat(model=model_name, model_id=entry.id if entry else None, **fields)
+
+    async def v1_models(request: Request) -> Response:
+        """
+        获取所有模型列表 (OpenAI API格式)，与Flask路由返回相同的响应体和ETag
+        """
+        try:
+            if request.query_params.get('refresh', 'false').lower() == 'true':
+                # 只通知后台任务刷新，不阻塞当前请求
+                maintenance_scheduler.trigger('model_refresh')
+            body, etag = await run_sync(model_registry.payload, 'v1_models', v1_models_payload)
+            headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers=headers)
+            return Response(body, media_type='application/json', headers=headers)
+        except Exception as e:
+            logger.error(f"Error getting models: {e}")
+            return JSONResponse({
+                'success': False,
+                'message': f'获取模型列表失败: {str(e)}'
+            }, status_code=500)
+
+    async def v1_chat_completions(request: Request) -> Response:
+        """
+        OpenAI兼容的聊天完成接口，每个请求结束时输出一条汇总日志
+        """
+        started = time.perf_counter()
+        request_id = new_request_id(request.headers.get('x-request-id'))
+        headers = {'X-Request-ID': request_id}
+        summary = {'request_id': request_id, 'path': request.url.path}
+        try:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            if not data or 'messages' not in data or 'model' not in data:
+                request_logger.log_request(started, **summary, status_code=400, error='missing_parameters')
+                return _error('Missing required parameters: messages or model',
+                              'invalid_request_error', 'missing_parameters', 400, headers)
+
+            model_name = data['model']
+            messages = data['messages']
+            summary.update(model=model_name, stream=bool(data.get('stream', False)))
+            model = await run_sync(model_registry.get, model_name)
+            if not model and not model_router.is_alias(model_name):
+                request_logger.log_request(started, **summary, status_code=404, error='model_not_found')
+                return _error(f'Model {model_name} not found', 'invalid_request_error', 'model_not_found', 404, headers)
+
+            # 聊天历史记录在请求结束后交给后台写入
+            request_json = json.dumps(data)
+            params = {
+                'temperature': data.get('temperature', 0.7),
+                'max_tokens': data.get('max_tokens', 1000),
+                'top_p': data.get('top_p', 1.0),
+                'frequency_penalty': data.get('frequency_penalty', 0),
+                'presence_penalty': data.get('presence_penalty', 0)
+            }
+
+            if data.get('stream', False):
+                # 客户端要求返回usage时透传给上游
+                if data.get('stream_options'):
+                    params['stream_options'] = data['stream_options']
+                tracker = StreamUsageTracker(model_name)
+
+                async def generate():
+                    is_empty = True
+                    error = None
+                    completed = False
+                    # 停机时服务器取消超时的流，shutdown 等待 finally 提交历史记录后再写完队列
+                    with drain_service.track():
+                        try:
+                            try:
+                                async with aclosing(model_router.astream_chat_completion(
+                                    messages=messages, model=model_name, tracker=tracker, **params
+                                )) as chunks:
+                                    async for chunk in chunks:
+                                        if chunk:
+                                            is_empty = False
+                                            yield chunk
+                            except Exception as e:
+                                error = str(e)
+                                # 在流中返回错误信息
+                                yield f"data: {json.dumps({'error': error})}\n\n"
+
+                            if is_empty:
+                                error = error or 'Empty completion in streaming response'
+                                yield f"data: {json.dumps({'error': 'Empty completion in streaming response'})}\n\n"
+                            completed = True
+                        finally:
+                            # 记录流式请求的聊天历史，客户端中途断开时也要写入
+                            usage = tracker.get_usage() if tracker.key_id else {}
+                            latency = latency_fields(started, {'upstream_ms': tracker.upstream_ms, 'ttfb_ms': tracker.ttfb_ms})
+                            # 没有上游目标接受请求时与非流式请求相同，记录客户端请求的模型（别名）
+                            served_model = tracker.model if tracker.key_id else None
+                            with anyio.CancelScope(shield=True):
+                                await run_sync(
+                                    record_chat, served_model or model_name,
+                                    key_id=tracker.key_id or 0,
+                                    request=request_json,
+                                    tokens_used=usage.get('total_tokens', 0),
+                                    prompt_tokens=usage.get('prompt_tokens', 0),
+                                    completion_tokens=usage.get('completion_tokens', 0),
+                                    is_error=is_empty or error is not None,
+                                    **latency
+                                )
+                            # 没有发送完就结束的流是客户端断开了连接（或停机时被取消），汇总日志中记录下来
+                            if not completed and error is None:
+                                error = 'client_disconnected'
+                            request_logger.log_request(
+                                started,
+                                **summary,
+                                request_body=request_json,
+                                status_code=200,
+                                key_id=tracker.key_id,
+                                served_model=served_model,
+                                alias=tracker.alias,
+                                attempts=tracker.attempts,
+                                prompt_tokens=usage.get('prompt_tokens', 0),
+                                completion_tokens=usage.get('completion_tokens', 0),
+                                total_tokens=usage.get('total_tokens', 0),
+                                error=error,
+                                **latency
+                            )
+
+                return StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+
+            try:
+                response_data = await model_router.achat_completion(messages=messages, model=model_name, **params)
+            except Exception as api_error:
+                # 如果API调用失败，仍然记录聊天历史
+                error_json = json.dumps({'error': str(api_error)})
+                latency = latency_fields(started)
+                await run_sync(
+                    record_chat, model_name,
+                    key_id=0,
+                    request=request_json,
+                    response=error_json,
+                    tokens_used=0,
+                    is_error=True,
+                    **latency
+                )
+                request_logger.log_request(
+                    started, **summary, request_body=request_json, response_body=error_json,
+                    status_code=500, error=str(api_error), **latency
+                )
+                return _error(str(api_error), 'api_error', 'api_error', 500, headers)
+
+            usage = response_data.get('_usage', {})
+            route = response_data['_route']
+            response_json = json.dumps(response_data)
+            latency = latency_fields(started, response_data.get('_timing'))
+            await run_sync(
+                record_chat, route['model'],
+                key_id=response_data['_key_info']['id'],
+                request=request_json,
+                response=response_json,
+                tokens_used=usage.get('total_tokens', 0),
+                prompt_tokens=usage.get('prompt_tokens', 0),
+                completion_tokens=usage.get('completion_tokens', 0),
+                **latency
+            )
+            request_logger.log_request(
+                started,
+                **summary,
+                request_body=request_json,
+                response_body=response_json,
+                status_code=200,
+                key_id=response_data['_key_info']['id'],
+                served_model=route['model'],
+                alias=route.get('alias'),
+                attempts=route.get('attempts'),
+                prompt_tokens=usage.get('prompt_tokens', 0),
+                completion_tokens=usage.get('completion_tokens', 0),
+                total_tokens=usage.get('total_tokens', 0),
+                **latency
+            )
+
+            # 移除自定义的 _key_info、_usage、_timing 和 _route 字段
+            for field in ('_key_info', '_usage', '_timing', '_route'):
+                response_data.pop(field, None)
+            return JSONResponse(response_data, headers=headers)
+        except Exception as e:
+            logger.error(f"Error in chat_completions: {e}")
+            request_logger.log_request(started, **summary, status_code=500, error=str(e))
+            return _error(str(e), 'api_error', 'api_error', 500, headers)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        if maintenance_scheduler.enabled:
+            maintenance_scheduler.ensure_started()
+        yield
+        # 服务器等正在进行的请求和流完成后才执行到这里，关闭时写完队列中剩余的历史记录
+        await async_openai_service.aclose()
+        await anyio.to_thread.run_sync(drain_service.shutdown)
+
+    return Starlette(
+        routes=[
+            Route('/v1/models', v1_models, methods=['GET']),
+            Route('/v1/chat/completions', v1_chat_completions, methods=['POST']),
+            # 管理界面和其他接口仍由Flask处理
+            Mount('/', app=WSGIMiddleware(flask_app))
+        ],
+        lifespan=lifespan
+    )
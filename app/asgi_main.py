@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+ASGI启动文件
+
+uvicorn app.asgi_main:app --host 0.0.0.0 --port 5000
+hypercorn app.asgi_main:app --bind 0.0.0.0:5000
+"""
+
+from dotenv import load_dotenv
+from app.asgi import create_asgi_app
+
+# 加载环境变量
+load_dotenv()
+
+# 创建ASGI应用，/v1 接口由异步路由处理，其他路径交给Flask
+app = create_asgi_app()
@@ -0,0 +1,32 @@
+"""
+数据库初始化
+
+建表、补充新增的列、执行迁移和写入种子数据只需要在部署时执行一次，不必在每个worker启动时重复。
+gunicorn 在主进程启动时执行一次（见 app/gunicorn_conf.py），也可以单独执行后
+用 DATABASE_BOOTSTRAP=False 启动服务。
+
+用法: python -m app.bootstrap
+"""
+
+import sys
+from dotenv import load_dotenv
+
+
+def bootstrap() -> bool:
+    """
+    初始化数据库，返回是否成功
+    """
+    from app import create_app, db
+    from app.utils.database import init_database, seed_database
+
+    app = create_app(bootstrap=False)
+    with app.app_context():
+        success = init_database() and seed_database()
+        for engine in db.engines.values():
+            engine.dispose()
+    return success
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    sys.exit(0 if bootstrap() else 1)
@@ -0,0 +1,80 @@
+"""
+Flask命令行工具
+
+使用方法: flask --app app.main <命令>
+"""
+
+import click
+from datetime import datetime, timedelta
+
+def register_commands(app):
+    """
+    注册命令行命令
+    """
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--days', type=int, default=None, help='只回填最近N天的数据，默认回填全部历史')
+    @click.option('--granularity', type=click.Choice(['minute', 'hour']), multiple=True,
+                  help='只回填指定粒度的汇总表，可重复指定')
+    def backfill_rollups(days, granularity):
+        """
+        从聊天历史重建使用统计汇总表
+        """
+        from app.services.rollup_service import RollupService
+
+        since = datetime.utcnow() - timedelta(days=days) if days else None
+        result = RollupService.backfill(since=since, granularities=list(granularity) or None)
+        for name, rows in result.items():
+            click.echo(f"{name}: 写入 {rows} 行汇总数据")
+
+    @app.cli.command('purge-history')
+    @click.option('--days', type=int, default=None, help='保留最近N天的聊天历史，默认使用 HISTORY_RETENTION_DAYS')
+    def purge_history(days):
+        """
+        分批清理过期聊天历史并压缩数据库
+        """
+        from app.services.maintenance_service import MaintenanceService
+
+        report = MaintenanceService.run_retention(days)
+        purge = report.get('purge', {})
+        click.echo(f"删除 {purge.get('rows_removed', 0)} 行聊天历史（{purge.get('chunks', 0)} 批）")
+        compaction = report.get('compaction')
+        if compaction and not compaction.get('skipped'):
+            click.echo(f"压缩方式 {compaction['mode']}，回收 {compaction['bytes_reclaimed']} 字节")
+
+    @app.cli.command('compact-db')
+    @click.option('--full', is_flag=True, help='开启增量压缩并执行一次完整VACUUM（会锁库）')
+    @click.option('--mode', type=click.Choice(['incremental', 'vacuum_into']), default=None,
+                  help='压缩方式，默认使用 COMPACTION_MODE')
+    def compact_db(full, mode):
+        """
+        压缩SQLite数据库
+        """
+        from app.services.maintenance_service import MaintenanceService
+
+        if full:
+            report = MaintenanceService.full_vacuum()
+        else:
+            report = MaintenanceService.compact_database(mode)
+        if report.get('skipped'):
+            click.echo("未执行压缩（非SQLite数据库或未开启增量压缩，可使用 --full）")
+        else:
+            click.echo(f"回收 {report['bytes_reclaimed']} 字节")
+
+    @app.cli.command('backfill-costs')
+    @click.option('--days', type=int, default=None, help='只回填最近N天的聊天历史，默认回填全部')
+    @click.option('--reprice', is_flag=True, help='按当前价格表重新计算已拆分记录的费用')
+    def backfill_costs(days, reprice):
+        """
+        从保存的响应内容回填输入输出token和费用，并重建汇总表
+        """
+        from app.services.cost_service import CostService
+
+        since = datetime.utcnow() - timedelta(days=days) if days else None
+        report = CostService.backfill(since=since, reprice=reprice)
+        history = report['history']
+        click.echo(f"扫描 {history['scanned']} 条聊天历史：从响应解析 {history['from_response']} 条，"
+                   f"估算 {history['estimated']} 条，重新计价 {history['repriced']} 条")
+        for name, rows in report['rollups'].items():
+            click.echo(f"{name}: 写入 {rows} 行汇总数据")
+        click.echo(f"补齐 {report['usage_stats']} 条Key和模型累计统计")
@@ -15,9 +15,17 @@ class Config:
     # 数据库配置
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:////data/app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '0'))  # 主连接池大小，0表示使用SQLAlchemy默认值
+    DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', '10'))  # 主连接池允许超出的连接数
+    DATABASE_READ_ENABLED = os.getenv('DATABASE_READ_ENABLED', 'True').lower() == 'true'  # 统计等分析查询是否使用单独的只读连接
+    DATABASE_READ_URL = os.getenv('DATABASE_READ_URL', '')  # 只读副本地址，为空时SQLite以只读方式打开同一个数据库文件
+    DATABASE_READ_POOL_SIZE = int(os.getenv('DATABASE_READ_POOL_SIZE', '0'))  # 只读连接池大小，0表示使用SQLAlchemy默认值
+    DATABASE_READ_MAX_OVERFLOW = int(os.getenv('DATABASE_READ_MAX_OVERFLOW', '5'))  # 只读连接池允许超出的连接数
+    SQLITE_WAL = os.getenv('SQLITE_WAL', 'True').lower() == 'true'  # SQLite使用WAL模式，读取不阻塞写入
     
     # OpenAI API配置
     OPENAI_API_BASE_URL = os.getenv('OPENAI_API_BASE_URL', 'https://api.openai.com/v1')
+    UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '1000'))  # ASGI数据面到上游的最大连接数，即同时转发的流数上限
     
     # 应用配置
     DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
@@ -26,9 +34,30 @@ class Config:
     
     # Key轮询配置
     KEY_ROTATION_INTERVAL = 1  # 每次请求轮询一次
+    KEY_TOKENS_PER_MINUTE = int(os.getenv('KEY_TOKENS_PER_MINUTE', '0'))  # 每个Key每分钟的token额度，0表示不限制
+    
+    # Token估算配置
+    TOKENIZER_VOCAB_DIR = os.getenv('TOKENIZER_VOCAB_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tokenizer'))  # 离线词表目录
+    
+    # 模型注册表配置
+    MODEL_REGISTRY_CHECK_INTERVAL = float(os.getenv('MODEL_REGISTRY_CHECK_INTERVAL', '5'))  # 检查其他进程是否修改了模型的间隔（秒）
+    MODEL_REFRESH_INTERVAL = int(os.getenv('MODEL_REFRESH_INTERVAL', '3600'))  # 后台从上游刷新模型列表的间隔（秒），0表示不自动刷新
+    MODEL_REFRESH_JITTER = int(os.getenv('MODEL_REFRESH_JITTER', '300'))  # 刷新时间的随机推迟上限（秒），避免多个进程同时请求上游
+    
+    # 模型别名路由配置
+    MODEL_ROUTES_PATH = os.getenv('MODEL_ROUTES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'model_routes.json'))  # 模型别名路由表
+    MODEL_ROUTE_DEADLINE_MS = int(os.getenv('MODEL_ROUTE_DEADLINE_MS', '30000'))  # 路由请求默认的总耗时上限（毫秒），包括换目标重试
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))  # 上游目标连续失败多少次后熔断
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))  # 熔断后多久放行一个试探请求（秒）
+    
+    # 计费配置
+    MODEL_PRICES_PATH = os.getenv('MODEL_PRICES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'model_prices.json'))  # 模型价格表（美元/百万token）
     
     # 统计配置
-    STATS_CACHE_TIMEOUT = 300  # 统计数据缓存时间（秒）
+    STATS_CACHE_ENABLED = os.getenv('STATS_CACHE_ENABLED', 'True').lower() == 'true'  # 是否缓存统计结果
+    STATS_CACHE_TIMEOUT = int(os.getenv('STATS_CACHE_TIMEOUT', '300'))  # 统计数据缓存时间（秒）
+    STATS_CACHE_STALE_TIMEOUT = int(os.getenv('STATS_CACHE_STALE_TIMEOUT', '3600'))  # 过期后仍可先返回旧值的最长时间（秒）
+    STATS_CACHE_MAX_ENTRIES = int(os.getenv('STATS_CACHE_MAX_ENTRIES', '256'))  # 最多缓存的结果数
     
     # 聊天配置
     CHAT_MAX_HISTORY = 100  # 最大聊天历史记录数
@@ -44,6 +73,39 @@ class Config:
     HEARTBEAT_RESTART_COOLDOWN = int(os.getenv('HEARTBEAT_RESTART_COOLDOWN', '300'))  # 重启冷却时间（秒）
     HEARTBEAT_AUTO_START = os.getenv('HEARTBEAT_AUTO_START', 'True').lower() == 'true'  # 是否自动启动心跳检测
 
+    # 历史记录异步写入配置
+    HISTORY_QUEUE_MAXSIZE = int(os.getenv('HISTORY_QUEUE_MAXSIZE', '10000'))  # 写入队列最大长度
+    HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '200'))  # 每批最多写入的事件数
+    HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1.0'))  # 批量写入最长等待时间（秒）
+    HISTORY_OVERFLOW_POLICY = os.getenv('HISTORY_OVERFLOW_POLICY', 'block')  # 队列满时的策略: block, drop_metadata, spill
+    HISTORY_BLOCK_TIMEOUT = float(os.getenv('HISTORY_BLOCK_TIMEOUT', '5'))  # block策略下最长等待时间（秒）
+    HISTORY_SPILL_PATH = os.getenv('HISTORY_SPILL_PATH', '/data/history_spill.jsonl')  # spill策略的溢出文件
+    HISTORY_DRAIN_TIMEOUT = float(os.getenv('HISTORY_DRAIN_TIMEOUT', '30'))  # 关闭时等待队列写完的最长时间（秒）
+    HISTORY_WRITE_RETRIES = int(os.getenv('HISTORY_WRITE_RETRIES', '3'))  # 数据库被锁定等临时错误的重试次数
+    HISTORY_RETRY_BACKOFF = float(os.getenv('HISTORY_RETRY_BACKOFF', '0.5'))  # 第一次重试前等待的时间（秒），之后每次翻倍
+    DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '60'))  # 停机时等待正在进行的请求和流式响应完成的最长时间（秒）
+
+    # 请求日志配置
+    REQUEST_LOG_ENABLED = os.getenv('REQUEST_LOG_ENABLED', 'True').lower() == 'true'  # 是否为每个聊天请求输出一条汇总日志
+    REQUEST_LOG_PATH = os.getenv('REQUEST_LOG_PATH', '')  # 请求日志文件，为空时输出到标准错误
+    REQUEST_LOG_QUEUE_MAXSIZE = int(os.getenv('REQUEST_LOG_QUEUE_MAXSIZE', '10000'))  # 日志队列最大长度，队列满时丢弃
+    REQUEST_LOG_BODY_SAMPLE_RATE = float(os.getenv('REQUEST_LOG_BODY_SAMPLE_RATE', '0'))  # 记录请求和响应内容的请求比例（0到1）
+    REQUEST_LOG_BODY_MAX_CHARS = int(os.getenv('REQUEST_LOG_BODY_MAX_CHARS', '2000'))  # 请求和响应内容最多记录的字符数
+    REQUEST_LOG_REDACT_FIELDS = os.getenv('REQUEST_LOG_REDACT_FIELDS', 'api_key,authorization,password,secret,key_value')  # 记录内容时脱敏的字段名（逗号分隔）
+
+    # 数据保留与压缩配置
+    MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', 'True').lower() == 'true'  # 是否启用后台维护任务
+    MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', '3600'))  # 维护任务执行间隔（秒）
+    MAINTENANCE_LOCK_PATH = os.getenv('MAINTENANCE_LOCK_PATH', '/data/maintenance.lock')  # 多进程部署时只允许一个进程执行维护任务，目录不存在时放在数据库目录或实例目录下
+    HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '0'))  # 聊天历史保留天数，0表示不清理（默认不删除历史）
+    RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', '1000'))  # 每个删除事务覆盖的主键范围
+    RETENTION_CHUNK_PAUSE = float(os.getenv('RETENTION_CHUNK_PAUSE', '0.05'))  # 两次删除事务之间的间隔（秒）
+    COMPACTION_MODE = os.getenv('COMPACTION_MODE', 'incremental')  # 压缩方式: incremental, vacuum_into, none
+    COMPACTION_PAGES = int(os.getenv('COMPACTION_PAGES', '0'))  # 每次增量压缩释放的页数，0表示释放全部空闲页
+    COMPACTION_SNAPSHOT_PATH = os.getenv('COMPACTION_SNAPSHOT_PATH', '/data/app.compact.db')  # vacuum_into方式输出的压缩副本
+    ROLLUP_MINUTE_RETENTION_HOURS = int(os.getenv('ROLLUP_MINUTE_RETENTION_HOURS', '48'))  # 分钟级汇总保留小时数
+    ROLLUP_HOUR_RETENTION_DAYS = int(os.getenv('ROLLUP_HOUR_RETENTION_DAYS', '90'))  # 小时级汇总保留天数，天级汇总永久保留
+
 class DevelopmentConfig(Config):
     """
     开发环境配置
@@ -0,0 +1,162 @@
+"""
+Gunicorn配置
+
+通过 GUNICORN_PROFILE 选择worker模型，三种配置都针对长时间的SSE流式响应：
+- gthread（默认）：每个worker一个线程池，一个流占用一个线程，worker心跳不受流式响应影响
+- gevent：每个流一个协程，需要另外安装 gevent
+- uvicorn：运行ASGI入口 app.asgi_main:app，/v1 接口由事件循环处理
+
+worker数量按容器可用的CPU数计算，可以用 GUNICORN_WORKERS 覆盖。
+数据库在主进程启动时初始化一次，worker启动时不再重复。
+
+启动方式: gunicorn -c app/gunicorn_conf.py
+"""
+
+import os
+import sys
+import selectors
+import subprocess
+import importlib.util
+from functools import partial
+from gunicorn.workers.gthread import ThreadWorker
+
+# 各配置的worker类型、每个CPU的worker数和运行的应用
+PROFILES = {
+    'gthread': {
+        'worker_class': 'gthread',
+        'workers_per_cpu': 2,
+        'wsgi_app': 'app.main:app'
+    },
+    'gevent': {
+        'worker_class': 'gevent',
+        'workers_per_cpu': 1,
+        'wsgi_app': 'app.main:app'
+    },
+    'uvicorn': {
+        'worker_class': 'uvicorn.workers.UvicornWorker',
+        'workers_per_cpu': 1,
+        'wsgi_app': 'app.asgi_main:app'
+    }
+}
+
+
+class DrainingThreadWorker(ThreadWorker):
+    """
+    停机时不丢弃刚返回keep-alive响应的连接
+
+    gunicorn在主线程中处理请求完成后的连接，如果这时worker已经收到SIGTERM，会直接关闭连接；
+    但响应已经带着keep-alive发给了客户端，客户端可能已经在这个连接上发出了下一个请求，
+    结果在滚动重启时收到连接断开错误。这里把这类连接放回keep-alive队列：下一个请求仍然会被处理
+    （响应带 Connection: close），空闲超过 keepalive 秒后再关闭。
+    依赖gunicorn 26的 ThreadWorker 内部实现（finish_request、keepalived_conns），requirements.txt 固定了主版本。
+    """
+
+    def finish_request(self, conn, fs):
+        if (self.alive or not hasattr(self, 'keepalived_conns')
+                or fs.cancelled() or fs.exception() is not None or fs.result() is not True):
+            return super().finish_request(conn, fs)
+
+        try:
+            conn.sock.setblocking(False)
+            conn.set_timeout()
+            self.keepalived_conns.append(conn)
+            self.poller.register(conn.sock, selectors.EVENT_READ,
+                                 partial(self.on_client_socket_readable, conn))
+        except Exception:
+            self.nr_conns -= 1
+            conn.close()
+
+
+def cpu_count() -> int:
+    """
+    可用的CPU数，容器中优先使用cgroup的CPU配额
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(int(int(quota) / int(period)), 1)
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+profile_name = os.getenv('GUNICORN_PROFILE', 'gthread')
+if profile_name not in PROFILES:
+    raise RuntimeError(f"未知的 GUNICORN_PROFILE: {profile_name}，可选值: {', '.join(PROFILES)}")
+profile = PROFILES[profile_name]
+if profile_name == 'gevent' and importlib.util.find_spec('gevent') is None:
+    raise RuntimeError("gevent 配置需要先安装 gevent: pip install gevent")
+
+bind = os.getenv('GUNICORN_BIND', f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}")
+wsgi_app = profile['wsgi_app']
+worker_class = DrainingThreadWorker if profile_name == 'gthread' else profile['worker_class']
+workers = int(os.getenv('GUNICORN_WORKERS', '0')) or profile['workers_per_cpu'] * cpu_count() + 1
+
+# gthread每个worker的线程数，即每个worker同时处理的请求（包括流）数
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+# gevent每个worker同时保持的连接数
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# 流式响应期间worker仍然发送心跳，timeout只用于结束卡死的worker，不会截断长时间的流
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# 停机分两段：worker先在 DRAIN_TIMEOUT 内等待正在进行的请求和流完成，再停止超时的流（最多5秒）并在
+# HISTORY_DRAIN_TIMEOUT 内写完历史记录队列（worker_exit）；主进程在 graceful_timeout 时强制结束worker，
+# 所以默认值包含两段时间和10秒余量
+drain_timeout = float(os.getenv('DRAIN_TIMEOUT', '60'))
+flush_reserve = float(os.getenv('HISTORY_DRAIN_TIMEOUT', '30')) + 10
+graceful_timeout = int(float(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', drain_timeout + flush_reserve)))
+# graceful_timeout 设置得更短时压缩等待请求的时间，仍然留出写历史记录的时间
+drain_timeout = max(int(min(drain_timeout, graceful_timeout - flush_reserve)), 1)
+# 客户端连接的保持时间，在前面有负载均衡时应大于负载均衡的空闲超时
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# 在主进程中加载应用，worker通过fork共享已加载的代码，启动时不再各自导入和初始化；
+# worker在fork后丢弃继承的数据库连接（见 app/__init__.py）。
+# gevent要在加载应用前完成monkey patch，不能预加载
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true' and profile_name != 'gevent'
+
+# worker心跳文件放在内存文件系统中，避免容器的磁盘IO阻塞心跳
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+proc_name = 'openai-proxy'
+
+
+def on_starting(server):
+    """
+    主进程启动时初始化一次数据库，worker创建应用时跳过
+
+    预加载时应用已经在主进程中创建（数据库也已初始化）；否则在单独的进程中初始化，
+    主进程不导入应用代码。DATABASE_BOOTSTRAP=False 表示数据库由部署流程单独初始化。
+    """
+    if server.cfg.preload_app:
+        return
+    if os.getenv('DATABASE_BOOTSTRAP', 'True').lower() == 'true':
+        subprocess.run([sys.executable, '-m', 'app.bootstrap'], check=True)
+    os.environ['DATABASE_BOOTSTRAP'] = 'False'
+
+
+def post_worker_init(worker):
+    """
+    worker中等待正在进行的请求的时间限制为 drain_timeout，停机时间的其余部分留给 worker_exit
+
+    gthread和gevent按worker自己的 graceful_timeout 等待，修改只影响worker进程，主进程仍按原值强制结束；
+    uvicorn使用 timeout_graceful_shutdown，超时后取消剩余的请求并执行lifespan关闭；
+    两者都在 worker 退出前由 drain_service.shutdown 停止超时的流，等它们记录历史后再写完队列
+    """
+    worker.cfg.set('graceful_timeout', drain_timeout)
+    if hasattr(worker, 'config') and hasattr(worker.config, 'timeout_graceful_shutdown'):
+        worker.config.timeout_graceful_shutdown = drain_timeout
+
+
+def worker_exit(server, worker):
+    """
+    worker处理完正在进行的请求后退出前，写完历史记录和使用统计队列
+    """
+    module = sys.modules.get('app.services.drain_service')
+    if module is not None:
+        module.drain_service.shutdown()
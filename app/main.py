@@ -10,6 +10,7 @@ import logging
 from dotenv import load_dotenv
 from app import create_app
 from app.services.heartbeat_service import heartbeat_service
+from app.services.drain_service import drain_service
 
 # 加载环境变量
 load_dotenv()
@@ -23,17 +24,19 @@ logger = logging.getLogger(__name__)
 app = create_app()
 
 def signal_handler(sig, frame):
-    """信号处理函数，用于优雅地关闭应用"""
-    logger.info("接收到关闭信号，正在停止心跳检测服务...")
-    heartbeat_service.stop()
-    logger.info("心跳检测服务已停止")
+    """信号处理函数，等待正在进行的请求完成后优雅地关闭应用"""
+    # 信号处理函数在主线程（服务器接受连接的线程）中执行，排空期间不会再接受新连接
+    logger.info("接收到关闭信号，等待正在进行的请求完成...")
+    if drain_service.drain():
+        logger.info("正在进行的请求已全部完成")
+    drain_service.shutdown()
     sys.exit(0)
 
-# 注册信号处理函数
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
 if __name__ == '__main__':
+    # 注册信号处理函数；gunicorn等服务器自己处理信号，worker退出时调用 drain_service.shutdown
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
     # 获取配置
     debug = os.getenv('DEBUG', 'True').lower() == 'true'
     host = os.getenv('HOST', '0.0.0.0')
@@ -59,6 +62,6 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("接收到键盘中断信号")
     finally:
-        # 确保心跳检测服务被停止
-        heartbeat_service.stop()
+        # 确保后台线程被停止，队列中的历史记录被写完
+        drain_service.shutdown()
         logger.info("应用已关闭")
\ No newline at end of file
@@ -1,3 +1,19 @@
 """
 数据模型模块
-"""
\ No newline at end of file
+
+导入所有模型，db.create_all 和 sync_schema 通过导入本模块看到全部的表
+"""
+
+from app.models.key import Key
+from app.models.model import Model
+from app.models.usage_stats import UsageStat
+from app.models.chat_history import ChatHistory
+from app.models.usage_rollup import UsageRollupMinute, UsageRollupHour, UsageRollupDay
+from app.models.data_version import DataVersion
+from app.models.latency_histogram import LatencyHistogramBin
+from app.models.schema_migration import SchemaMigration
+
+__all__ = [
+    'Key', 'Model', 'UsageStat', 'ChatHistory', 'UsageRollupMinute', 'UsageRollupHour', 'UsageRollupDay',
+    'DataVersion', 'LatencyHistogramBin', 'SchemaMigration'
+]
@@ -4,12 +4,21 @@
 
 from datetime import datetime
 from app import db
+from app.utils.pricing import format_cost
 
 class ChatHistory(db.Model):
     """
     聊天历史记录数据模型
     """
     __tablename__ = 'chat_history'
+    __table_args__ = (
+        # 列表分页按 (timestamp, id) 倒序；按Key、模型过滤时再按时间排序
+        db.Index('ix_chat_history_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_chat_history_key_id_timestamp', 'key_id', 'timestamp'),
+        db.Index('ix_chat_history_model_timestamp', 'model', 'timestamp'),
+        # 按请求状态过滤时不需要读取响应内容
+        db.Index('ix_chat_history_is_error_timestamp', 'is_error', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     key_id = db.Column(db.Integer, db.ForeignKey('keys.id'), nullable=False)
@@ -19,6 +28,10 @@ class ChatHistory(db.Model):
     response = db.Column(db.Text, nullable=True)  # JSON格式存储响应内容
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     tokens_used = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=True)  # 为空表示未记录输入输出拆分
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    cost_nanos = db.Column(db.BigInteger, nullable=True)  # 费用（纳美元）
+    is_error = db.Column(db.Boolean, nullable=False, default=False, server_default='0')  # 是否为失败请求
     
     def __repr__(self):
         return f'<ChatHistory {self.id}: Key {self.key_id} - {self.model}>'
@@ -35,7 +48,11 @@ class ChatHistory(db.Model):
             'request': self.request,
             'response': self.response,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'tokens_used': self.tokens_used
+            'tokens_used': self.tokens_used,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost': format_cost(self.cost_nanos) if self.cost_nanos is not None else None,
+            'is_error': self.is_error
         }
     
     @staticmethod
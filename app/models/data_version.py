@@ -0,0 +1,92 @@
+"""
+数据版本计数器模型
+
+每类数据一个单调递增的版本号，写入数据时在同一事务中加一，
+缓存只需读取版本号即可判断数据是否变化（多个worker进程共享）。
+"""
+
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+
+# 统计数据版本：Key、模型、使用统计、聊天历史、汇总表和延迟直方图的任何写入都会使其变化
+STATS_VERSION = 'stats'
+
+# 模型数据版本：模型表的任何写入都会使其变化，各进程的模型注册表据此重新加载
+MODELS_VERSION = 'models'
+
+# 变化时需要使统计数据版本加一的表
+STATS_TABLES = {
+    'keys',
+    'models',
+    'usage_stats',
+    'chat_history',
+    'usage_rollup_minute',
+    'usage_rollup_hour',
+    'usage_rollup_day',
+    'latency_histogram_bins'
+}
+
+class DataVersion(db.Model):
+    """
+    数据版本计数器
+    """
+    __tablename__ = 'data_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}: {self.version}>'
+
+    @staticmethod
+    def get(name: str) -> int:
+        """
+        读取当前版本号
+        """
+        return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
+
+    @staticmethod
+    def bump(name: str, session=None):
+        """
+        在当前事务中把版本号加一，同一事务内只加一次
+        """
+        session = session or db.session()
+        bumped = session.info.setdefault('bumped_versions', set())
+        if name in bumped:
+            return
+        bumped.add(name)
+
+        table = DataVersion.__table__
+        connection = session.connection()
+        result = connection.execute(
+            table.update().where(table.c.name == name).values(
+                version=table.c.version + 1,
+                updated_at=datetime.utcnow()
+            )
+        )
+        if not result.rowcount:
+            connection.execute(table.insert().values(name=name, version=1, updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    """
+    ORM写入统计相关的表时自动更新统计数据版本，写入模型表时同时更新模型数据版本
+    """
+    tables = {getattr(instance, '__tablename__', None) for instance in (*session.new, *session.dirty, *session.deleted)}
+    if tables & STATS_TABLES:
+        DataVersion.bump(STATS_VERSION, session)
+    if 'models' in tables:
+        DataVersion.bump(MODELS_VERSION, session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _reset_bumped(session):
+    """
+    事务结束后清除本事务的加一标记
+    """
+    session.info.pop('bumped_versions', None)
@@ -10,6 +10,9 @@ class Key(db.Model):
     OpenAI Key数据模型
     """
     __tablename__ = 'keys'
+    __table_args__ = (
+        db.Index('ix_keys_status', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     key_value = db.Column(db.String(255), nullable=False, unique=True)
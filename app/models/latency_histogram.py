@@ -0,0 +1,27 @@
+"""
+延迟直方图数据模型
+"""
+
+from app import db
+
+class LatencyHistogramBin(db.Model):
+    """
+    按小时、Key、模型和指标存储的延迟直方图桶计数
+
+    每个非零桶一行，写入时按唯一键累加计数，多个进程的直方图天然可合并。
+    """
+    __tablename__ = 'latency_histogram_bins'
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'key_id', 'model_id', 'metric', 'bin', name='uq_latency_histogram_bin'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)  # 小时桶起点（UTC）
+    key_id = db.Column(db.Integer, nullable=False)
+    model_id = db.Column(db.Integer, nullable=False, default=0)  # 0表示未知模型
+    metric = db.Column(db.String(20), nullable=False)  # total, ttfb, overhead
+    bin = db.Column(db.Integer, nullable=False)  # 直方图桶序号
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<LatencyHistogramBin {self.bucket} {self.metric}[{self.bin}]: {self.count}>'
@@ -2,19 +2,64 @@
 模型信息数据模型
 """
 
+import json
 from datetime import datetime
+from typing import Dict, Any, Union
 from app import db
 
+
+def parse_capabilities(raw: Union[str, Dict[str, Any], None]) -> Dict[str, Any]:
+    """
+    解析模型能力JSON，格式错误时视为没有能力信息
+    """
+    if isinstance(raw, dict):
+        return raw
+    if not raw:
+        return {}
+    try:
+        capabilities = json.loads(raw)
+    except (ValueError, TypeError):
+        return {}
+    return capabilities if isinstance(capabilities, dict) else {}
+
+
+def capability_columns(capabilities: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    从模型能力中取出按列存储的字段
+    """
+    context_window = capabilities.get('context_window', capabilities.get('max_tokens'))
+    try:
+        context_window = int(context_window) if context_window is not None else None
+    except (ValueError, TypeError):
+        context_window = None
+    owned_by = capabilities.get('owned_by')
+    return {
+        'supports_chat': bool(capabilities.get('supports_chat', False)),
+        'supports_completion': bool(capabilities.get('supports_completion', False)),
+        'context_window': context_window,
+        'owned_by': str(owned_by) if owned_by is not None else None
+    }
+
+
 class Model(db.Model):
     """
     OpenAI模型信息数据模型
     """
     __tablename__ = 'models'
+    __table_args__ = (
+        db.Index('ix_models_supports_chat', 'supports_chat'),
+        db.Index('ix_models_supports_completion', 'supports_completion'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     model_name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.Text, nullable=True)
     capabilities = db.Column(db.Text, nullable=True)  # JSON格式存储模型能力
+    # 常用能力按列存储，按能力筛选模型时不需要解析JSON
+    supports_chat = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    supports_completion = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    context_window = db.Column(db.Integer, nullable=True)  # 上下文长度（token）
+    owned_by = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -34,6 +79,10 @@ class Model(db.Model):
             'model_name': self.model_name,
             'description': self.description,
             'capabilities': self.capabilities,
+            'supports_chat': self.supports_chat,
+            'supports_completion': self.supports_completion,
+            'context_window': self.context_window,
+            'owned_by': self.owned_by,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -45,11 +94,8 @@ class Model(db.Model):
         """
         model = Model.query.filter_by(model_name=model_name).first()
         if not model:
-            model = Model(
-                model_name=model_name,
-                description=description,
-                capabilities=capabilities
-            )
+            model = Model(model_name=model_name, description=description)
+            model.set_capabilities(capabilities)
             db.session.add(model)
             db.session.commit()
         return model
@@ -61,6 +107,16 @@ class Model(db.Model):
         if description is not None:
             self.description = description
         if capabilities is not None:
-            self.capabilities = capabilities
+            self.set_capabilities(capabilities)
         self.updated_at = datetime.utcnow()
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+    
+    def set_capabilities(self, capabilities: Union[str, Dict[str, Any], None]):
+        """
+        设置模型能力，同时更新按列存储的能力字段
+        """
+        if isinstance(capabilities, dict):
+            capabilities = json.dumps(capabilities)
+        self.capabilities = capabilities
+        for name, value in capability_columns(parse_capabilities(capabilities)).items():
+            setattr(self, name, value)
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+数据库迁移记录模型
+"""
+
+from datetime import datetime
+from app import db
+
+class SchemaMigration(db.Model):
+    """
+    已执行的数据库迁移，每个迁移版本只执行一次
+    """
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}: {self.name}>'
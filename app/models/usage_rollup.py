@@ -0,0 +1,92 @@
+"""
+使用统计汇总数据模型
+"""
+
+from sqlalchemy.orm import declared_attr
+from app import db
+
+class UsageRollupMixin:
+    """
+    按时间桶、Key和模型汇总的使用统计
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)  # 时间桶起点（UTC）
+    key_id = db.Column(db.Integer, nullable=False)
+    model_id = db.Column(db.Integer, nullable=False, default=0)  # 0表示未知模型
+    request_count = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    total_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    # 小时和天级汇总的累加值会超过32位整数（毫秒累加约24.8天即溢出）
+    latency_ms_sum = db.Column(db.BigInteger, nullable=False, default=0)
+    cost_nanos = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # 费用（纳美元），整数累加保证精确
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            db.UniqueConstraint('bucket', 'key_id', 'model_id', name=f'uq_{cls.__tablename__}_bucket_key_model'),
+        )
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.bucket}: Key {self.key_id} - Model {self.model_id}>'
+
+    def to_dict(self):
+        """
+        转换为字典格式
+        """
+        return {
+            'bucket': self.bucket.isoformat() if self.bucket else None,
+            'key_id': self.key_id,
+            'model_id': self.model_id,
+            'request_count': self.request_count,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'error_count': self.error_count,
+            'latency_ms_sum': self.latency_ms_sum,
+            'cost_nanos': self.cost_nanos
+        }
+
+class UsageRollupMinute(UsageRollupMixin, db.Model):
+    """
+    分钟级使用统计汇总
+    """
+    __tablename__ = 'usage_rollup_minute'
+    granularity = 'minute'
+
+class UsageRollupHour(UsageRollupMixin, db.Model):
+    """
+    小时级使用统计汇总
+    """
+    __tablename__ = 'usage_rollup_hour'
+    granularity = 'hour'
+
+class UsageRollupDay(UsageRollupMixin, db.Model):
+    """
+    天级使用统计汇总（由小时级汇总合并而来，永久保留）
+    """
+    __tablename__ = 'usage_rollup_day'
+    granularity = 'day'
+
+# 汇总粒度与数据模型的对应关系，从细到粗
+ROLLUP_MODELS = {
+    'minute': UsageRollupMinute,
+    'hour': UsageRollupHour,
+    'day': UsageRollupDay
+}
+
+# 写入聊天历史时实时更新的汇总粒度，天级汇总由后台任务合并
+LIVE_GRANULARITIES = ('minute', 'hour')
+
+# 汇总表中的累加字段
+ROLLUP_METRICS = (
+    'request_count',
+    'prompt_tokens',
+    'completion_tokens',
+    'total_tokens',
+    'error_count',
+    'latency_ms_sum',
+    'cost_nanos'
+)
@@ -4,12 +4,18 @@
 
 from datetime import datetime
 from app import db
+from app.utils.pricing import format_cost
 
 class UsageStat(db.Model):
     """
     Key使用统计数据模型
     """
     __tablename__ = 'usage_stats'
+    __table_args__ = (
+        # 写入时按 (Key, 模型名称) 查找记录；统计查询按模型ID关联
+        db.Index('ix_usage_stats_key_id_model', 'key_id', 'model'),
+        db.Index('ix_usage_stats_model_id_key_id', 'model_id', 'key_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     key_id = db.Column(db.Integer, db.ForeignKey('keys.id'), nullable=False)
@@ -18,6 +24,9 @@ class UsageStat(db.Model):
     usage_count = db.Column(db.Integer, nullable=False, default=0)
     last_used = db.Column(db.DateTime, nullable=True)
     total_tokens = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    cost_nanos = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # 费用（纳美元）
     
     def __repr__(self):
         return f'<UsageStat {self.id}: Key {self.key_id} - {self.model}>'
@@ -33,7 +42,10 @@ class UsageStat(db.Model):
             'model': self.model,
             'usage_count': self.usage_count,
             'last_used': self.last_used.isoformat() if self.last_used else None,
-            'total_tokens': self.total_tokens
+            'total_tokens': self.total_tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost': format_cost(self.cost_nanos)
         }
     
     def update_usage(self, tokens_used=0):
@@ -55,4 +67,24 @@ class UsageStat(db.Model):
             stat = UsageStat(key_id=key_id, model=model, model_id=model_id)
             db.session.add(stat)
             db.session.commit()
-        return stat
\ No newline at end of file
+        return stat
+    
+    @staticmethod
+    def link_model_ids(connection=None):
+        """
+        按模型名称补齐尚未关联模型的记录的 model_id（不提交事务，由调用方统一提交）
+
+        使用统计先于模型记录写入时 model_id 为空，模型创建后调用以便统计查询按ID关联。
+        """
+        from app.models.model import Model
+        table = UsageStat.__table__
+        models = Model.__table__
+        result = (connection or db.session).execute(
+            table.update().where(
+                table.c.model_id.is_(None),
+                table.c.model.in_(db.select(models.c.model_name))
+            ).values(
+                model_id=db.select(models.c.id).where(models.c.model_name == table.c.model).scalar_subquery()
+            )
+        )
+        return result.rowcount
\ No newline at end of file
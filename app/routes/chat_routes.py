@@ -3,26 +3,41 @@
 """
 
 import logging
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, request, jsonify, Response, stream_with_context, g
 from app import db
-from app.models.key import Key
-from app.models.model import Model
-from app.models.usage_stats import UsageStat
+from app.utils.model_registry import model_registry
 from app.models.chat_history import ChatHistory
-from app.services.openai_service import openai_service
-from app.services.key_service import KeyService
+from app.services.model_router import model_router
+from app.services.drain_service import drain_service
+from app.services.history_writer import history_writer, latency_fields
+from app.services.request_log import request_logger, new_request_id
+from app.utils.tokenizer import StreamUsageTracker
 from app.utils.auth import login_required
+from app.utils.time_buckets import parse_time_param
+from app.services.export_service import ExportService, EXPORT_FORMATS, validate_format
+from app.services.chat_history_service import (
+    ChatHistoryService, CHAT_HISTORY_FIELDS, DEFAULT_LIST_FIELDS, DEFAULT_PAGE_SIZE, parse_fields, validate_status
+)
 import json
+import time
 
 # 创建蓝图
 bp = Blueprint('chat_routes', __name__)
 
+def _model_id(model_name):
+    """
+    获取实际使用的上游模型的ID，模型不在模型表中时返回None
+    """
+    entry = model_registry.get(model_name)
+    return entry.id if entry else None
+
 @bp.route('/api/chat', methods=['POST'])
 @login_required
 def chat():
     """
     聊天接口
     """
+    started = time.perf_counter()
     try:
         data = request.get_json()
         
@@ -35,21 +50,16 @@ def chat():
         model_name = data['model']
         messages = data['messages']
         
-        # 检查模型是否存在
-        model = Model.query.filter_by(model_name=model_name).first()
-        if not model:
+        # 检查模型是否存在，配置了别名路由的模型名称不需要在模型表中
+        model = model_registry.get(model_name)
+        if not model and not model_router.is_alias(model_name):
             return jsonify({
                 'success': False,
                 'message': f'模型 {model_name} 不存在'
             }), 400
         
-        # 创建聊天历史记录
-        chat_record = ChatHistory.create_record(
-            key_id=0,  # 先设置为0，后面更新
-            model=model_name,
-            model_id=model.id,
-            request=json.dumps(data)
-        )
+        # 聊天历史记录在请求结束后交给后台写入
+        request_json = json.dumps(data)
         
         # 获取额外参数
         temperature = data.get('temperature', 0.7)
@@ -57,7 +67,7 @@ def chat():
         
         # 调用OpenAI API
         try:
-            response_data = openai_service.chat_completion(
+            response_data = model_router.chat_completion(
                 messages=messages,
                 model=model_name,
                 temperature=temperature,
@@ -67,19 +77,31 @@ def chat():
             # 从OpenAI API响应中获取使用的Key信息
             key_info = response_data.get('_key_info')
             if key_info:
-                # 更新聊天历史记录中的Key ID
-                chat_record.key_id = key_info['id']
-                
-                # 更新聊天历史记录
-                chat_record.update_response(
+                # 记录聊天历史
+                usage = response_data.get('_usage', {})
+                served_model = response_data['_route']['model']
+                history_writer.submit_chat(
+                    key_id=key_info['id'],
+                    model=served_model,
+                    model_id=_model_id(served_model),
+                    request=request_json,
                     response=json.dumps(response_data),
-                    tokens_used=response_data.get('usage', {}).get('total_tokens', 0)
+                    tokens_used=usage.get('total_tokens', 0),
+                    prompt_tokens=usage.get('prompt_tokens', 0),
+                    completion_tokens=usage.get('completion_tokens', 0),
+                    **latency_fields(started, response_data.get('_timing'))
                 )
         except Exception as api_error:
             # 如果API调用失败，仍然记录聊天历史
-            chat_record.update_response(
+            history_writer.submit_chat(
+                key_id=0,
+                model=model_name,
+                model_id=model.id if model else None,
+                request=request_json,
                 response=json.dumps({'error': str(api_error)}),
-                tokens_used=0
+                tokens_used=0,
+                is_error=True,
+                **latency_fields(started)
             )
             
             # 重新抛出异常
@@ -100,14 +122,17 @@ def chat():
 def chat_completions():
     """
     OpenAI兼容的聊天完成接口
+
+    每个请求结束时输出一条汇总日志（见 app/services/request_log.py），响应头 X-Request-ID 为日志中的请求ID
     """
+    started = time.perf_counter()
+    g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+    summary = {'request_id': g.request_id, 'path': request.path}
     try:
-        logging.info("Received request for /v1/chat/completions")
         data = request.get_json()
-        logging.info(f"Request data: {data}")
         
         if not data or 'messages' not in data or 'model' not in data:
-            logging.warning("Missing required parameters: messages or model")
+            request_logger.log_request(started, **summary, status_code=400, error='missing_parameters')
             return jsonify({
                 'error': {
                     'message': 'Missing required parameters: messages or model',
@@ -119,11 +144,12 @@ def chat_completions():
         model_name = data['model']
         messages = data['messages']
         stream = data.get('stream', False)
+        summary.update(model=model_name, stream=bool(stream))
 
         # 检查模型是否存在
-        model = Model.query.filter_by(model_name=model_name).first()
-        if not model:
-            logging.warning(f"Model not found: {model_name}")
+        model = model_registry.get(model_name)
+        if not model and not model_router.is_alias(model_name):
+            request_logger.log_request(started, **summary, status_code=404, error='model_not_found')
             return jsonify({
                 'error': {
                     'message': f'Model {model_name} not found',
@@ -132,13 +158,8 @@ def chat_completions():
                 }
             }), 404
         
-        # 创建聊天历史记录
-        chat_record = ChatHistory.create_record(
-            key_id=0,  # 先设置为0，后面更新
-            model=model_name,
-            model_id=model.id,
-            request=json.dumps(data)
-        )
+        # 聊天历史记录在请求结束后交给后台写入
+        request_json = json.dumps(data)
         
         # 获取额外参数
         temperature = data.get('temperature', 0.7)
@@ -148,41 +169,90 @@ def chat_completions():
         presence_penalty = data.get('presence_penalty', 0)
         
         if stream:
-            logging.info("Streaming response requested")
+            # 客户端要求返回usage时透传给上游
+            stream_kwargs = {}
+            if data.get('stream_options'):
+                stream_kwargs['stream_options'] = data['stream_options']
+            tracker = StreamUsageTracker(model_name)
+            
             def generate():
                 is_empty = True
+                error = None
+                completed = False
                 try:
-                    for chunk in openai_service.stream_chat_completion(
-                        messages=messages,
-                        model=model_name,
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        top_p=top_p,
-                        frequency_penalty=frequency_penalty,
-                        presence_penalty=presence_penalty
-                    ):
-                        if chunk:
-                            is_empty = False
-                            logging.info(f"Streaming chunk: {chunk}")
-                            yield chunk
-                except Exception as e:
-                    logging.error(f"流式聊天请求失败: {e}")
-                    # 在流中返回错误信息
-                    error_message = json.dumps({'error': str(e)})
-                    yield f"data: {error_message}\n\n"
-                
-                if is_empty:
-                    logging.warning("Empty completion in streaming response")
-                    # 如果没有收到任何数据，则返回一个错误
-                    error_message = json.dumps({'error': 'Empty completion in streaming response'})
-                    yield f"data: {error_message}\n\n"
+                    try:
+                        for chunk in model_router.stream_chat_completion(
+                            messages=messages,
+                            model=model_name,
+                            tracker=tracker,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            top_p=top_p,
+                            frequency_penalty=frequency_penalty,
+                            presence_penalty=presence_penalty,
+                            **stream_kwargs
+                        ):
+                            if drain_service.cancelled:
+                                # 停机时超过排空时间的流在这里结束，finally 中记录已经转发的部分
+                                error = 'server_shutdown'
+                                yield f"data: {json.dumps({'error': 'Service is shutting down'})}\n\n"
+                                break
+                            if chunk:
+                                is_empty = False
+                                yield chunk
+                    except Exception as e:
+                        error = str(e)
+                        # 在流中返回错误信息
+                        error_message = json.dumps({'error': error})
+                        yield f"data: {error_message}\n\n"
+                    
+                    if is_empty:
+                        error = error or 'Empty completion in streaming response'
+                        # 如果没有收到任何数据，则返回一个错误
+                        error_message = json.dumps({'error': 'Empty completion in streaming response'})
+                        yield f"data: {error_message}\n\n"
+                    completed = True
+                finally:
+                    # 记录流式请求的聊天历史，客户端中途断开时也要写入；上游未返回usage时使用本地估算值
+                    usage = tracker.get_usage() if tracker.key_id else {}
+                    latency = latency_fields(started, {'upstream_ms': tracker.upstream_ms, 'ttfb_ms': tracker.ttfb_ms})
+                    # 没有上游目标接受请求时与非流式请求相同，记录客户端请求的模型（别名）
+                    served_model = tracker.model if tracker.key_id else None
+                    history_writer.submit_chat(
+                        key_id=tracker.key_id or 0,
+                        model=served_model or model_name,
+                        model_id=_model_id(served_model or model_name),
+                        request=request_json,
+                        tokens_used=usage.get('total_tokens', 0),
+                        prompt_tokens=usage.get('prompt_tokens', 0),
+                        completion_tokens=usage.get('completion_tokens', 0),
+                        is_error=error is not None,
+                        **latency
+                    )
+                    # 没有发送完就结束的流是客户端断开了连接，汇总日志中记录下来
+                    if not completed and error is None:
+                        error = 'client_disconnected'
+                    request_logger.log_request(
+                        started,
+                        **summary,
+                        request_body=request_json,
+                        status_code=200,
+                        key_id=tracker.key_id,
+                        served_model=served_model,
+                        alias=tracker.alias,
+                        attempts=tracker.attempts,
+                        prompt_tokens=usage.get('prompt_tokens', 0),
+                        completion_tokens=usage.get('completion_tokens', 0),
+                        total_tokens=usage.get('total_tokens', 0),
+                        error=error,
+                        **latency
+                    )
 
             return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
         # 调用OpenAI API
         try:
-            logging.info("Calling OpenAI API for chat completion")
-            response_data = openai_service.chat_completion(
+            response_data = model_router.chat_completion(
                 messages=messages,
                 model=model_name,
                 temperature=temperature,
@@ -191,37 +261,80 @@ def chat_completions():
                 frequency_penalty=frequency_penalty,
                 presence_penalty=presence_penalty
             )
-            logging.info(f"OpenAI API response: {response_data}")
             
             # 从OpenAI API响应中获取使用的Key信息
             key_info = response_data.get('_key_info')
+            usage = response_data.get('_usage', {})
+            route = response_data.get('_route', {})
+            response_json = json.dumps(response_data)
+            latency = latency_fields(started, response_data.get('_timing'))
             if key_info:
-                # 更新聊天历史记录中的Key ID
-                chat_record.key_id = key_info['id']
-                
-                # 更新聊天历史记录
-                chat_record.update_response(
-                    response=json.dumps(response_data),
-                    tokens_used=response_data.get('usage', {}).get('total_tokens', 0)
+                # 记录聊天历史
+                served_model = route['model']
+                history_writer.submit_chat(
+                    key_id=key_info['id'],
+                    model=served_model,
+                    model_id=_model_id(served_model),
+                    request=request_json,
+                    response=response_json,
+                    tokens_used=usage.get('total_tokens', 0),
+                    prompt_tokens=usage.get('prompt_tokens', 0),
+                    completion_tokens=usage.get('completion_tokens', 0),
+                    **latency
                 )
         except Exception as api_error:
-            logging.error(f"Error calling OpenAI API: {api_error}")
             # 如果API调用失败，仍然记录聊天历史
-            chat_record.update_response(
-                response=json.dumps({'error': str(api_error)}),
-                tokens_used=0
+            error_json = json.dumps({'error': str(api_error)})
+            latency = latency_fields(started)
+            history_writer.submit_chat(
+                key_id=0,
+                model=model_name,
+                model_id=model.id if model else None,
+                request=request_json,
+                response=error_json,
+                tokens_used=0,
+                is_error=True,
+                **latency
+            )
+            request_logger.log_request(
+                started, **summary, request_body=request_json, response_body=error_json,
+                status_code=500, error=str(api_error), **latency
             )
             
-            # 重新抛出异常
-            raise api_error
+            return jsonify({
+                'error': {
+                    'message': str(api_error),
+                    'type': 'api_error',
+                    'code': 'api_error'
+                }
+            }), 500
         
-        # 移除自定义的 _key_info 字段
-        if '_key_info' in response_data:
-            del response_data['_key_info']
+        request_logger.log_request(
+            started,
+            **summary,
+            request_body=request_json,
+            response_body=response_json,
+            status_code=200,
+            key_id=key_info['id'] if key_info else None,
+            served_model=route.get('model'),
+            alias=route.get('alias'),
+            attempts=route.get('attempts'),
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            total_tokens=usage.get('total_tokens', 0),
+            **latency
+        )
+
+        # 移除自定义的 _key_info、_usage、_timing 和 _route 字段
+        response_data.pop('_key_info', None)
+        response_data.pop('_usage', None)
+        response_data.pop('_timing', None)
+        response_data.pop('_route', None)
             
         return jsonify(response_data)
     except Exception as e:
         logging.error(f"Error in chat_completions: {e}")
+        request_logger.log_request(started, **summary, status_code=500, error=str(e))
         return jsonify({
             'error': {
                 'message': str(e),
@@ -230,31 +343,47 @@ def chat_completions():
             }
         }), 500
 
+@bp.after_request
+def add_request_id(response):
+    """
+    聊天完成接口的响应带上请求ID
+    """
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
 @bp.route('/api/chat/history', methods=['GET'])
 @login_required
 def get_chat_history():
     """
-    获取聊天历史记录
+    分页获取聊天历史记录
+
+    按时间倒序返回，cursor 为上一页返回的 next_cursor；key_id、model、start/end、status 可以任意组合。
+    默认不返回请求和响应内容，可以用 fields 指定返回的字段（逗号分隔）。
     """
     try:
-        # 获取查询参数
-        limit = request.args.get('limit', 50, type=int)
-        key_id = request.args.get('key_id', type=int)
-        model = request.args.get('model')
-        
-        if key_id:
-            # 根据Key获取聊天历史
-            history = ChatHistory.get_history_by_key(key_id, limit)
-        elif model:
-            # 根据模型获取聊天历史
-            history = ChatHistory.get_history_by_model(model, limit)
-        else:
-            # 获取最近的聊天历史
-            history = ChatHistory.get_recent_history(limit)
+        try:
+            history = ChatHistoryService.list_history(
+                limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+                cursor=request.args.get('cursor'),
+                fields=parse_fields(request.args.get('fields'), CHAT_HISTORY_FIELDS, DEFAULT_LIST_FIELDS),
+                start=parse_time_param(request.args.get('start')),
+                end=parse_time_param(request.args.get('end')),
+                key_id=request.args.get('key_id', type=int),
+                model=request.args.get('model'),
+                status=request.args.get('status')
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         return jsonify({
             'success': True,
-            'data': [record.to_dict() for record in history]
+            'data': history['items'],
+            'pagination': history['pagination']
         })
     except Exception as e:
         return jsonify({
@@ -262,6 +391,46 @@ def get_chat_history():
             'message': f'获取聊天历史失败: {str(e)}'
         }), 500
 
+@bp.route('/api/chat/history/export', methods=['GET'])
+@login_required
+def export_chat_history():
+    """
+    流式导出聊天历史（NDJSON或CSV）
+
+    过滤条件与聊天历史列表相同，fields 指定导出字段（逗号分隔，默认全部，包括请求和响应内容）
+    """
+    try:
+        try:
+            export_format = validate_format(request.args.get('format', 'ndjson'))
+            fields = parse_fields(request.args.get('fields'), CHAT_HISTORY_FIELDS)
+            start = parse_time_param(request.args.get('start'))
+            end = parse_time_param(request.args.get('end'))
+            status = validate_status(request.args.get('status'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        records = ExportService.iter_chat_history(
+            fields,
+            start=start,
+            end=end,
+            key_id=request.args.get('key_id', type=int),
+            model=request.args.get('model'),
+            status=status
+        )
+        return Response(
+            stream_with_context(ExportService.render(records, fields, export_format)),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename=chat_history.{export_format}'}
+        )
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'导出聊天历史失败: {str(e)}'
+        }), 500
+
 @bp.route('/api/chat/history/<int:history_id>', methods=['GET'])
 @login_required
 def get_chat_history_detail(history_id):
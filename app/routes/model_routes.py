@@ -3,52 +3,88 @@
 """
 
 import logging
-import time
-from flask import Blueprint, request, jsonify
+import calendar
+from typing import List
+from flask import Blueprint, Response, current_app, request, jsonify
 from app.services.model_service import ModelService
+from app.utils.model_registry import model_registry, ModelEntry
 from app.utils.auth import login_required
 
 # 创建蓝图
 bp = Blueprint('model_routes', __name__)
 
+def _trigger_refresh():
+    """
+    让后台任务从OpenAI API刷新模型列表
+    """
+    from app.services.maintenance_service import maintenance_scheduler
+    if not maintenance_scheduler.trigger('model_refresh'):
+        logging.info("Model refresh job is not enabled, skipping refresh")
+
+def v1_models_payload(entries: List[ModelEntry]) -> bytes:
+    """
+    生成 /v1/models 的响应体，created 使用模型的创建时间，内容不变时响应体逐字节相同
+
+    ASGI数据面也使用该函数，两种部署方式返回相同的响应体和ETag
+    """
+    return _dumps({
+        "object": "list",
+        "data": [
+            {
+                "id": entry.model_name,
+                "object": "model",
+                "created": calendar.timegm(entry.created_at.utctimetuple()) if entry.created_at else 0,
+                "owned_by": entry.owned_by or "openai"
+            }
+            for entry in entries
+        ]
+    })
+
+def _api_models_payload(entries: List[ModelEntry]) -> bytes:
+    """
+    生成 /api/models 的响应体
+    """
+    return _dumps({
+        "success": True,
+        "data": [
+            {
+                "id": entry.model_name,
+                "model_name": entry.model_name,
+                "description": entry.description or "",
+                "created_at": entry.created_at,
+                "updated_at": entry.updated_at
+            }
+            for entry in entries
+        ]
+    })
+
+def _dumps(data) -> bytes:
+    """
+    按 jsonify 的格式序列化响应体
+    """
+    return (current_app.json.dumps(data) + "\n").encode('utf-8')
+
+def _cached_response(name: str, build, cache_control: str) -> Response:
+    """
+    返回按模型版本缓存的响应体，客户端带相同的 If-None-Match 时返回 304
+    """
+    body, etag = model_registry.payload(name, build)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
 @bp.route('/v1/models', methods=['GET'])
 def get_v1_models():
     """
     获取所有模型列表 (OpenAI API格式)
     """
     try:
-        logging.info("Received request for /v1/models")
-        # 获取查询参数
-        refresh = request.args.get('refresh', 'false').lower() == 'true'
-        
-        if refresh:
-            logging.info("Refreshing models from OpenAI API")
-            # 从OpenAI API刷新模型列表并保存到数据库
-            try:
-                ModelService.refresh_models()
-                logging.info("Successfully refreshed models and saved to database")
-            except Exception as e:
-                logging.error(f"Failed to refresh models: {e}")
-                # 即使刷新失败，也返回数据库中的模型列表
-        
-        logging.info("Fetching models from database")
-        # 直接从数据库获取模型列表
-        models = ModelService.get_all_models()
+        if request.args.get('refresh', 'false').lower() == 'true':
+            # 只通知后台任务刷新，不阻塞当前请求，返回数据库中现有的模型列表
+            _trigger_refresh()
         
-        response_data = {
-            "object": "list",
-            "data": [
-                {
-                    "id": model.model_name,
-                    "object": "model",
-                    "created": int(time.time()),
-                    "owned_by": "openai"
-                }
-                for model in models
-            ]
-        }
-        logging.info(f"Returning {len(response_data['data'])} models")
-        return jsonify(response_data)
+        return _cached_response('v1_models', v1_models_payload, 'no-cache')
     except Exception as e:
         logging.error(f"Error getting models: {e}")
         return jsonify({
@@ -63,39 +99,11 @@ def get_api_models():
     获取所有模型列表 (前端适配格式)
     """
     try:
-        logging.info("Received request for /api/models")
-        # 获取查询参数
-        refresh = request.args.get('refresh', 'false').lower() == 'true'
-        
-        if refresh:
-            logging.info("Refreshing models from OpenAI API")
-            # 从OpenAI API刷新模型列表并保存到数据库
-            try:
-                ModelService.refresh_models()
-                logging.info("Successfully refreshed models and saved to database")
-            except Exception as e:
-                logging.error(f"Failed to refresh models: {e}")
-                # 即使刷新失败，也返回数据库中的模型列表
+        if request.args.get('refresh', 'false').lower() == 'true':
+            # 只通知后台任务刷新，不阻塞当前请求，返回数据库中现有的模型列表
+            _trigger_refresh()
         
-        logging.info("Fetching models from database")
-        # 直接从数据库获取模型列表
-        models = ModelService.get_all_models()
-        
-        response_data = {
-            "success": True,
-            "data": [
-                {
-                    "id": model.model_name,
-                    "model_name": model.model_name,
-                    "description": model.description or "",
-                    "created_at": model.created_at,
-                    "updated_at": model.updated_at
-                }
-                for model in models
-            ]
-        }
-        logging.info(f"Returning {len(response_data['data'])} models")
-        return jsonify(response_data)
+        return _cached_response('api_models', _api_models_payload, 'private, no-cache')
     except Exception as e:
         logging.error(f"Error getting models: {e}")
         return jsonify({
@@ -103,6 +111,55 @@ def get_api_models():
             'message': f'获取模型列表失败: {str(e)}'
         }), 500
 
+@bp.route('/api/models/routes', methods=['GET'])
+@login_required
+def get_model_routes():
+    """
+    获取模型别名路由表和各上游目标的熔断状态
+    """
+    try:
+        from app.services.model_router import model_router
+        return jsonify({
+            'success': True,
+            'data': model_router.get_status()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取模型路由表失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/models/refresh', methods=['POST'])
+@login_required
+def refresh_models():
+    """
+    立即从OpenAI API刷新模型列表，返回新增、更新和未变化的模型数
+    """
+    try:
+        from app.services.maintenance_service import maintenance_scheduler
+        if 'model_refresh' not in maintenance_scheduler.jobs:
+            return jsonify({
+                'success': True,
+                'data': ModelService.refresh_models()
+            })
+        
+        result = maintenance_scheduler.run_job('model_refresh')
+        if result is None:
+            return jsonify({
+                'success': False,
+                'message': maintenance_scheduler.jobs['model_refresh']['last_error'] or '其他进程正在执行维护任务'
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'刷新模型列表失败: {str(e)}'
+        }), 500
+
 @bp.route('/api/models/<string:model_name>', methods=['GET'])
 @login_required
 def get_model(model_name):
@@ -279,14 +336,8 @@ def get_chat_models():
         refresh = request.args.get('refresh', 'false').lower() == 'true'
         
         if refresh:
-            logging.info("Refreshing chat models from OpenAI API")
-            # 从OpenAI API刷新模型列表并保存到数据库
-            try:
-                ModelService.refresh_models()
-                logging.info("Successfully refreshed chat models and saved to database")
-            except Exception as e:
-                logging.error(f"Failed to refresh chat models: {e}")
-                # 即使刷新失败，也返回数据库中的模型列表
+            # 只通知后台任务刷新，不阻塞当前请求，返回数据库中现有的模型列表
+            _trigger_refresh()
         
         # 直接从数据库获取支持聊天的模型列表
         models = ModelService.get_chat_models()
@@ -2,8 +2,10 @@
 统计数据路由
 """
 
-from flask import Blueprint, request, jsonify
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app.services.stats_service import StatsService
+from app.utils.time_buckets import floor_datetime, validate_granularity, parse_time_param, GRANULARITY_DELTAS
 from app.utils.auth import login_required
 
 # 创建蓝图
@@ -67,14 +69,19 @@ def get_key_stats():
                     'message': 'Key不存在'
                 }), 404
         else:
-            # 获取所有Key的统计信息
-            from app.models.key import Key
-            keys = Key.query.all()
-            stats = []
-            for key in keys:
-                key_stat = StatsService.get_key_stats(key.id)
-                if key_stat:
-                    stats.append(key_stat)
+            # 分页获取所有Key的统计信息
+            try:
+                result = StatsService.get_all_key_stats(**_paging_params('id'))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 400
+            return jsonify({
+                'success': True,
+                'data': result['items'],
+                'pagination': result['pagination']
+            })
         
         return jsonify({
             'success': True,
@@ -86,6 +93,17 @@ def get_key_stats():
             'message': f'获取Key统计失败: {str(e)}'
         }), 500
 
+def _paging_params(default_sort):
+    """
+    读取分页和排序参数
+    """
+    return {
+        'page': request.args.get('page', 1, type=int),
+        'per_page': request.args.get('per_page', 50, type=int),
+        'sort': request.args.get('sort', default_sort),
+        'order': request.args.get('order', 'asc')
+    }
+
 @bp.route('/api/stats/models', methods=['GET'])
 @login_required
 def get_model_stats():
@@ -105,14 +123,19 @@ def get_model_stats():
                     'message': '模型不存在'
                 }), 404
         else:
-            # 获取所有模型的统计信息
-            from app.models.model import Model
-            models = Model.query.all()
-            stats = []
-            for model in models:
-                model_stat = StatsService.get_model_stats(model.model_name)
-                if model_stat:
-                    stats.append(model_stat)
+            # 分页获取所有模型的统计信息
+            try:
+                result = StatsService.get_all_model_stats(**_paging_params('id'))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 400
+            return jsonify({
+                'success': True,
+                'data': result['items'],
+                'pagination': result['pagination']
+            })
         
         return jsonify({
             'success': True,
@@ -143,4 +166,355 @@ def get_hourly_stats():
         return jsonify({
             'success': False,
             'message': f'获取每小时使用统计失败: {str(e)}'
-        }), 500
\ No newline at end of file
+        }), 500
+
+@bp.route('/api/stats/series', methods=['GET'])
+@login_required
+def get_usage_series():
+    """
+    获取任意时间范围和粒度的使用趋势
+
+    start/end为ISO格式的UTC时间；未指定start时使用hours或days表示最近一段时间
+    """
+    try:
+        granularity = request.args.get('granularity', 'hour')  # minute, hour, day
+        key_id = request.args.get('key_id', type=int)
+        model_name = request.args.get('model')
+        
+        try:
+            validate_granularity(granularity)
+            end = parse_time_param(request.args.get('end'))
+            if end is None:
+                end = floor_datetime(datetime.utcnow(), granularity) + GRANULARITY_DELTAS[granularity]
+            start = parse_time_param(request.args.get('start'))
+            if start is None:
+                hours = request.args.get('hours', type=int)
+                days = request.args.get('days', type=int)
+                start = end - (timedelta(days=days) if days else timedelta(hours=hours or 24))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        model_id = None
+        if model_name:
+            from app.utils.model_registry import model_registry
+            model = model_registry.get(model_name)
+            if not model:
+                return jsonify({
+                    'success': False,
+                    'message': '模型不存在'
+                }), 404
+            model_id = model.id
+        
+        try:
+            stats = StatsService.get_usage_series(start, end, granularity, key_id=key_id, model_id=model_id)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'data': stats
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取使用趋势失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/export/usage', methods=['GET'])
+@login_required
+def export_usage():
+    """
+    流式导出使用统计汇总（NDJSON或CSV），每行为一个 (时间桶, Key, 模型)
+
+    start/end为ISO格式的UTC时间；未指定start时使用hours或days表示最近一段时间
+    """
+    try:
+        from app.services.export_service import ExportService, USAGE_FIELDS, EXPORT_FORMATS, validate_format
+        
+        granularity = request.args.get('granularity', 'hour')  # minute, hour, day
+        key_id = request.args.get('key_id', type=int)
+        model_name = request.args.get('model')
+        
+        try:
+            export_format = validate_format(request.args.get('format', 'ndjson'))
+            validate_granularity(granularity)
+            end = parse_time_param(request.args.get('end'))
+            if end is None:
+                end = floor_datetime(datetime.utcnow(), granularity) + GRANULARITY_DELTAS[granularity]
+            start = parse_time_param(request.args.get('start'))
+            if start is None:
+                hours = request.args.get('hours', type=int)
+                days = request.args.get('days', type=int)
+                start = end - (timedelta(days=days) if days else timedelta(hours=hours or 24))
+            if start >= end:
+                raise ValueError("开始时间必须早于结束时间")
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        model_id = None
+        if model_name:
+            from app.utils.model_registry import model_registry
+            model = model_registry.get(model_name)
+            if not model:
+                return jsonify({
+                    'success': False,
+                    'message': '模型不存在'
+                }), 404
+            model_id = model.id
+        
+        records = ExportService.iter_usage(start, end, granularity, key_id=key_id, model_id=model_id)
+        return Response(
+            stream_with_context(ExportService.render(records, list(USAGE_FIELDS), export_format)),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename=usage_{granularity}.{export_format}'}
+        )
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'导出使用统计失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/latency', methods=['GET'])
+@login_required
+def get_latency_stats():
+    """
+    获取延迟百分位（p50/p95/p99），可按Key、模型过滤，group=key或model时按Key或模型分组
+    """
+    return _latency_response(request.args.get('group'))
+
+@bp.route('/api/stats/latency/keys', methods=['GET'])
+@login_required
+def get_key_latency_stats():
+    """
+    获取每个Key的延迟百分位
+    """
+    return _latency_response('key')
+
+@bp.route('/api/stats/latency/models', methods=['GET'])
+@login_required
+def get_model_latency_stats():
+    """
+    获取每个模型的延迟百分位
+    """
+    return _latency_response('model')
+
+def _latency_response(group):
+    """
+    解析时间范围和过滤参数并返回延迟统计
+
+    start/end为ISO格式的UTC时间；未指定start时使用hours表示最近一段时间（默认24小时），
+    结束时间对齐到小时，同一小时内的请求可以命中统计缓存
+    """
+    try:
+        key_id = request.args.get('key_id', type=int)
+        model_name = request.args.get('model')
+        
+        try:
+            end = parse_time_param(request.args.get('end'))
+            start = parse_time_param(request.args.get('start'))
+            if start is None:
+                hours = request.args.get('hours', 24, type=int)
+                start = (end or floor_datetime(datetime.utcnow(), 'hour') + timedelta(hours=1)) - timedelta(hours=hours)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        model_id = None
+        if model_name:
+            from app.utils.model_registry import model_registry
+            model = model_registry.get(model_name)
+            if not model:
+                return jsonify({
+                    'success': False,
+                    'message': '模型不存在'
+                }), 404
+            model_id = model.id
+        
+        try:
+            stats = StatsService.get_latency_stats(start, end, key_id=key_id, model_id=model_id, group=group)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'data': stats
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取延迟统计失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/prices', methods=['GET'])
+@login_required
+def get_model_prices():
+    """
+    获取当前使用的模型价格表
+    """
+    try:
+        from app.utils.pricing import price_table
+        return jsonify({
+            'success': True,
+            'data': price_table.to_dict()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取模型价格表失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/writer', methods=['GET'])
+@login_required
+def get_writer_stats():
+    """
+    获取历史记录写入队列状态
+    """
+    try:
+        from app.services.history_writer import history_writer
+        return jsonify({
+            'success': True,
+            'data': history_writer.get_metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取写入队列状态失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/request-log', methods=['GET'])
+@login_required
+def get_request_log_stats():
+    """
+    获取请求日志队列状态
+    """
+    try:
+        from app.services.request_log import request_logger
+        return jsonify({
+            'success': True,
+            'data': request_logger.get_metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取请求日志状态失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/tokenizer', methods=['GET'])
+@login_required
+def get_tokenizer_stats():
+    """
+    获取Token估算精度统计
+    """
+    try:
+        from app.utils.tokenizer import token_counter
+        return jsonify({
+            'success': True,
+            'data': token_counter.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取Token估算统计失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/maintenance', methods=['GET'])
+@login_required
+def get_maintenance_status():
+    """
+    获取后台维护任务状态和存储信息
+    """
+    try:
+        from app.services.maintenance_service import maintenance_scheduler, MaintenanceService
+        status = maintenance_scheduler.get_status()
+        status['storage'] = MaintenanceService.get_storage_info()
+        return jsonify({
+            'success': True,
+            'data': status
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取维护任务状态失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/maintenance/<job_name>', methods=['POST'])
+@login_required
+def run_maintenance_job(job_name):
+    """
+    立即执行一个维护任务
+    """
+    try:
+        from app.services.maintenance_service import maintenance_scheduler
+        if job_name not in maintenance_scheduler.jobs:
+            return jsonify({
+                'success': False,
+                'message': f'维护任务 {job_name} 不存在'
+            }), 404
+        
+        result = maintenance_scheduler.run_job(job_name)
+        if result is None:
+            return jsonify({
+                'success': False,
+                'message': maintenance_scheduler.jobs[job_name]['last_error'] or '其他进程正在执行维护任务'
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'执行维护任务失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/cache', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """
+    获取统计缓存命中情况
+    """
+    try:
+        from app.services.stats_cache import stats_cache
+        return jsonify({
+            'success': True,
+            'data': stats_cache.get_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取统计缓存状态失败: {str(e)}'
+        }), 500
+
+@bp.route('/api/stats/cache', methods=['DELETE'])
+@login_required
+def clear_cache():
+    """
+    清空统计缓存
+    """
+    try:
+        from app.services.stats_cache import stats_cache
+        stats_cache.clear()
+        return jsonify({
+            'success': True,
+            'message': '统计缓存已清空'
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'清空统计缓存失败: {str(e)}'
+        }), 500
@@ -0,0 +1,219 @@
+"""
+异步OpenAI API服务
+
+ASGI数据面使用的上游客户端：等待上游和转发流式响应时不占用线程，一个事件循环可以同时转发大量流。
+Key选择、额度预扣、token估算和使用统计与 OpenAIService 共用同一套实现，
+其中可能访问数据库的同步步骤在线程池中、在Flask应用上下文内执行。
+"""
+
+import os
+import time
+import asyncio
+from typing import Dict, Any, Optional, List, Tuple
+import anyio
+import httpx
+from app.config import Config
+from app.models.key import Key
+from app.services.openai_service import openai_service, UpstreamOverloadError
+from app.utils.key_rotation import key_rotation
+from app.utils.tokenizer import token_counter, StreamUsageTracker
+
+
+class AsyncOpenAIService:
+    """
+    异步OpenAI API服务类
+    """
+
+    def __init__(self, app=None):
+        """
+        初始化异步OpenAI API服务，HTTP客户端在第一次请求时创建
+        """
+        self.app = None
+        self.base_url = os.getenv('OPENAI_API_BASE_URL', 'https://api.openai.com/v1')
+        self.timeout = openai_service.timeout
+        self.max_retries = openai_service.max_retries
+        self.max_connections = Config.UPSTREAM_MAX_CONNECTIONS
+        self._client = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        绑定Flask应用，同步步骤在该应用的上下文中执行
+        """
+        self.app = app
+        self.base_url = app.config.get('OPENAI_API_BASE_URL', self.base_url)
+        self.max_connections = app.config.get('UPSTREAM_MAX_CONNECTIONS', self.max_connections)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        与上游共用的连接池
+        """
+        if self._client is None:
+            # httpx 默认最多100个连接，超出的流会排队等待连接
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=100)
+            self._client = httpx.AsyncClient(base_url=f"{self.base_url}/", timeout=self.timeout, limits=limits)
+        return self._client
+
+    async def aclose(self):
+        """
+        关闭HTTP客户端
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+        在线程池中、Flask应用上下文内执行同步函数
+        """
+        def call():
+            with self.app.app_context():
+                return func(*args, **kwargs)
+        return await anyio.to_thread.run_sync(call)
+
+    async def make_request(self, method: str, endpoint: str, data: Dict[str, Any] = None,
+                           key: Optional[Key] = None, stream: bool = False,
+                           timeout: Optional[float] = None, retry: bool = True) -> httpx.Response:
+        """
+        发送请求到OpenAI API，与 OpenAIService.make_request 的重试和错误处理相同
+
+        stream 为True时返回未读取响应体的响应，调用方负责关闭
+        """
+        headers = openai_service.get_headers(key.key_value) if key else {}
+        max_retries = self.max_retries if retry else 1
+
+        for attempt in range(max_retries):
+            try:
+                request = self.client.build_request(method.upper(), endpoint, headers=headers, json=data,
+                                                    timeout=timeout or self.timeout)
+                response = await self.client.send(request, stream=stream)
+            except httpx.HTTPError as e:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)  # 指数退避
+                    continue
+                reason = 'timeout' if isinstance(e, httpx.TimeoutException) else 'connection_error'
+                raise UpstreamOverloadError(f"请求失败: {str(e)}", reason)
+
+            if response.status_code == 200:
+                return response
+
+            await response.aread()
+            await response.aclose()
+            if response.status_code == 429:
+                # 请求频率限制，等待后重试
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)  # 指数退避
+                    continue
+                raise UpstreamOverloadError('请求频率限制', 'rate_limited')
+            error_info = response.json() if response.headers.get('content-type') == 'application/json' else response.text
+            await self.run_sync(openai_service.raise_for_status, response.status_code, error_info, key)
+
+        raise Exception("超过最大重试次数")
+
+    async def _prepare(self, messages: List[Dict[str, str]], model: str, max_tokens: Optional[int],
+                       key_pool: Optional[Tuple]) -> Tuple[Key, int, int]:
+        """
+        估算提示token并选择Key，返回 (Key, 提示token数, 预扣token数)
+        """
+        def prepare():
+            prompt_tokens = token_counter.count_messages(messages, model)
+            charged_tokens = prompt_tokens + (max_tokens or 0)
+            return openai_service.select_key(key_pool, charged_tokens), prompt_tokens, charged_tokens
+        return await self.run_sync(prepare)
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str,
+                              temperature: float = 0.7, max_tokens: int = 1000,
+                              key_pool: Optional[Tuple] = None, timeout: Optional[float] = None,
+                              **kwargs) -> Dict[str, Any]:
+        """
+        聊天完成，返回值与 OpenAIService.chat_completion 相同
+        """
+        try:
+            key, prompt_tokens, charged_tokens = await self._prepare(messages, model, max_tokens, key_pool)
+
+            data = {
+                'model': model,
+                'messages': messages,
+                'temperature': temperature,
+                'max_tokens': max_tokens
+            }
+            data.update(kwargs)
+
+            started = time.perf_counter()
+            try:
+                response = await self.make_request('POST', 'chat/completions', data=data, key=key,
+                                                   timeout=timeout, retry=key_pool is None)
+            except Exception:
+                key_rotation.reconcile_tokens(key.id, charged_tokens, 0)
+                raise
+
+            result = response.json()
+            upstream_ms = (time.perf_counter() - started) * 1000
+            result['_timing'] = {
+                'upstream_ms': upstream_ms,
+                'ttfb_ms': response.elapsed.total_seconds() * 1000
+            }
+            result['_key_info'] = {
+                'id': key.id,
+                'key_value': key.key_value
+            }
+            result['_usage'] = await self.run_sync(
+                openai_service.record_chat_usage, key, model, result, prompt_tokens, charged_tokens
+            )
+            return result
+        except UpstreamOverloadError as e:
+            raise UpstreamOverloadError(f"聊天请求失败: {str(e)}", e.reason)
+        except Exception as e:
+            raise Exception(f"聊天请求失败: {str(e)}")
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                     tracker: Optional[StreamUsageTracker] = None,
+                                     key_pool: Optional[Tuple] = None, timeout: Optional[float] = None, **kwargs):
+        """
+        流式聊天完成，与 OpenAIService.stream_chat_completion 相同，按收到的数据块逐个返回
+        """
+        try:
+            tracker = tracker or StreamUsageTracker(model)
+            key, tracker.prompt_estimate, charged_tokens = await self._prepare(
+                messages, model, kwargs.get('max_tokens'), key_pool
+            )
+
+            data = {
+                'model': model,
+                'messages': messages,
+                'stream': True
+            }
+            data.update(kwargs)
+
+            started = time.perf_counter()
+            try:
+                response = await self.make_request('POST', 'chat/completions', data=data, key=key, stream=True,
+                                                   timeout=timeout, retry=key_pool is None)
+            except Exception:
+                key_rotation.reconcile_tokens(key.id, charged_tokens, 0)
+                raise
+            # 上游接受请求后才把用量记到这个Key上
+            tracker.key_id = key.id
+
+            try:
+                async for chunk in response.aiter_raw():
+                    if tracker.ttfb_ms is None:
+                        tracker.ttfb_ms = (time.perf_counter() - started) * 1000
+                    tracker.feed(chunk)
+                    yield chunk
+            finally:
+                # 客户端中途断开时也记录已产生的用量，不受取消影响
+                tracker.upstream_ms = (time.perf_counter() - started) * 1000
+                with anyio.CancelScope(shield=True):
+                    await response.aclose()
+                    await self.run_sync(openai_service.record_stream_usage, key, model, tracker, charged_tokens)
+        except UpstreamOverloadError as e:
+            raise UpstreamOverloadError(f"流式聊天请求失败: {str(e)}", e.reason)
+        except Exception as e:
+            raise Exception(f"流式聊天请求失败: {str(e)}")
+
+# 全局异步OpenAI服务实例
+async_openai_service = AsyncOpenAIService()
@@ -0,0 +1,201 @@
+"""
+聊天历史查询服务
+
+列表按 (timestamp, id) 倒序做键集分页：游标记录上一页最后一行的位置，
+下一页直接从该位置继续扫描，翻到多深都不需要OFFSET跳过前面的行。
+列表默认不返回请求和响应内容，需要时通过 fields 指定或查询单条详情。
+"""
+
+import json
+import base64
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy import select, and_, or_
+from app import db
+from app.models.chat_history import ChatHistory
+from app.utils.pricing import format_cost
+from app.utils.db_routing import read_only
+
+# 分页大小
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 请求状态过滤
+HISTORY_STATUSES = ('success', 'error')
+
+
+def _isoformat(value):
+    """
+    时间字段输出为ISO格式
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.isoformat()
+
+
+def _cost(value):
+    """
+    费用字段输出为美元金额字符串
+    """
+    return format_cost(value) if value is not None else None
+
+
+# 聊天历史可查询的字段: 字段名 -> (列, 输出转换)
+CHAT_HISTORY_FIELDS = {
+    'id': (ChatHistory.id, None),
+    'timestamp': (ChatHistory.timestamp, _isoformat),
+    'key_id': (ChatHistory.key_id, None),
+    'model_id': (ChatHistory.model_id, None),
+    'model': (ChatHistory.model, None),
+    'tokens_used': (ChatHistory.tokens_used, None),
+    'prompt_tokens': (ChatHistory.prompt_tokens, None),
+    'completion_tokens': (ChatHistory.completion_tokens, None),
+    'cost': (ChatHistory.cost_nanos, _cost),
+    'is_error': (ChatHistory.is_error, None),
+    'request': (ChatHistory.request, None),
+    'response': (ChatHistory.response, None)
+}
+
+# 内容字段，列表默认不返回
+BODY_FIELDS = ('request', 'response')
+
+# 列表默认返回的字段
+DEFAULT_LIST_FIELDS = tuple(name for name in CHAT_HISTORY_FIELDS if name not in BODY_FIELDS)
+
+
+def parse_fields(value: Optional[str], available, default=None) -> List[str]:
+    """
+    解析逗号分隔的字段列表，未指定时使用默认字段
+    """
+    if not value:
+        return list(default or available)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ValueError(f"不支持的字段: {', '.join(unknown)}，可选字段: {', '.join(available)}")
+    return fields
+
+
+def validate_status(status: Optional[str]) -> Optional[str]:
+    """
+    校验请求状态过滤参数
+    """
+    if status is not None and status not in HISTORY_STATUSES:
+        raise ValueError(f"不支持的状态: {status}，可选值: {', '.join(HISTORY_STATUSES)}")
+    return status
+
+
+class ChatHistoryService:
+    """
+    聊天历史查询服务类
+    """
+
+    @staticmethod
+    def filter_conditions(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          key_id: Optional[int] = None, model: Optional[str] = None,
+                          status: Optional[str] = None) -> List[Any]:
+        """
+        构造过滤条件，各条件可以任意组合
+        """
+        validate_status(status)
+        conditions = []
+        if start is not None:
+            conditions.append(ChatHistory.timestamp >= start)
+        if end is not None:
+            conditions.append(ChatHistory.timestamp < end)
+        if key_id is not None:
+            conditions.append(ChatHistory.key_id == key_id)
+        if model:
+            conditions.append(ChatHistory.model == model)
+        if status is not None:
+            conditions.append(ChatHistory.is_error.is_(status == 'error'))
+        return conditions
+
+    @staticmethod
+    def select_fields(fields: List[str]):
+        """
+        只查询需要的字段，id和timestamp总是查询（分页游标需要）
+        """
+        columns = [CHAT_HISTORY_FIELDS[name][0].label(name) for name in fields if name not in ('id', 'timestamp')]
+        return select(ChatHistory.id.label('id'), ChatHistory.timestamp.label('timestamp'), *columns)
+
+    @staticmethod
+    def to_record(row, fields: List[str]) -> Dict[str, Any]:
+        """
+        把查询结果行转换为输出字典
+        """
+        mapping = row._mapping
+        record = {}
+        for name in fields:
+            convert = CHAT_HISTORY_FIELDS[name][1]
+            record[name] = convert(mapping[name]) if convert else mapping[name]
+        return record
+
+    @staticmethod
+    def encode_cursor(timestamp: datetime, history_id: int) -> str:
+        """
+        把一行的位置编码为不透明的游标
+        """
+        raw = json.dumps([_isoformat(timestamp), history_id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """
+        解析游标，返回 (timestamp, id)
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            timestamp, history_id = json.loads(raw)
+            return datetime.fromisoformat(timestamp), int(history_id)
+        except (ValueError, TypeError):
+            raise ValueError("无效的分页游标")
+
+    @staticmethod
+    def list_query(limit: int, cursor: Optional[str], fields: List[str], **filters):
+        """
+        构造一页聊天历史的查询语句，多取一行用于判断是否还有下一页
+        """
+        stmt = ChatHistoryService.select_fields(fields)
+        conditions = ChatHistoryService.filter_conditions(**filters)
+        if cursor:
+            timestamp, history_id = ChatHistoryService.decode_cursor(cursor)
+            conditions.append(or_(
+                ChatHistory.timestamp < timestamp,
+                and_(ChatHistory.timestamp == timestamp, ChatHistory.id < history_id)
+            ))
+        if conditions:
+            stmt = stmt.where(*conditions)
+        return stmt.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit + 1)
+
+    @staticmethod
+    @read_only
+    def list_history(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                     fields: Optional[List[str]] = None, **filters) -> Dict[str, Any]:
+        """
+        按时间倒序分页查询聊天历史
+
+        返回的 next_cursor 传给下一次请求即可继续翻页。
+        """
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"limit 必须在 1 到 {MAX_PAGE_SIZE} 之间")
+        fields = list(fields or DEFAULT_LIST_FIELDS)
+
+        rows = db.session.execute(ChatHistoryService.list_query(limit, cursor, fields, **filters)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = ChatHistoryService.encode_cursor(last.timestamp, last.id)
+
+        return {
+            'items': [ChatHistoryService.to_record(row, fields) for row in rows],
+            'pagination': {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }
+        }
@@ -0,0 +1,178 @@
+"""
+费用回填服务
+
+升级前写入的聊天历史只有总token数。回填时从保存的响应内容中解析上游返回的usage，
+补齐输入输出token和费用；响应中没有usage的记录（例如流式请求）用请求内容估算输入token。
+聊天历史补齐后再重建使用统计汇总表，并补齐Key和模型的累计费用。
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from sqlalchemy import bindparam, func, or_
+from app import db
+from app.models.chat_history import ChatHistory
+from app.models.usage_stats import UsageStat
+from app.models.data_version import DataVersion, STATS_VERSION
+from app.services.rollup_service import RollupService
+from app.utils.pricing import price_table
+from app.utils.tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+# 每批回填的主键范围
+COST_BACKFILL_CHUNK_SIZE = 1000
+
+class CostService:
+    """
+    费用回填服务类
+    """
+
+    @staticmethod
+    def extract_usage(response: Optional[str]) -> Optional[Tuple[int, int]]:
+        """
+        从保存的响应内容中解析上游返回的 (输入token, 输出token)
+        """
+        if not response:
+            return None
+        try:
+            usage = json.loads(response).get('usage')
+        except (ValueError, AttributeError):
+            return None
+        if not isinstance(usage, dict):
+            return None
+        return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+
+    @staticmethod
+    def estimate_split(request: Optional[str], model: str, tokens_used: int) -> Tuple[int, int]:
+        """
+        响应中没有usage时，用请求内容估算输入token，其余计为输出token
+        """
+        prompt_tokens = 0
+        try:
+            messages = json.loads(request or '{}').get('messages')
+            if messages:
+                prompt_tokens = token_counter.count_messages(messages, model)
+        except (ValueError, AttributeError, TypeError):
+            pass
+        prompt_tokens = min(prompt_tokens, tokens_used or 0)
+        return prompt_tokens, (tokens_used or 0) - prompt_tokens
+
+    @staticmethod
+    def backfill_history(since: Optional[datetime] = None, reprice: bool = False,
+                         chunk_size: int = COST_BACKFILL_CHUNK_SIZE) -> Dict[str, int]:
+        """
+        按主键范围分批补齐聊天历史的输入输出token和费用
+
+        默认只处理尚未拆分或尚未计费的记录；reprice=True 时按当前价格表重新计算所有记录的费用。
+        """
+        report = {'scanned': 0, 'from_response': 0, 'estimated': 0, 'repriced': 0}
+        query = db.session.query(func.min(ChatHistory.id), func.max(ChatHistory.id))
+        if since is not None:
+            query = query.filter(ChatHistory.timestamp >= since)
+        min_id, max_id = query.first()
+        if min_id is None:
+            return report
+
+        table = ChatHistory.__table__
+        update = table.update().where(table.c.id == bindparam('b_id')).values(
+            prompt_tokens=bindparam('b_prompt_tokens'),
+            completion_tokens=bindparam('b_completion_tokens'),
+            cost_nanos=bindparam('b_cost_nanos')
+        )
+
+        for chunk_start in range(min_id, max_id + 1, chunk_size):
+            rows = db.session.query(
+                ChatHistory.id, ChatHistory.model, ChatHistory.request, ChatHistory.response,
+                ChatHistory.tokens_used, ChatHistory.prompt_tokens, ChatHistory.completion_tokens
+            ).filter(
+                ChatHistory.id >= chunk_start,
+                ChatHistory.id < chunk_start + chunk_size
+            )
+            if since is not None:
+                rows = rows.filter(ChatHistory.timestamp >= since)
+            if not reprice:
+                rows = rows.filter(or_(ChatHistory.prompt_tokens.is_(None), ChatHistory.cost_nanos.is_(None)))
+
+            params = []
+            for row in rows.all():
+                report['scanned'] += 1
+                if row.prompt_tokens is not None:
+                    split = (row.prompt_tokens, row.completion_tokens or 0)
+                    report['repriced'] += 1
+                else:
+                    split = CostService.extract_usage(row.response)
+                    if split is not None:
+                        report['from_response'] += 1
+                    else:
+                        split = CostService.estimate_split(row.request, row.model, row.tokens_used)
+                        report['estimated'] += 1
+                params.append({
+                    'b_id': row.id,
+                    'b_prompt_tokens': split[0],
+                    'b_completion_tokens': split[1],
+                    'b_cost_nanos': price_table.cost_nanos(row.model, *split)
+                })
+
+            if params:
+                db.session.execute(update, params)
+                DataVersion.bump(STATS_VERSION)
+                db.session.commit()
+
+        logger.info(f"聊天历史费用回填完成: {report}")
+        return report
+
+    @staticmethod
+    def backfill_usage_stats() -> int:
+        """
+        用聊天历史补齐尚未记录输入输出拆分的Key和模型累计统计
+        """
+        totals = db.session.query(
+            ChatHistory.key_id,
+            ChatHistory.model,
+            func.coalesce(func.sum(ChatHistory.prompt_tokens), 0).label('prompt_tokens'),
+            func.coalesce(func.sum(ChatHistory.completion_tokens), 0).label('completion_tokens'),
+            func.coalesce(func.sum(ChatHistory.cost_nanos), 0).label('cost_nanos')
+        ).group_by(ChatHistory.key_id, ChatHistory.model).all()
+        totals = {(item.key_id, item.model): item for item in totals}
+
+        params = []
+        for stat in UsageStat.query.filter(
+            UsageStat.prompt_tokens == 0,
+            UsageStat.completion_tokens == 0,
+            UsageStat.cost_nanos == 0
+        ).all():
+            item = totals.get((stat.key_id, stat.model))
+            if item is None:
+                continue
+            params.append({
+                'b_id': stat.id,
+                'b_prompt_tokens': item.prompt_tokens,
+                'b_completion_tokens': item.completion_tokens,
+                'b_cost_nanos': item.cost_nanos
+            })
+
+        if params:
+            table = UsageStat.__table__
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    prompt_tokens=bindparam('b_prompt_tokens'),
+                    completion_tokens=bindparam('b_completion_tokens'),
+                    cost_nanos=bindparam('b_cost_nanos')
+                ),
+                params
+            )
+            DataVersion.bump(STATS_VERSION)
+            db.session.commit()
+        return len(params)
+
+    @staticmethod
+    def backfill(since: Optional[datetime] = None, reprice: bool = False) -> Dict[str, Any]:
+        """
+        回填聊天历史费用，然后重建汇总表并补齐累计统计
+        """
+        report = {'history': CostService.backfill_history(since=since, reprice=reprice)}
+        report['rollups'] = RollupService.backfill(since=since)
+        report['usage_stats'] = CostService.backfill_usage_stats()
+        return report
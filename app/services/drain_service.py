@@ -0,0 +1,179 @@
+"""
+优雅停机服务
+
+收到SIGTERM后进入排空状态：不再处理新请求（返回503，负载均衡可以换到其他实例重试），
+等待正在进行的请求和流式响应在 DRAIN_TIMEOUT 内完成；超时仍未结束的流式响应在下一个数据块时停止，
+记录已转发部分的历史后结束，然后写完历史记录和使用统计队列、停止后台线程，最后退出进程。
+
+gunicorn 和 uvicorn 自己负责停止接受连接和等待正在进行的请求，只需要在worker退出时调用 shutdown；
+Flask自带的服务器由 app/main.py 的信号处理函数调用 drain 和 shutdown。
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+from werkzeug.wsgi import ClosingIterator
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 停机时等待被停止的流式响应记录历史的时间（秒）
+STREAM_CANCEL_TIMEOUT = 5
+
+
+class InFlightMiddleware:
+    """
+    统计正在进行的请求的WSGI中间件
+
+    响应体迭代完（流式响应发送完或客户端断开）才算请求结束；排空期间新请求直接返回503
+    """
+
+    def __init__(self, wsgi_app, service: 'DrainService'):
+        self.wsgi_app = wsgi_app
+        self.service = service
+
+    def __call__(self, environ, start_response):
+        if not self.service.request_started():
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Retry-After', '1'),
+                ('Connection', 'close')
+            ])
+            return [b'{"error": {"message": "Service is shutting down", "type": "service_unavailable", "code": "draining"}}']
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.service.request_finished()
+            raise
+        return ClosingIterator(iterable, self.service.request_finished)
+
+
+class DrainService:
+    """
+    优雅停机服务类
+    """
+
+    def __init__(self, app=None):
+        """
+        初始化优雅停机服务
+        """
+        self.timeout = Config.DRAIN_TIMEOUT
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._draining = False
+        self._cancelled = False
+        self._stopped = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        绑定Flask应用，统计经过该应用的请求
+        """
+        self.timeout = app.config.get('DRAIN_TIMEOUT', self.timeout)
+        app.wsgi_app = InFlightMiddleware(app.wsgi_app, self)
+
+    @property
+    def draining(self) -> bool:
+        """
+        是否处于排空状态
+        """
+        return self._draining
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        正在进行的流式响应是否应该停止
+        """
+        return self._cancelled
+
+    def request_started(self) -> bool:
+        """
+        记录一个新请求，排空期间返回False
+        """
+        with self._condition:
+            if self._draining:
+                return False
+            self._in_flight += 1
+            return True
+
+    def request_finished(self):
+        """
+        记录一个请求结束
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def track(self):
+        """
+        统计一个不经过 InFlightMiddleware 的请求（ASGI的流式响应），shutdown 会等待它结束
+        """
+        with self._condition:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            self.request_finished()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        进入排空状态并等待正在进行的请求完成，返回是否在超时前全部完成
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._draining = True
+            while self._in_flight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"等待 {timeout} 秒后仍有 {self._in_flight} 个请求未完成")
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def cancel(self, timeout: float = STREAM_CANCEL_TIMEOUT) -> bool:
+        """
+        通知正在进行的流式响应停止，等待它们记录历史后结束，返回是否在超时前全部结束
+        """
+        self._cancelled = True
+        return self.drain(timeout)
+
+    def shutdown(self):
+        """
+        停止后台线程，写完队列中剩余的历史记录、使用统计和请求日志（只执行一次）
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+
+        # 排空超时后仍在进行的流式响应提交的历史记录也要写入，先让它们结束
+        self.cancel()
+
+        from app.services.heartbeat_service import heartbeat_service
+        from app.services.history_writer import history_writer
+        from app.services.maintenance_service import maintenance_scheduler
+        from app.services.request_log import request_logger
+
+        heartbeat_service.stop()
+        history_writer.stop()
+        maintenance_scheduler.stop()
+        request_logger.stop()
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        获取排空状态
+        """
+        return {
+            'draining': self._draining,
+            'cancelled': self._cancelled,
+            'in_flight': self._in_flight
+        }
+
+# 全局优雅停机服务实例
+drain_service = DrainService()
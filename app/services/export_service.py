@@ -0,0 +1,208 @@
+"""
+数据导出服务
+
+聊天历史和使用统计按行从数据库读出、逐行编码为NDJSON或CSV并以生成器返回，
+导出任意行数时内存占用都只与批大小有关。
+
+PostgreSQL/MySQL 使用服务端游标一次读完；SQLite 按主键分批读取，
+每批之后释放连接，长时间导出不会一直持有读锁而阻塞历史记录写入。
+"""
+
+import io
+import csv
+import json
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterator, Callable
+from sqlalchemy import select, func
+from app import db
+from app.models.chat_history import ChatHistory
+from app.models.usage_rollup import ROLLUP_MODELS, ROLLUP_METRICS
+from app.services.rollup_service import RollupService
+from app.services.chat_history_service import ChatHistoryService
+from app.utils.pricing import format_cost
+from app.utils.db_routing import read_only_queries
+from app.utils.time_buckets import floor_datetime, bucket_expression, parse_bucket
+
+# 支持的导出格式及响应类型
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# 每批读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+# 输出缓冲达到该长度（字符）时交给响应发送
+EXPORT_CHUNK_CHARS = 64 * 1024
+
+
+def _isoformat(value):
+    """
+    时间字段输出为ISO格式
+    """
+    if value is None:
+        return None
+    return parse_bucket(value).isoformat()
+
+
+# 使用统计导出的字段
+USAGE_FIELDS = ('bucket', 'key_id', 'model_id') + tuple(name for name in ROLLUP_METRICS if name != 'cost_nanos') + ('cost',)
+
+
+def validate_format(export_format: str) -> str:
+    """
+    校验导出格式
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}，可选格式: {', '.join(EXPORT_FORMATS)}")
+    return export_format
+
+
+class ExportService:
+    """
+    数据导出服务类
+    """
+
+    @staticmethod
+    def iter_rows(stmt, id_column, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+        """
+        按主键顺序逐行读取查询结果（走只读引擎）
+        """
+        if db.session.get_bind().dialect.name != 'sqlite':
+            # 服务端游标，每次只取一批到内存
+            with read_only_queries():
+                result = db.session.execute(
+                    stmt.order_by(id_column).execution_options(stream_results=True, yield_per=batch_size)
+                )
+            yield from result
+            return
+
+        last_id = None
+        while True:
+            page = stmt if last_id is None else stmt.where(id_column > last_id)
+            with read_only_queries():
+                rows = db.session.execute(page.order_by(id_column).limit(batch_size)).all()
+            # 每批结束后释放连接，不在两批之间持有SQLite读锁
+            db.session.close()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
+    @staticmethod
+    def iter_chat_history(fields: List[str], **filters) -> Iterator[Dict[str, Any]]:
+        """
+        逐行读取聊天历史，只查询需要导出的字段，过滤条件与聊天历史列表相同
+        """
+        stmt = ChatHistoryService.select_fields(fields)
+        conditions = ChatHistoryService.filter_conditions(**filters)
+        if conditions:
+            stmt = stmt.where(*conditions)
+        for row in ExportService.iter_rows(stmt, ChatHistory.id):
+            yield ChatHistoryService.to_record(row, fields)
+
+    @staticmethod
+    def iter_usage(start: datetime, end: datetime, granularity: str = 'hour', key_id: Optional[int] = None,
+                   model_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        逐行读取使用统计汇总，每行为一个 (时间桶, Key, 模型)
+
+        天粒度中尚未合并到天级汇总的部分从小时级汇总按天聚合补齐。
+        参数由调用方在开始输出前校验。
+        """
+        def apply_filters(stmt, rollup_model):
+            if key_id is not None:
+                stmt = stmt.where(rollup_model.key_id == key_id)
+            if model_id is not None:
+                stmt = stmt.where(rollup_model.model_id == model_id)
+            return stmt
+
+        def to_record(mapping):
+            record = {name: mapping[name] for name in USAGE_FIELDS if name not in ('bucket', 'cost')}
+            record['bucket'] = _isoformat(mapping['bucket'])
+            record['cost'] = format_cost(mapping['cost_nanos'])
+            return {name: record[name] for name in USAGE_FIELDS}
+
+        rollup_model = ROLLUP_MODELS[granularity]
+        range_end = end
+        tail_start = None
+        if granularity == 'day':
+            merged_until = RollupService.get_merged_until() or floor_datetime(start, 'day')
+            range_end = min(end, merged_until)
+            tail_start = max(floor_datetime(start, 'day'), merged_until)
+
+        stmt = apply_filters(select(
+            rollup_model.id.label('id'),
+            rollup_model.bucket.label('bucket'),
+            rollup_model.key_id.label('key_id'),
+            rollup_model.model_id.label('model_id'),
+            *[getattr(rollup_model, name).label(name) for name in ROLLUP_METRICS]
+        ).where(
+            rollup_model.bucket >= floor_datetime(start, granularity),
+            rollup_model.bucket < range_end
+        ), rollup_model)
+        for row in ExportService.iter_rows(stmt, rollup_model.id):
+            yield to_record(row._mapping)
+
+        if tail_start is not None and tail_start < end:
+            hour_model = ROLLUP_MODELS['hour']
+            dialect_name = db.session.get_bind().dialect.name
+            bucket = bucket_expression(hour_model.bucket, 'day', dialect_name).label('bucket')
+            stmt = apply_filters(select(
+                bucket,
+                hour_model.key_id.label('key_id'),
+                hour_model.model_id.label('model_id'),
+                *[func.sum(getattr(hour_model, name)).label(name) for name in ROLLUP_METRICS]
+            ).where(
+                hour_model.bucket >= tail_start,
+                hour_model.bucket < end
+            ), hour_model).group_by(bucket, hour_model.key_id, hour_model.model_id).order_by(bucket)
+            with read_only_queries():
+                result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            for row in result:
+                yield to_record(row._mapping)
+
+    @staticmethod
+    def render(records: Iterator[Dict[str, Any]], fields: List[str], export_format: str) -> Iterator[str]:
+        """
+        把记录编码为NDJSON或CSV文本块
+        """
+        encode = ExportService._csv_encoder(fields) if export_format == 'csv' else ExportService._ndjson_encoder()
+        buffer = []
+        size = 0
+        for text in encode(records):
+            buffer.append(text)
+            size += len(text)
+            if size >= EXPORT_CHUNK_CHARS:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer)
+
+    @staticmethod
+    def _ndjson_encoder() -> Callable[[Iterator[Dict[str, Any]]], Iterator[str]]:
+        """
+        每条记录编码为一行JSON
+        """
+        def encode(records):
+            for record in records:
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        return encode
+
+    @staticmethod
+    def _csv_encoder(fields: List[str]) -> Callable[[Iterator[Dict[str, Any]]], Iterator[str]]:
+        """
+        第一行为表头，之后每条记录一行CSV
+        """
+        def encode(records):
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(fields)
+            for record in records:
+                writer.writerow(['' if record[name] is None else record[name] for name in fields])
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+            yield output.getvalue()
+        return encode
@@ -455,7 +455,7 @@ class HeartbeatService:
             # 在新线程中执行重启，避免阻塞当前线程
             def restart_in_thread():
                 try:
-                    # 给当前进程发送SIGTERM信号，优雅地关闭
+                    # 给当前进程发送SIGTERM信号，等正在进行的请求完成后优雅地关闭（gunicorn会重新启动worker）
                     if os.name == 'nt':  # Windows
                         # Windows下使用taskkill命令
                         subprocess.run(['taskkill', '/F', '/PID', str(pid)], check=True)
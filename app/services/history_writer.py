@@ -0,0 +1,594 @@
+"""
+历史记录异步写入服务
+
+请求线程只负责把聊天历史和使用统计事件放入有界队列，
+由后台写入线程批量写入数据库。
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy.exc import DBAPIError, OperationalError
+from app import db
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 队列满时的处理策略
+OVERFLOW_BLOCK = 'block'  # 阻塞等待，超时后丢弃
+OVERFLOW_DROP_METADATA = 'drop_metadata'  # 丢弃聊天历史事件，使用统计事件仍然阻塞等待
+OVERFLOW_SPILL = 'spill'  # 写入本地溢出文件，稍后回放
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_METADATA, OVERFLOW_SPILL)
+
+# 事件类型
+EVENT_CHAT = 'chat'  # 聊天历史记录（请求/响应内容）
+EVENT_USAGE = 'usage'  # Key和模型使用统计
+
+_STOP = object()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    是否为可以重试的临时数据库错误：SQLite数据库被锁定（清理和压缩期间）或连接失效
+    """
+    if isinstance(error, OperationalError):
+        message = str(error.orig or error).lower()
+        if 'locked' in message or 'busy' in message:
+            return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def latency_fields(started: float, timing: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    计算写入聊天历史的延迟字段：上游总耗时、上游首字节耗时和代理自身耗时
+
+    started 为请求开始时的 time.perf_counter()，timing 为上游耗时（upstream_ms、ttfb_ms）
+    """
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not timing or timing.get('upstream_ms') is None:
+        return {'latency_ms': elapsed_ms}
+    return {
+        'latency_ms': timing['upstream_ms'],
+        'ttfb_ms': timing.get('ttfb_ms'),
+        'overhead_ms': max(elapsed_ms - timing['upstream_ms'], 0)
+    }
+
+
+class HistoryWriter:
+    """
+    历史记录批量写入器
+    """
+
+    def __init__(self, app=None):
+        """
+        初始化写入器
+        """
+        self.app = None
+        self.maxsize = Config.HISTORY_QUEUE_MAXSIZE
+        self.batch_size = Config.HISTORY_BATCH_SIZE
+        self.flush_interval = Config.HISTORY_FLUSH_INTERVAL
+        self.overflow_policy = Config.HISTORY_OVERFLOW_POLICY
+        self.block_timeout = Config.HISTORY_BLOCK_TIMEOUT
+        self.spill_path = Config.HISTORY_SPILL_PATH
+        self.drain_timeout = Config.HISTORY_DRAIN_TIMEOUT
+        self.write_retries = Config.HISTORY_WRITE_RETRIES
+        self.retry_backoff = Config.HISTORY_RETRY_BACKOFF
+
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._stopping = False
+        self._reset_metrics()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        绑定Flask应用，写入线程在第一次提交事件时才启动
+        """
+        self.app = app
+        self.maxsize = app.config.get('HISTORY_QUEUE_MAXSIZE', self.maxsize)
+        self.batch_size = app.config.get('HISTORY_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('HISTORY_FLUSH_INTERVAL', self.flush_interval)
+        self.overflow_policy = app.config.get('HISTORY_OVERFLOW_POLICY', self.overflow_policy)
+        self.spill_path = app.config.get('HISTORY_SPILL_PATH', self.spill_path)
+        self.write_retries = app.config.get('HISTORY_WRITE_RETRIES', self.write_retries)
+        self.retry_backoff = app.config.get('HISTORY_RETRY_BACKOFF', self.retry_backoff)
+
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"未知的历史写入溢出策略 {self.overflow_policy}，使用 {OVERFLOW_BLOCK}")
+            self.overflow_policy = OVERFLOW_BLOCK
+
+        self._queue = queue.Queue(maxsize=self.maxsize)
+
+    def _reset_metrics(self):
+        """
+        重置统计指标
+        """
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': {EVENT_CHAT: 0, EVENT_USAGE: 0},
+            'spilled': 0,
+            'replayed': 0,
+            'corrupt': 0,
+            'batches': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    # ------------------------------------------------------------------
+    # 提交事件
+    # ------------------------------------------------------------------
+
+    def submit_chat(self, key_id: int, model: str, request: str, response: Optional[str] = None,
+                    tokens_used: int = 0, model_id: Optional[int] = None,
+                    timestamp: Optional[datetime] = None, is_error: bool = False,
+                    latency_ms: float = 0, prompt_tokens: int = 0,
+                    completion_tokens: int = 0, ttfb_ms: Optional[float] = None,
+                    overhead_ms: Optional[float] = None) -> bool:
+        """
+        提交一条聊天历史记录，同时累加到使用统计汇总表和延迟直方图
+
+        latency_ms 为上游总耗时，ttfb_ms 为上游首字节耗时，overhead_ms 为代理自身耗时
+        """
+        return self.submit({
+            'type': EVENT_CHAT,
+            'key_id': key_id,
+            'model': model,
+            'model_id': model_id,
+            'request': request,
+            'response': response,
+            'tokens_used': tokens_used or 0,
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'is_error': is_error,
+            'latency_ms': latency_ms or 0,
+            'ttfb_ms': ttfb_ms,
+            'overhead_ms': overhead_ms,
+            'timestamp': timestamp or datetime.utcnow()
+        })
+
+    def submit_usage(self, key_id: int, model: str, tokens_used: int = 0,
+                     timestamp: Optional[datetime] = None, prompt_tokens: int = 0,
+                     completion_tokens: int = 0) -> bool:
+        """
+        提交一条Key使用统计
+        """
+        return self.submit({
+            'type': EVENT_USAGE,
+            'key_id': key_id,
+            'model': model,
+            'tokens_used': tokens_used or 0,
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'timestamp': timestamp or datetime.utcnow()
+        })
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """
+        提交事件到写入队列，返回事件是否被接收（写入队列或溢出文件）
+        """
+        if self.app is None or self._queue is None:
+            # 未绑定应用（例如脚本中直接调用）时同步写入
+            self._write_batch([event])
+            return True
+
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(event)
+            self._incr('enqueued')
+            return True
+        except queue.Full:
+            return self._handle_overflow(event)
+
+    def _handle_overflow(self, event: Dict[str, Any]) -> bool:
+        """
+        根据溢出策略处理无法入队的事件
+        """
+        if self.overflow_policy == OVERFLOW_SPILL:
+            if self._spill([event]):
+                return True
+        elif self.overflow_policy == OVERFLOW_DROP_METADATA and event['type'] == EVENT_CHAT:
+            self._record_drop(event)
+            return False
+
+        # block策略，以及drop_metadata策略下的使用统计事件：有限时间内阻塞等待
+        try:
+            self._queue.put(event, timeout=self.block_timeout)
+            self._incr('enqueued')
+            return True
+        except queue.Full:
+            self._record_drop(event)
+            return False
+
+    def _record_drop(self, event: Dict[str, Any]):
+        """
+        记录被丢弃的事件
+        """
+        with self._metrics_lock:
+            self._metrics['dropped'][event['type']] += 1
+        logger.warning(f"历史写入队列已满，丢弃 {event['type']} 事件")
+
+    # ------------------------------------------------------------------
+    # 溢出文件
+    # ------------------------------------------------------------------
+
+    def _spill(self, events: List[Dict[str, Any]]) -> bool:
+        """
+        将事件追加写入溢出文件
+        """
+        try:
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for event in events:
+                        record = dict(event)
+                        record['timestamp'] = record['timestamp'].isoformat()
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._incr('spilled', len(events))
+            return True
+        except OSError as e:
+            logger.error(f"写入历史溢出文件失败: {e}")
+            return False
+
+    def _replay_spill(self):
+        """
+        回放溢出文件中的事件
+
+        每写入一批就在 .offset 文件中记录已回放到的位置，回放中途进程退出时下次从该位置继续，
+        最多重复写入一批；无法解析的行（例如写入溢出文件时进程被杀留下的半行）计数后跳过
+        """
+        if not self.spill_path:
+            return
+
+        replay_path = f"{self.spill_path}.replay"
+        offset_path = f"{replay_path}.offset"
+        with self._spill_lock:
+            # 上次回放未完成时先处理残留文件
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+                self._remove_file(offset_path)
+
+        batch = []
+        with open(replay_path, 'rb') as f:
+            f.seek(self._read_offset(offset_path))
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                    event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"跳过无法解析的历史溢出记录: {e}")
+                    self._incr('corrupt')
+                    continue
+                batch.append(event)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    self._incr('replayed', len(batch))
+                    self._write_offset(offset_path, f.tell())
+                    batch = []
+        if batch:
+            self._flush(batch)
+            self._incr('replayed', len(batch))
+        os.remove(replay_path)
+        self._remove_file(offset_path)
+
+    @staticmethod
+    def _read_offset(offset_path: str) -> int:
+        """
+        读取上次回放到的位置，没有记录时从头开始
+        """
+        try:
+            with open(offset_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def _write_offset(offset_path: str, offset: int):
+        """
+        记录已回放到的位置（先写临时文件再替换，不会留下不完整的内容）
+        """
+        tmp_path = f"{offset_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, offset_path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        """
+        删除文件，不存在时忽略
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # ------------------------------------------------------------------
+    # 写入线程
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """
+        按需启动写入线程
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+            logger.info("历史记录写入线程已启动")
+
+    def _run(self):
+        """
+        写入线程主循环：攒批后统一写入
+        """
+        while True:
+            batch, stop = self._collect_batch()
+            if batch:
+                self._flush(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                break
+            if not batch and self.overflow_policy == OVERFLOW_SPILL:
+                # 队列空闲时回放溢出文件
+                self._safe_replay()
+
+        # 退出前把溢出文件中的事件写完
+        if self.overflow_policy == OVERFLOW_SPILL:
+            self._safe_replay()
+
+    def _collect_batch(self):
+        """
+        从队列中取出一批事件
+        """
+        batch = []
+        try:
+            item = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, False
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not self._stopping:
+                break
+            try:
+                item = self._queue.get(timeout=max(remaining, 0)) if not self._stopping else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _safe_replay(self):
+        """
+        回放溢出文件，出错时只记录日志
+        """
+        try:
+            with self.app.app_context():
+                self._replay_spill()
+        except Exception as e:
+            logger.error(f"回放历史溢出文件失败: {e}")
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        """
+        写入一批事件并记录耗时
+
+        临时错误退避重试；其他错误时拆分批次，只有无法写入的单条事件才计为失败（spill策略下写入溢出文件）
+        """
+        start = time.perf_counter()
+        failed = self._write_isolated(batch)
+        written = len(batch) - len(failed)
+        if written:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._metrics_lock:
+                m = self._metrics
+                m['written'] += written
+                m['batches'] += 1
+                m['last_batch_size'] = written
+                m['max_batch_size'] = max(m['max_batch_size'], written)
+                m['last_flush_ms'] = elapsed_ms
+                m['max_flush_ms'] = max(m['max_flush_ms'], elapsed_ms)
+                m['total_flush_ms'] += elapsed_ms
+        if failed:
+            if self.overflow_policy == OVERFLOW_SPILL and self._spill(failed):
+                return
+            self._incr('failed', len(failed))
+
+    def _write_isolated(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        写入一批事件，返回无法写入的事件
+
+        非临时错误时把批次对半拆分后分别写入，一条有问题的事件不会导致整批丢失；
+        临时错误重试后仍然失败时不再拆分，整批返回
+        """
+        try:
+            self._write_with_retry(batch)
+            return []
+        except Exception as e:
+            if len(batch) == 1 or is_transient_error(e):
+                logger.error(f"批量写入历史记录失败（{len(batch)} 条）: {e}")
+                return list(batch)
+            middle = len(batch) // 2
+            return self._write_isolated(batch[:middle]) + self._write_isolated(batch[middle:])
+
+    def _write_with_retry(self, batch: List[Dict[str, Any]]):
+        """
+        在一个事务中写入一批事件，临时错误按指数退避重试
+        """
+        for attempt in range(self.write_retries + 1):
+            try:
+                with self.app.app_context():
+                    self._write_batch(batch)
+                return
+            except Exception as e:
+                if attempt >= self.write_retries or not is_transient_error(e):
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"写入历史记录遇到临时错误，{delay:.1f} 秒后重试: {e}")
+                self._incr('retried')
+                time.sleep(delay)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        """
+        在一个事务中写入一批事件
+        """
+        from app.models.chat_history import ChatHistory
+        from app.services.key_service import KeyService
+        from app.services.rollup_service import RollupService
+        from app.services.latency_service import LatencyService
+        from app.models.data_version import DataVersion, STATS_VERSION
+        from app.utils.pricing import price_table
+
+        usages = {}
+        chats = []
+        try:
+            for event in batch:
+                # 按写入时的价格表计算费用，失败请求不计费
+                if 'cost_nanos' not in event:
+                    event['cost_nanos'] = 0 if event.get('is_error') else price_table.cost_nanos(
+                        event['model'], event.get('prompt_tokens', 0), event.get('completion_tokens', 0)
+                    )
+                if event['type'] == EVENT_CHAT:
+                    chats.append(event)
+                    db.session.add(ChatHistory(
+                        key_id=event['key_id'],
+                        model=event['model'],
+                        model_id=event.get('model_id'),
+                        request=event['request'],
+                        response=event.get('response'),
+                        tokens_used=event.get('tokens_used', 0),
+                        prompt_tokens=event.get('prompt_tokens', 0),
+                        completion_tokens=event.get('completion_tokens', 0),
+                        cost_nanos=event['cost_nanos'],
+                        is_error=bool(event.get('is_error')),
+                        timestamp=event['timestamp']
+                    ))
+                elif event['type'] == EVENT_USAGE:
+                    usage = usages.setdefault((event['key_id'], event['model']), {
+                        'key_id': event['key_id'],
+                        'model': event['model'],
+                        'count': 0,
+                        'tokens': 0,
+                        'prompt_tokens': 0,
+                        'completion_tokens': 0,
+                        'cost_nanos': 0,
+                        'last_used': event['timestamp']
+                    })
+                    usage['count'] += 1
+                    usage['tokens'] += event.get('tokens_used', 0)
+                    usage['prompt_tokens'] += event.get('prompt_tokens', 0)
+                    usage['completion_tokens'] += event.get('completion_tokens', 0)
+                    usage['cost_nanos'] += event['cost_nanos']
+                    usage['last_used'] = max(usage['last_used'], event['timestamp'])
+
+            KeyService.record_usage_batch(list(usages.values()))
+            RollupService.record_events(chats)
+            LatencyService.record_events(chats)
+            DataVersion.bump(STATS_VERSION)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    # ------------------------------------------------------------------
+    # 关闭与指标
+    # ------------------------------------------------------------------
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待队列中已提交的事件全部写入
+        """
+        if self._queue is None or self._thread is None or not self._thread.is_alive():
+            return True
+        deadline = time.monotonic() + (timeout if timeout is not None else self.drain_timeout)
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        停止写入线程，退出前把队列中的事件全部写完
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+
+        timeout = timeout if timeout is not None else self.drain_timeout
+        logger.info(f"正在写入剩余的 {self._queue.qsize()} 条历史事件...")
+        self._stopping = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error("历史写入队列已满，无法发送停止信号")
+            return False
+        self._thread.join(timeout=timeout)
+        drained = not self._thread.is_alive()
+        if drained:
+            logger.info("历史记录写入线程已停止")
+        else:
+            logger.error(f"历史记录写入未在 {timeout} 秒内完成，剩余 {self._queue.qsize()} 条")
+        return drained
+
+    def _incr(self, name: str, value: int = 1):
+        """
+        累加计数指标
+        """
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取写入队列的运行指标
+        """
+        with self._metrics_lock:
+            m = dict(self._metrics)
+            m['dropped'] = dict(self._metrics['dropped'])
+        batches = m.pop('batches')
+        total_flush_ms = m.pop('total_flush_ms')
+        m.update({
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'queue_maxsize': self.maxsize,
+            'overflow_policy': self.overflow_policy,
+            'batch_limit': self.batch_size,
+            'batches': batches,
+            'avg_batch_size': round(m['written'] / batches, 2) if batches else 0,
+            'avg_flush_ms': round(total_flush_ms / batches, 3) if batches else 0.0,
+            'last_flush_ms': round(m['last_flush_ms'], 3),
+            'max_flush_ms': round(m['max_flush_ms'], 3),
+            'dropped_total': sum(m['dropped'].values())
+        })
+        return m
+
+# 全局历史记录写入实例
+history_writer = HistoryWriter()
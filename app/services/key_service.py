@@ -4,9 +4,11 @@ Key管理服务
 
 import re
 from typing import List, Optional, Dict, Any
+from sqlalchemy import bindparam, func
 from app import db
 from app.models.key import Key
 from app.models.usage_stats import UsageStat
+from app.utils.db_routing import read_only
 
 class KeyService:
     """
@@ -157,9 +159,80 @@ class KeyService:
         
         usage_stat = UsageStat.get_or_create(key_id, model, model_id)
         usage_stat.update_usage(tokens_used)
-        
+
         return True
-    
+
+    @staticmethod
+    def record_usage_batch(usages: List[Dict[str, Any]]) -> None:
+        """
+        批量累加Key和模型的使用统计（不提交事务，由调用方统一提交）
+
+        usages中每一项包含: key_id, model, count, tokens, last_used，
+        以及可选的 prompt_tokens, completion_tokens, cost_nanos
+        """
+        if not usages:
+            return
+
+        from app.models.model import Model
+
+        # 按Key汇总，使用一条UPDATE语句批量更新
+        key_totals = {}
+        for usage in usages:
+            total = key_totals.setdefault(usage['key_id'], {'count': 0, 'last_used': usage['last_used']})
+            total['count'] += usage['count']
+            total['last_used'] = max(total['last_used'], usage['last_used'])
+
+        keys_table = Key.__table__
+        db.session.execute(
+            keys_table.update()
+            .where(keys_table.c.id == bindparam('b_key_id'))
+            .values(
+                usage_count=keys_table.c.usage_count + bindparam('b_count'),
+                last_used=bindparam('b_last_used')
+            ),
+            [
+                {'b_key_id': key_id, 'b_count': total['count'], 'b_last_used': total['last_used']}
+                for key_id, total in key_totals.items()
+            ]
+        )
+
+        # 一次性加载涉及的模型和使用统计记录
+        model_names = {usage['model'] for usage in usages}
+        model_ids = dict(
+            db.session.query(Model.model_name, Model.id).filter(Model.model_name.in_(model_names)).all()
+        )
+        existing_stats = {
+            (stat.key_id, stat.model): stat
+            for stat in UsageStat.query.filter(
+                UsageStat.key_id.in_(key_totals.keys()),
+                UsageStat.model.in_(model_names)
+            ).all()
+        }
+
+        for usage in usages:
+            stat = existing_stats.get((usage['key_id'], usage['model']))
+            if not stat:
+                stat = UsageStat(
+                    key_id=usage['key_id'],
+                    model=usage['model'],
+                    model_id=model_ids.get(usage['model']),
+                    usage_count=0,
+                    total_tokens=0,
+                    prompt_tokens=0,
+                    completion_tokens=0,
+                    cost_nanos=0
+                )
+                db.session.add(stat)
+                existing_stats[(usage['key_id'], usage['model'])] = stat
+            elif stat.model_id is None:
+                stat.model_id = model_ids.get(usage['model'])
+            stat.usage_count += usage['count']
+            stat.total_tokens += usage['tokens']
+            stat.prompt_tokens = (stat.prompt_tokens or 0) + usage.get('prompt_tokens', 0)
+            stat.completion_tokens = (stat.completion_tokens or 0) + usage.get('completion_tokens', 0)
+            stat.cost_nanos = (stat.cost_nanos or 0) + usage.get('cost_nanos', 0)
+            stat.last_used = max(stat.last_used, usage['last_used']) if stat.last_used else usage['last_used']
+
     @staticmethod
     def set_key_status(key_id: int, status: str) -> bool:
         """
@@ -172,22 +245,25 @@ class KeyService:
         return key.set_status(status)
     
     @staticmethod
+    @read_only
     def get_keys_summary() -> Dict[str, Any]:
         """
         获取Keys摘要信息
         """
-        total_keys = Key.query.count()
-        active_keys = Key.query.filter_by(status='active').count()
-        inactive_keys = Key.query.filter_by(status='inactive').count()
-        error_keys = Key.query.filter_by(status='error').count()
-        total_usage = sum(key.usage_count for key in Key.query.all())
+        # 按状态分组一次查询得到数量和使用次数
+        rows = db.session.query(
+            Key.status,
+            func.count(Key.id),
+            func.coalesce(func.sum(Key.usage_count), 0)
+        ).group_by(Key.status).all()
+        counts = {status: count for status, count, _ in rows}
         
         return {
-            'total_keys': total_keys,
-            'active_keys': active_keys,
-            'inactive_keys': inactive_keys,
-            'error_keys': error_keys,
-            'total_usage': total_usage
+            'total_keys': sum(counts.values()),
+            'active_keys': counts.get('active', 0),
+            'inactive_keys': counts.get('inactive', 0),
+            'error_keys': counts.get('error', 0),
+            'total_usage': sum(usage for _, _, usage in rows)
         }
     
     @staticmethod
@@ -0,0 +1,151 @@
+"""
+请求延迟统计服务
+
+每个成功请求的上游总耗时、上游首字节耗时和代理自身耗时分别计入对数分桶直方图，
+按 (小时, Key, 模型, 指标, 桶序号) 累加写入数据库。写入与聊天历史在同一事务中完成，
+多个worker进程写入的计数直接相加，查询时把范围内的桶计数求和即可得到合并后的直方图。
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterable
+from sqlalchemy import func
+from app import db
+from app.config import Config
+from app.models.latency_histogram import LatencyHistogramBin
+from app.utils.latency_histogram import LatencyHistogram, bucket_index, LATENCY_METRICS
+from app.utils.time_buckets import floor_datetime
+
+logger = logging.getLogger(__name__)
+
+# 直方图的时间粒度
+LATENCY_GRANULARITY = 'hour'
+
+# 聊天事件中各指标对应的字段
+METRIC_FIELDS = {
+    'total': 'latency_ms',
+    'ttfb': 'ttfb_ms',
+    'overhead': 'overhead_ms'
+}
+
+class LatencyService:
+    """
+    请求延迟统计服务类
+    """
+
+    @staticmethod
+    def aggregate_events(events: Iterable[Dict[str, Any]]) -> Dict[tuple, int]:
+        """
+        按 (小时, Key, 模型, 指标, 桶序号) 汇总聊天事件的延迟，失败请求不计入
+        """
+        counts = {}
+        for event in events:
+            if event.get('is_error') or not event.get('key_id'):
+                continue
+            bucket = floor_datetime(event['timestamp'], LATENCY_GRANULARITY)
+            model_id = event.get('model_id') or 0
+            for metric, field in METRIC_FIELDS.items():
+                value = event.get(field)
+                if value is None:
+                    continue
+                row_key = (bucket, event['key_id'], model_id, metric, bucket_index(value))
+                counts[row_key] = counts.get(row_key, 0) + 1
+        return counts
+
+    @staticmethod
+    def record_events(events: List[Dict[str, Any]]):
+        """
+        将一批聊天事件的延迟累加到直方图（不提交事务，由调用方统一提交）
+        """
+        counts = LatencyService.aggregate_events(events)
+        if not counts:
+            return
+
+        values = [
+            dict(bucket=bucket, key_id=key_id, model_id=model_id, metric=metric, bin=index, count=count)
+            for (bucket, key_id, model_id, metric, index), count in counts.items()
+        ]
+        table = LatencyHistogramBin.__table__
+        dialect_name = db.session.get_bind().dialect.name
+
+        if dialect_name in ('sqlite', 'postgresql'):
+            if dialect_name == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['bucket', 'key_id', 'model_id', 'metric', 'bin'],
+                set_={'count': table.c.count + stmt.excluded.count}
+            )
+            db.session.execute(stmt, values)
+            return
+
+        # 其他数据库：先查询已存在的行再分别更新
+        for value in values:
+            row = LatencyHistogramBin.query.filter_by(
+                bucket=value['bucket'], key_id=value['key_id'], model_id=value['model_id'],
+                metric=value['metric'], bin=value['bin']
+            ).first()
+            if row is None:
+                db.session.add(LatencyHistogramBin(**value))
+            else:
+                row.count += value['count']
+
+    @staticmethod
+    def get_histograms(start: datetime, end: Optional[datetime] = None, group_by: Optional[str] = None,
+                       **filters) -> Dict[Any, Dict[str, LatencyHistogram]]:
+        """
+        合并时间范围内的直方图
+
+        返回 {指标: 直方图}；指定 group_by（key_id 或 model_id）时返回 {分组值: {指标: 直方图}}。
+        桶计数在数据库中求和，Python端只处理非零桶。
+        """
+        group_columns = [getattr(LatencyHistogramBin, group_by).label('group_value')] if group_by else []
+        query = db.session.query(
+            *group_columns,
+            LatencyHistogramBin.metric,
+            LatencyHistogramBin.bin,
+            func.sum(LatencyHistogramBin.count).label('count')
+        ).filter(
+            LatencyHistogramBin.bucket >= floor_datetime(start, LATENCY_GRANULARITY)
+        )
+        if end is not None:
+            query = query.filter(LatencyHistogramBin.bucket < end)
+        for name, value in filters.items():
+            column = getattr(LatencyHistogramBin, name)
+            query = query.filter(column.in_(value) if isinstance(value, (list, tuple, set)) else column == value)
+        query = query.group_by(*group_columns, LatencyHistogramBin.metric, LatencyHistogramBin.bin)
+
+        result = {}
+        for item in query.all():
+            histograms = result.setdefault(item.group_value, {}) if group_by else result
+            histogram = histograms.get(item.metric)
+            if histogram is None:
+                histogram = histograms[item.metric] = LatencyHistogram()
+            histogram.add_bucket(item.bin, item.count or 0)
+        return result
+
+    @staticmethod
+    def summarize(histograms: Dict[str, LatencyHistogram]) -> Dict[str, Dict[str, Any]]:
+        """
+        输出各指标的请求数和百分位延迟
+        """
+        return {
+            metric: (histograms.get(metric) or LatencyHistogram()).summary()
+            for metric in LATENCY_METRICS
+        }
+
+    @staticmethod
+    def prune() -> Dict[str, int]:
+        """
+        清理超出小时级汇总保留期的直方图
+        """
+        cutoff = floor_datetime(datetime.utcnow() - timedelta(days=Config.ROLLUP_HOUR_RETENTION_DAYS), 'day')
+        deleted = LatencyHistogramBin.query.filter(
+            LatencyHistogramBin.bucket < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        if deleted:
+            logger.info(f"清理 {deleted} 行延迟直方图")
+        return {'pruned': deleted}
@@ -0,0 +1,406 @@
+"""
+数据维护服务
+
+按主键范围分批清理过期的聊天历史，每批一个短事务，批次之间让出数据库锁；
+清理后对SQLite做增量压缩或 VACUUM INTO 压缩副本，并报告删除行数和回收空间。
+使用统计汇总表不受聊天历史清理影响。
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+from sqlalchemy import func, text
+from sqlalchemy.engine import make_url
+from app import db
+from app.config import Config
+from app.models.chat_history import ChatHistory
+from app.models.data_version import DataVersion, STATS_VERSION
+from app.services.rollup_service import RollupService
+from app.services.latency_service import LatencyService
+from app.services.model_service import ModelService
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - 非POSIX平台不做跨进程互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 压缩方式
+COMPACTION_INCREMENTAL = 'incremental'  # PRAGMA incremental_vacuum，释放空闲页
+COMPACTION_VACUUM_INTO = 'vacuum_into'  # VACUUM INTO 输出压缩后的数据库副本
+COMPACTION_NONE = 'none'
+COMPACTION_MODES = (COMPACTION_INCREMENTAL, COMPACTION_VACUUM_INTO, COMPACTION_NONE)
+
+
+class MaintenanceService:
+    """
+    数据维护服务类
+    """
+
+    @staticmethod
+    def purge_chat_history(days: int, chunk_size: Optional[int] = None,
+                           pause: Optional[float] = None) -> Dict[str, Any]:
+        """
+        按主键范围分批删除 days 天之前的聊天历史
+        """
+        chunk_size = chunk_size or Config.RETENTION_CHUNK_SIZE
+        pause = Config.RETENTION_CHUNK_PAUSE if pause is None else pause
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        started = time.perf_counter()
+
+        # 只需确定一次待删除的主键范围，之后每批都是主键范围扫描
+        low, high = db.session.query(
+            func.min(ChatHistory.id), func.max(ChatHistory.id)
+        ).filter(ChatHistory.timestamp < cutoff).one()
+        db.session.commit()
+
+        removed = 0
+        chunks = 0
+        if low is not None:
+            table = ChatHistory.__table__
+            for chunk_start in range(low, high + 1, chunk_size):
+                result = db.session.execute(
+                    table.delete().where(
+                        table.c.id >= chunk_start,
+                        table.c.id < chunk_start + chunk_size,
+                        table.c.timestamp < cutoff
+                    )
+                )
+                db.session.commit()
+                removed += result.rowcount or 0
+                chunks += 1
+                if pause:
+                    time.sleep(pause)
+
+        if removed:
+            DataVersion.bump(STATS_VERSION)
+            db.session.commit()
+
+        report = {
+            'cutoff': cutoff.isoformat(),
+            'rows_removed': removed,
+            'chunks': chunks,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+        logger.info(f"聊天历史清理完成，删除 {removed} 行（{chunks} 批）")
+        return report
+
+    @staticmethod
+    def get_storage_info() -> Dict[str, Any]:
+        """
+        获取SQLite数据库的页数和空闲页信息
+        """
+        bind = db.session.get_bind()
+        if bind.dialect.name != 'sqlite':
+            return {'dialect': bind.dialect.name}
+
+        page_size = db.session.execute(text('PRAGMA page_size')).scalar()
+        page_count = db.session.execute(text('PRAGMA page_count')).scalar()
+        freelist_count = db.session.execute(text('PRAGMA freelist_count')).scalar()
+        auto_vacuum = db.session.execute(text('PRAGMA auto_vacuum')).scalar()
+        db.session.commit()
+
+        path = bind.url.database
+        return {
+            'dialect': 'sqlite',
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': freelist_count,
+            'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(auto_vacuum, auto_vacuum),
+            'database_bytes': page_size * page_count,
+            'free_bytes': page_size * freelist_count,
+            'file_bytes': os.path.getsize(path) if path and path != ':memory:' and os.path.exists(path) else None
+        }
+
+    @staticmethod
+    def compact_database(mode: Optional[str] = None, pages: Optional[int] = None,
+                         snapshot_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        压缩SQLite数据库并报告回收的空间
+        """
+        mode = mode or Config.COMPACTION_MODE
+        if mode not in COMPACTION_MODES:
+            raise ValueError(f"不支持的压缩方式: {mode}")
+
+        before = MaintenanceService.get_storage_info()
+        report = {'mode': mode, 'before': before}
+        if before['dialect'] != 'sqlite' or mode == COMPACTION_NONE:
+            report['skipped'] = True
+            return report
+
+        if mode == COMPACTION_INCREMENTAL:
+            if before['auto_vacuum'] != 'incremental':
+                # 旧数据库需要先执行一次 flask compact-db --full 才能增量压缩
+                logger.warning("数据库未启用增量压缩（auto_vacuum=incremental），跳过压缩")
+                report['skipped'] = True
+                return report
+            pages = Config.COMPACTION_PAGES if pages is None else pages
+            pragma = f'PRAGMA incremental_vacuum({int(pages)});' if pages else 'PRAGMA incremental_vacuum;'
+            with db.engine.connect() as conn:
+                # sqlite3的execute只执行一步（只释放一页），executescript会执行到结束
+                conn.connection.driver_connection.executescript(pragma)
+        else:
+            snapshot_path = snapshot_path or Config.COMPACTION_SNAPSHOT_PATH
+            tmp_path = f"{snapshot_path}.tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('VACUUM INTO ?', (tmp_path,))
+            os.replace(tmp_path, snapshot_path)
+            report['snapshot_path'] = snapshot_path
+            report['snapshot_bytes'] = os.path.getsize(snapshot_path)
+
+        after = MaintenanceService.get_storage_info()
+        report['after'] = after
+        if mode == COMPACTION_INCREMENTAL:
+            report['bytes_reclaimed'] = before['database_bytes'] - after['database_bytes']
+        else:
+            report['bytes_reclaimed'] = before['database_bytes'] - report['snapshot_bytes']
+        logger.info(f"数据库压缩完成（{mode}），回收 {report['bytes_reclaimed']} 字节")
+        return report
+
+    @staticmethod
+    def full_vacuum() -> Dict[str, Any]:
+        """
+        开启增量压缩并执行一次完整 VACUUM（会锁库，适合维护窗口手动执行）
+        """
+        before = MaintenanceService.get_storage_info()
+        if before['dialect'] != 'sqlite':
+            return {'before': before, 'skipped': True}
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        after = MaintenanceService.get_storage_info()
+        return {
+            'before': before,
+            'after': after,
+            'bytes_reclaimed': before['database_bytes'] - after['database_bytes']
+        }
+
+    @staticmethod
+    def run_retention(days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        执行一次保留策略：清理过期聊天历史后压缩数据库
+        """
+        days = Config.HISTORY_RETENTION_DAYS if days is None else days
+        report = {'started_at': datetime.utcnow().isoformat()}
+        if days > 0:
+            report['purge'] = MaintenanceService.purge_chat_history(days)
+        if report.get('purge', {}).get('rows_removed'):
+            report['compaction'] = MaintenanceService.compact_database()
+        return report
+
+
+class MaintenanceScheduler:
+    """
+    后台维护任务调度器
+
+    每个任务按固定间隔执行，可以加上随机抖动，避免多个进程在同一时刻执行；
+    多进程部署时通过文件锁保证同一时间只有一个进程执行。
+    """
+
+    def __init__(self, app=None):
+        """
+        初始化调度器
+        """
+        self.app = None
+        self.enabled = Config.MAINTENANCE_ENABLED
+        self.lock_path = Config.MAINTENANCE_LOCK_PATH
+        self.jobs = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._start_lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        绑定Flask应用，调度线程在第一个请求到达时才启动
+        """
+        self.app = app
+        self.enabled = app.config.get('MAINTENANCE_ENABLED', self.enabled)
+        self.lock_path = self._resolve_lock_path(app, app.config.get('MAINTENANCE_LOCK_PATH', self.lock_path))
+        interval = app.config.get('MAINTENANCE_INTERVAL', Config.MAINTENANCE_INTERVAL)
+        self.add_job('retention', MaintenanceService.run_retention, interval)
+        self.add_job('downsample', RollupService.downsample, interval)
+        self.add_job('latency_prune', LatencyService.prune, interval)
+        refresh_interval = app.config.get('MODEL_REFRESH_INTERVAL', Config.MODEL_REFRESH_INTERVAL)
+        if refresh_interval > 0:
+            self.add_job('model_refresh', ModelService.refresh_models, refresh_interval,
+                         jitter=app.config.get('MODEL_REFRESH_JITTER', Config.MODEL_REFRESH_JITTER))
+
+        if self.enabled:
+            app.before_request(self.ensure_started)
+
+    @staticmethod
+    def _resolve_lock_path(app, path: str) -> str:
+        """
+        确定锁文件路径：配置的目录不存在时改用SQLite数据库所在目录或Flask实例目录，
+        所有worker仍然使用同一个锁文件，不会每个进程都执行一遍维护任务
+        """
+        if not path or os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            return path
+        url = make_url(app.config.get('SQLALCHEMY_DATABASE_URI') or 'sqlite://')
+        directory = None
+        if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+            directory = os.path.dirname(os.path.abspath(url.database))
+        if not directory or not os.path.isdir(directory):
+            directory = app.instance_path
+            os.makedirs(directory, exist_ok=True)
+        fallback = os.path.join(directory, os.path.basename(path))
+        logger.warning(f"维护任务锁文件目录不存在: {path}，改用 {fallback}")
+        return fallback
+
+    def add_job(self, name: str, func: Callable[[], Dict[str, Any]], interval: float, jitter: float = 0):
+        """
+        注册维护任务，每次执行后在间隔上再随机推迟 0 到 jitter 秒
+        """
+        self.jobs[name] = {
+            'func': func,
+            'interval': interval,
+            'jitter': jitter,
+            'next_run': time.monotonic() + interval + random.uniform(0, jitter),
+            'running': False,
+            'last_run': None,
+            'last_result': None,
+            'last_error': None
+        }
+
+    def ensure_started(self):
+        """
+        按需启动调度线程
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+            self._thread.start()
+            logger.info("后台维护任务调度线程已启动")
+
+    def trigger(self, name: str) -> bool:
+        """
+        让调度线程尽快在后台执行一个任务，不等待执行结果
+        """
+        job = self.jobs.get(name)
+        if job is None or not self.enabled:
+            return False
+        job['next_run'] = time.monotonic()
+        self.ensure_started()
+        self._wake_event.set()
+        return True
+
+    def stop(self, timeout: float = 5):
+        """
+        停止调度线程
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        """
+        调度线程主循环
+        """
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for name, job in self.jobs.items():
+                if now >= job['next_run']:
+                    self.run_job(name)
+                    job['next_run'] = time.monotonic() + job['interval'] + random.uniform(0, job['jitter'])
+            next_run = min((job['next_run'] for job in self.jobs.values()), default=now + 60)
+            # trigger() 会提前唤醒
+            self._wake_event.wait(max(next_run - time.monotonic(), 1))
+            self._wake_event.clear()
+
+    def run_job(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        立即执行一个任务，其他进程正在执行维护任务时跳过
+        """
+        job = self.jobs[name]
+        lock_file = self._acquire_lock()
+        if lock_file is False:
+            logger.info(f"其他进程正在执行维护任务，跳过 {name}")
+            return None
+
+        job['running'] = True
+        try:
+            with self.app.app_context():
+                try:
+                    result = job['func']()
+                except Exception:
+                    db.session.rollback()
+                    raise
+            job['last_result'] = result
+            job['last_error'] = None
+            return result
+        except Exception as e:
+            job['last_error'] = str(e)
+            logger.error(f"维护任务 {name} 执行失败: {e}")
+            return None
+        finally:
+            job['running'] = False
+            job['last_run'] = datetime.utcnow().isoformat()
+            self._release_lock(lock_file)
+
+    def _acquire_lock(self):
+        """
+        获取跨进程文件锁，返回锁文件对象；已被占用时返回False
+        """
+        if fcntl is None or not self.lock_path:
+            return None
+        try:
+            lock_file = open(self.lock_path, 'a')
+        except OSError as e:
+            # 没有锁时无法保证只有一个进程执行，跳过本次任务，而不是让每个worker都执行
+            logger.error(f"无法打开维护任务锁文件 {self.lock_path}，跳过本次维护任务: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except OSError:
+            lock_file.close()
+            return False
+
+    @staticmethod
+    def _release_lock(lock_file):
+        """
+        释放跨进程文件锁
+        """
+        if lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        获取调度器和各任务的状态
+        """
+        now = time.monotonic()
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'jobs': {
+                name: {
+                    'interval': job['interval'],
+                    'jitter': job['jitter'],
+                    'running': job['running'],
+                    'next_run_in': max(round(job['next_run'] - now, 1), 0),
+                    'last_run': job['last_run'],
+                    'last_result': job['last_result'],
+                    'last_error': job['last_error']
+                } for name, job in self.jobs.items()
+            }
+        }
+
+# 全局维护任务调度实例
+maintenance_scheduler = MaintenanceScheduler()
@@ -0,0 +1,248 @@
+"""
+模型别名路由服务
+
+按路由表把客户端请求的模型别名转发到上游目标链：当前目标被限流、熔断或超出耗时上限时，
+在请求截止时间内换下一个目标，上游大面积降级时客户端的尾延迟仍然有上限。
+没有配置别名的模型直接请求同名的上游模型，行为与之前相同。
+Flask路由使用同步方法，ASGI数据面使用 achat_completion 和 astream_chat_completion，两者共用熔断器。
+"""
+
+import time
+import logging
+import threading
+from contextlib import aclosing
+from typing import Dict, Any, List, Optional
+from app.services.openai_service import openai_service, UpstreamOverloadError
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.routing_table import routing_table, ModelRoute, RouteTarget
+from app.utils.tokenizer import StreamUsageTracker
+
+logger = logging.getLogger(__name__)
+
+# 剩余时间少于该值时不再尝试下一个目标（秒）
+MIN_ATTEMPT_SECONDS = 0.05
+
+
+class ModelRouter:
+    """
+    模型别名路由器，每个上游目标有独立的熔断器
+    """
+
+    def __init__(self):
+        """
+        初始化路由器
+        """
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, target: RouteTarget) -> CircuitBreaker:
+        """
+        获取上游目标的熔断器
+        """
+        breaker = self._breakers.get(target.name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(target.name, CircuitBreaker())
+        return breaker
+
+    @staticmethod
+    def is_alias(model_name: str) -> bool:
+        """
+        模型名称是否配置了别名路由
+        """
+        return routing_table.get(model_name) is not None
+
+    @staticmethod
+    def _attempt_timeout(target: RouteTarget, deadline: float) -> Optional[float]:
+        """
+        计算本次尝试的超时时间：目标的耗时上限和请求剩余时间中较小的一个，剩余时间不足时返回None
+        """
+        remaining = deadline - time.monotonic()
+        if remaining < MIN_ATTEMPT_SECONDS:
+            return None
+        if target.latency_budget_ms:
+            return min(target.latency_budget_ms / 1000, remaining)
+        return remaining
+
+    def _targets(self, route: ModelRoute, errors: List[str]):
+        """
+        按顺序返回可以尝试的目标和超时时间，跳过熔断中的目标
+        """
+        deadline = time.monotonic() + route.deadline_ms / 1000
+        for target in route.targets:
+            timeout = self._attempt_timeout(target, deadline)
+            if timeout is None:
+                errors.append(f'{target.name}: 超过请求截止时间')
+                return
+            if not self.breaker(target).allow_request():
+                errors.append(f'{target.name}: 熔断中')
+                continue
+            yield target, timeout
+
+    def _record_failure(self, route: ModelRoute, target: RouteTarget, error: UpstreamOverloadError,
+                        errors: List[str]):
+        """
+        记录一次失败的尝试；Key池额度不足是本地限流，不计入上游目标的熔断
+        """
+        if error.reason != 'pool_exhausted':
+            self.breaker(target).record_failure(str(error))
+        errors.append(f'{target.name}: {error}')
+        logger.warning(f"模型 {route.alias} 的上游目标 {target.name} 不可用（{error.reason}），尝试下一个目标")
+
+    @staticmethod
+    def _all_failed(route: ModelRoute, errors: List[str]) -> UpstreamOverloadError:
+        """
+        所有目标都不可用时返回的错误
+        """
+        return UpstreamOverloadError(
+            f"模型 {route.alias} 的所有上游目标都不可用: {'; '.join(errors)}", 'all_targets_failed'
+        )
+
+    def chat_completion(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Dict[str, Any]:
+        """
+        聊天完成，结果的 _route 字段记录实际使用的上游模型和尝试次数
+        """
+        route = routing_table.get(model)
+        if route is None:
+            response = openai_service.chat_completion(messages=messages, model=model, **kwargs)
+            response['_route'] = {'model': model, 'attempts': 1}
+            return response
+
+        errors = []
+        for target, timeout in self._targets(route, errors):
+            try:
+                response = openai_service.chat_completion(
+                    messages=messages, model=target.model, key_pool=target.keys, timeout=timeout, **kwargs
+                )
+            except UpstreamOverloadError as e:
+                self._record_failure(route, target, e, errors)
+                continue
+            self.breaker(target).record_success()
+            response['_route'] = {'alias': route.alias, 'model': target.model, 'target': target.name,
+                                  'attempts': len(errors) + 1}
+            return response
+        raise self._all_failed(route, errors)
+
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                               tracker: StreamUsageTracker, **kwargs):
+        """
+        流式聊天完成
+
+        只在上游返回第一个数据块之前换目标，开始转发后不再切换；tracker.model 为实际使用的上游模型，
+        tracker.alias 和 tracker.attempts 与非流式请求的 _route 相同
+        """
+        route = routing_table.get(model)
+        if route is None:
+            tracker.attempts = 1
+            yield from openai_service.stream_chat_completion(messages=messages, model=model, tracker=tracker, **kwargs)
+            return
+
+        errors = []
+        tracker.alias = route.alias
+        for target, timeout in self._targets(route, errors):
+            tracker.model = target.model
+            tracker.attempts = len(errors) + 1
+            chunks = openai_service.stream_chat_completion(
+                messages=messages, model=target.model, tracker=tracker,
+                key_pool=target.keys, timeout=timeout, **kwargs
+            )
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self.breaker(target).record_success()
+                return
+            except UpstreamOverloadError as e:
+                # 第一个数据块之前失败的目标没有产生用量，不能把估算用量记到它的Key上
+                tracker.key_id = None
+                self._record_failure(route, target, e, errors)
+                continue
+            self.breaker(target).record_success()
+            yield first
+            yield from chunks
+            return
+        raise self._all_failed(route, errors)
+
+    async def achat_completion(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Dict[str, Any]:
+        """
+        异步聊天完成，与 chat_completion 相同
+        """
+        # httpx 只在ASGI部署中需要，按需导入
+        from app.services.async_openai_service import async_openai_service
+        route = routing_table.get(model)
+        if route is None:
+            response = await async_openai_service.chat_completion(messages=messages, model=model, **kwargs)
+            response['_route'] = {'model': model, 'attempts': 1}
+            return response
+
+        errors = []
+        for target, timeout in self._targets(route, errors):
+            try:
+                response = await async_openai_service.chat_completion(
+                    messages=messages, model=target.model, key_pool=target.keys, timeout=timeout, **kwargs
+                )
+            except UpstreamOverloadError as e:
+                self._record_failure(route, target, e, errors)
+                continue
+            self.breaker(target).record_success()
+            response['_route'] = {'alias': route.alias, 'model': target.model, 'target': target.name,
+                                  'attempts': len(errors) + 1}
+            return response
+        raise self._all_failed(route, errors)
+
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                      tracker: StreamUsageTracker, **kwargs):
+        """
+        异步流式聊天完成，与 stream_chat_completion 相同
+        """
+        # httpx 只在ASGI部署中需要，按需导入
+        from app.services.async_openai_service import async_openai_service
+        route = routing_table.get(model)
+        if route is None:
+            tracker.attempts = 1
+            # 显式关闭上游流，客户端断开时立即记录用量
+            async with aclosing(async_openai_service.stream_chat_completion(
+                messages=messages, model=model, tracker=tracker, **kwargs
+            )) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+
+        errors = []
+        tracker.alias = route.alias
+        for target, timeout in self._targets(route, errors):
+            tracker.model = target.model
+            tracker.attempts = len(errors) + 1
+            async with aclosing(async_openai_service.stream_chat_completion(
+                messages=messages, model=target.model, tracker=tracker,
+                key_pool=target.keys, timeout=timeout, **kwargs
+            )) as chunks:
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    self.breaker(target).record_success()
+                    return
+                except UpstreamOverloadError as e:
+                    tracker.key_id = None
+                    self._record_failure(route, target, e, errors)
+                    continue
+                self.breaker(target).record_success()
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+                return
+        raise self._all_failed(route, errors)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        获取路由表和各上游目标的熔断状态
+        """
+        status = routing_table.to_dict()
+        for alias, route in status['routes'].items():
+            for target in route['targets']:
+                name = RouteTarget(target['model'], tuple(target['keys']), target['latency_budget_ms']).name
+                breaker = self._breakers.get(name)
+                target['circuit'] = breaker.to_dict() if breaker else CircuitBreaker().to_dict()
+        return status
+
+# 全局模型路由实例
+model_router = ModelRouter()
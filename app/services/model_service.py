@@ -3,12 +3,17 @@
 """
 
 import json
+from datetime import datetime
 from typing import List, Optional, Dict, Any
+from sqlalchemy import select, bindparam
 from app import db
-from app.models.model import Model
+from app.models.model import Model, parse_capabilities, capability_columns
+from app.models.data_version import DataVersion, MODELS_VERSION, STATS_VERSION
 from app.models.usage_stats import UsageStat
 from app.models.chat_history import ChatHistory
 from app.services.openai_service import openai_service
+from app.utils.db_routing import read_only
+from app.utils.model_registry import model_registry
 
 class ModelService:
     """
@@ -49,12 +54,15 @@ class ModelService:
         # 创建新模型
         new_model = Model(
             model_name=model_name,
-            description=description,
-            capabilities=capabilities
+            description=description
         )
+        new_model.set_capabilities(capabilities)
         
         db.session.add(new_model)
+        db.session.flush()
+        UsageStat.link_model_ids()
         db.session.commit()
+        model_registry.invalidate()
         
         return new_model
     
@@ -71,9 +79,10 @@ class ModelService:
         if description is not None:
             model.description = description
         if capabilities is not None:
-            model.capabilities = capabilities
+            model.set_capabilities(capabilities)
         
         db.session.commit()
+        model_registry.invalidate()
         return model
     
     @staticmethod
@@ -87,9 +96,11 @@ class ModelService:
         
         db.session.delete(model)
         db.session.commit()
+        model_registry.invalidate()
         return True
     
     @staticmethod
+    @read_only
     def get_model_stats(model_name: str) -> Dict[str, Any]:
         """
         获取模型统计信息
@@ -108,59 +119,114 @@ class ModelService:
         return stats
     
     @staticmethod
-    def refresh_models() -> List[Model]:
+    def refresh_models() -> Dict[str, Any]:
         """
         从OpenAI API刷新模型列表
+
+        一次查询加载已有模型，与上游列表比较后只写入新增和有变化的模型，
+        新增和更新在一条批量 upsert 语句中完成。由后台任务定期执行，请求路径上不会调用。
         """
         try:
             # 从OpenAI API获取最新模型列表
             openai_models = openai_service.get_models()
             
-            # 更新数据库中的模型信息
-            updated_models = []
+            # 根据模型名称判断其能力，构建上游模型的完整行
+            upstream = {}
             for model_data in openai_models.get('data', []):
                 model_name = model_data.get('id')
-                if model_name:
-                    # 获取现有模型
-                    existing_model = ModelService.get_model_by_name(model_name)
-                    
-                    # 判断模型是否支持聊天和文本完成
-                    # 根据模型名称判断其能力
-                    supports_chat = ModelService._supports_chat_capability(model_name)
-                    supports_completion = ModelService._supports_completion_capability(model_name)
-                    
-                    # 构建能力信息
-                    capabilities = {
-                        'owned_by': model_data.get('owned_by'),
-                        'created': model_data.get('created'),
-                        'permission': model_data.get('permission', []),
-                        'supports_chat': supports_chat,
-                        'supports_completion': supports_completion
-                    }
-                    
-                    if existing_model:
-                        # 更新现有模型
-                        existing_model.description = f"OpenAI {model_name} 模型"
-                        existing_model.capabilities = json.dumps(capabilities)
-                        updated_models.append(existing_model)
-                    else:
-                        # 创建新模型
-                        model = Model(
-                            model_name=model_name,
-                            description=f"OpenAI {model_name} 模型",
-                            capabilities=json.dumps(capabilities)
-                        )
-                        db.session.add(model)
-                        updated_models.append(model)
+                if not model_name:
+                    continue
+                capabilities = {
+                    'owned_by': model_data.get('owned_by'),
+                    'created': model_data.get('created'),
+                    'permission': model_data.get('permission', []),
+                    'supports_chat': ModelService._supports_chat_capability(model_name),
+                    'supports_completion': ModelService._supports_completion_capability(model_name)
+                }
+                upstream[model_name] = {
+                    'model_name': model_name,
+                    'description': f"OpenAI {model_name} 模型",
+                    'capabilities': json.dumps(capabilities),
+                    **capability_columns(capabilities)
+                }
+            
+            # 一次查询加载已有模型，比较出新增和有变化的模型
+            existing = {
+                row.model_name: row for row in db.session.query(
+                    Model.id, Model.model_name, Model.description, Model.capabilities
+                ).filter(Model.model_name.in_(upstream)).all()
+            } if upstream else {}
+            inserted, updated = [], []
+            for model_name, values in upstream.items():
+                row = existing.get(model_name)
+                if row is None:
+                    inserted.append(values)
+                elif row.description != values['description'] or \
+                        parse_capabilities(row.capabilities) != json.loads(values['capabilities']):
+                    updated.append(values)
             
-            # 提交所有更改
-            db.session.commit()
+            changed = inserted + updated
+            if changed:
+                ModelService._upsert_models(changed)
+                if inserted:
+                    # 新增模型之前已有的使用统计关联到模型ID
+                    UsageStat.link_model_ids()
+                # 批量语句不经过ORM刷新，手动更新数据版本
+                DataVersion.bump(MODELS_VERSION)
+                DataVersion.bump(STATS_VERSION)
+                db.session.commit()
+                model_registry.invalidate()
             
-            return updated_models
+            return {
+                'upstream': len(upstream),
+                'inserted': len(inserted),
+                'updated': len(updated),
+                'unchanged': len(upstream) - len(changed)
+            }
         except Exception as e:
             db.session.rollback()
             raise Exception(f"刷新模型列表失败: {str(e)}")
     
+    @staticmethod
+    def _upsert_models(rows: List[Dict[str, Any]]):
+        """
+        按模型名称批量写入模型，已存在的模型更新描述和能力
+        """
+        now = datetime.utcnow()
+        values = [dict(row, created_at=now, updated_at=now) for row in rows]
+        table = Model.__table__
+        update_columns = [name for name in values[0] if name not in ('model_name', 'created_at')]
+        dialect_name = db.session.get_bind().dialect.name
+        
+        if dialect_name in ('sqlite', 'postgresql'):
+            if dialect_name == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['model_name'],
+                set_={name: stmt.excluded[name] for name in update_columns}
+            )
+            db.session.execute(stmt, values)
+            return
+        
+        # 其他数据库：已存在的模型批量更新，其余批量插入
+        existing = set(db.session.execute(
+            select(table.c.model_name).where(table.c.model_name.in_([value['model_name'] for value in values]))
+        ).scalars())
+        updates = [value for value in values if value['model_name'] in existing]
+        inserts = [value for value in values if value['model_name'] not in existing]
+        if updates:
+            db.session.execute(
+                table.update().where(table.c.model_name == bindparam('b_model_name')).values(
+                    {name: bindparam(f'b_{name}') for name in update_columns}
+                ),
+                [{f'b_{name}': value[name] for name in ['model_name'] + update_columns} for value in updates]
+            )
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+    
     @staticmethod
     def _supports_chat_capability(model_name: str) -> bool:
         """
@@ -180,6 +246,7 @@ class ModelService:
         return any(pattern in model_name.lower() for pattern in completion_patterns)
     
     @staticmethod
+    @read_only
     def get_models_summary() -> Dict[str, Any]:
         """
         获取模型摘要信息
@@ -193,9 +260,9 @@ class ModelService:
                 db.func.sum(UsageStat.usage_count).label('total_usage'),
                 db.func.sum(UsageStat.total_tokens).label('total_tokens')
             ).join(
-                UsageStat, Model.model_name == UsageStat.model
+                UsageStat, Model.id == UsageStat.model_id
             ).group_by(
-                Model.model_name
+                Model.id, Model.model_name
             ).all()
             
             # 获取最常用的模型
@@ -226,54 +293,31 @@ class ModelService:
     @staticmethod
     def get_model_capabilities(model_name: str) -> Dict[str, Any]:
         """
-        获取模型能力信息
+        获取模型能力信息（从模型注册表读取已解析的能力）
         """
-        model = ModelService.get_model_by_name(model_name)
-        if not model or not model.capabilities:
-            return {}
-        
-        try:
-            return json.loads(model.capabilities)
-        except json.JSONDecodeError:
-            return {}
+        model = model_registry.get(model_name)
+        return dict(model.capabilities) if model else {}
     
     @staticmethod
     def is_model_available(model_name: str) -> bool:
         """
         检查模型是否可用
         """
-        model = ModelService.get_model_by_name(model_name)
-        return model is not None
+        return model_registry.get(model_name) is not None
     
     @staticmethod
     def get_chat_models() -> List[Model]:
         """
         获取支持聊天的模型列表
         """
-        chat_models = []
-        all_models = ModelService.get_all_models()
-        
-        for model in all_models:
-            capabilities = ModelService.get_model_capabilities(model.model_name)
-            if capabilities.get('supports_chat', False):
-                chat_models.append(model)
-        
-        return chat_models
+        return Model.query.filter(Model.supports_chat.is_(True)).order_by(Model.id).all()
     
     @staticmethod
     def get_completion_models() -> List[Model]:
         """
         获取支持文本完成的模型列表
         """
-        completion_models = []
-        all_models = ModelService.get_all_models()
-        
-        for model in all_models:
-            capabilities = ModelService.get_model_capabilities(model.model_name)
-            if capabilities.get('supports_completion', False):
-                completion_models.append(model)
-        
-        return completion_models
+        return Model.query.filter(Model.supports_completion.is_(True)).order_by(Model.id).all()
 
 # 全局模型服务实例
 model_service = ModelService()
\ No newline at end of file
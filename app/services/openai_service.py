@@ -6,7 +6,7 @@ import os
 import json
 import requests
 import time
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from app import db
 from app.models.key import Key
 from app.models.model import Model
@@ -14,6 +14,17 @@ from app.models.usage_stats import UsageStat
 from app.models.chat_history import ChatHistory
 from app.utils.key_rotation import key_rotation
 from app.services.key_service import KeyService
+from app.services.history_writer import history_writer
+from app.utils.tokenizer import token_counter, StreamUsageTracker
+
+class UpstreamOverloadError(Exception):
+    """
+    上游过载：请求频率限制、超时、连接失败或5xx错误，可以换一个上游目标重试
+    """
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason  # rate_limited, timeout, connection_error, upstream_error, pool_exhausted, all_targets_failed
 
 class OpenAIService:
     """
@@ -38,28 +49,42 @@ class OpenAIService:
         }
     
     def make_request(self, method: str, endpoint: str, data: Dict[str, Any] = None,
-                        key: Optional[Key] = None, stream: bool = False) -> Dict[str, Any]:
+                        key: Optional[Key] = None, stream: bool = False,
+                        timeout: Optional[float] = None, retry: bool = True) -> Dict[str, Any]:
         """
         发送请求到OpenAI API
+
+        retry 为False时频率限制和网络错误不在本地退避重试，直接抛出 UpstreamOverloadError
         """
         url = f"{self.base_url}/{endpoint}"
         headers = self.get_headers(key.key_value) if key else {}
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if retry else 1
+        started = time.perf_counter()
         
-        for attempt in range(self.max_retries):
+        for attempt in range(max_retries):
             try:
+                attempt_started = time.perf_counter()
                 if method.upper() == 'GET':
-                    response = requests.get(url, headers=headers, timeout=self.timeout)
+                    response = requests.get(url, headers=headers, timeout=timeout)
                 elif method.upper() == 'POST':
-                    response = requests.post(url, headers=headers, json=data, timeout=self.timeout, stream=stream)
+                    response = requests.post(url, headers=headers, json=data, timeout=timeout, stream=stream)
                 else:
                     raise ValueError(f"不支持的HTTP方法: {method}")
                 
                 # 检查响应状态
                 if response.status_code == 200:
+                    # 首字节耗时包含之前失败重试的时间
+                    ttfb_ms = (attempt_started - started + response.elapsed.total_seconds()) * 1000
                     if stream:
                         return response
                     
                     result = response.json()
+                    # 上游耗时，由调用方计算代理自身耗时
+                    result['_timing'] = {
+                        'upstream_ms': (time.perf_counter() - started) * 1000,
+                        'ttfb_ms': ttfb_ms
+                    }
                     # 添加使用的Key信息到结果中
                     if key:
                         result['_key_info'] = {
@@ -67,34 +92,44 @@ class OpenAIService:
                             'key_value': key.key_value
                         }
                     return result
-                elif response.status_code == 401:
-                    # 认证失败，标记Key为无效
-                    if key:
-                        KeyService.set_key_status(key.id, 'error')
-                    raise Exception('API Key无效')
                 elif response.status_code == 429:
                     # 请求频率限制，等待后重试
-                    if attempt < self.max_retries - 1:
+                    if attempt < max_retries - 1:
                         wait_time = 2 ** attempt  # 指数退避
                         time.sleep(wait_time)
                         continue
                     else:
-                        raise Exception('请求频率限制')
+                        raise UpstreamOverloadError('请求频率限制', 'rate_limited')
                 else:
-                    # 其他错误
                     error_info = response.json() if response.headers.get('content-type') == 'application/json' else response.text
-                    raise Exception(f"API请求失败: {response.status_code} - {error_info}")
+                    self.raise_for_status(response.status_code, error_info, key)
             
             except requests.exceptions.RequestException as e:
-                if attempt < self.max_retries - 1:
+                if attempt < max_retries - 1:
                     wait_time = 2 ** attempt  # 指数退避
                     time.sleep(wait_time)
                     continue
                 else:
-                    raise Exception(f"请求失败: {str(e)}")
+                    reason = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection_error'
+                    raise UpstreamOverloadError(f"请求失败: {str(e)}", reason)
         
         raise Exception("超过最大重试次数")
     
+    @staticmethod
+    def raise_for_status(status_code: int, error_info: Any, key: Optional[Key] = None):
+        """
+        处理上游返回的错误状态码（429由调用方按是否重试处理）
+        """
+        if status_code == 401:
+            # 认证失败，标记Key为无效
+            if key:
+                KeyService.set_key_status(key.id, 'error')
+            raise Exception('API Key无效')
+        if status_code >= 500:
+            raise UpstreamOverloadError(f"API请求失败: {status_code} - {error_info}", 'upstream_error')
+        # 其他错误
+        raise Exception(f"API请求失败: {status_code} - {error_info}")
+    
     def get_models(self) -> Dict[str, Any]:
         """
         获取模型列表
@@ -108,7 +143,7 @@ class OpenAIService:
             response = self.make_request('GET', 'models', key=key)
             
             # 更新Key使用统计
-            KeyService.update_key_usage(key.id, 'models')
+            history_writer.submit_usage(key.id, 'models')
             
             return response
         except Exception as e:
@@ -116,15 +151,18 @@ class OpenAIService:
     
     def chat_completion(self, messages: List[Dict[str, str]], model: str,
                        temperature: float = 0.7, max_tokens: int = 1000,
+                       key_pool: Optional[Tuple] = None, timeout: Optional[float] = None,
                        **kwargs) -> Dict[str, Any]:
         """
         聊天完成
+
+        指定 key_pool 时只使用池中的Key，并且不在本地退避重试，过载时抛出 UpstreamOverloadError
         """
         try:
-            # 使用加权轮询算法选择Key，确保使用次数均衡
-            key = key_rotation.get_key_by_strategy('weighted_round_robin')
-            if not key:
-                raise Exception('没有可用的API Key')
+            # 发送前估算提示token，用于Key额度预扣
+            prompt_tokens = token_counter.count_messages(messages, model)
+            charged_tokens = prompt_tokens + (max_tokens or 0)
+            key = self.select_key(key_pool, charged_tokens)
             
             # 构建请求数据
             data = {
@@ -138,28 +176,33 @@ class OpenAIService:
             data.update(kwargs)
             
             # 发送请求
-            response = self.make_request('POST', 'chat/completions', data=data, key=key)
-            
-            # 计算使用的token数量
-            tokens_used = response.get('usage', {}).get('total_tokens', 0)
-            
-            # 更新Key使用统计
-            KeyService.update_key_usage(key.id, model, tokens_used)
+            try:
+                response = self.make_request('POST', 'chat/completions', data=data, key=key,
+                                             timeout=timeout, retry=key_pool is None)
+            except Exception:
+                key_rotation.reconcile_tokens(key.id, charged_tokens, 0)
+                raise
             
+            response['_usage'] = self.record_chat_usage(key, model, response, prompt_tokens, charged_tokens)
             return response
+        except UpstreamOverloadError as e:
+            raise UpstreamOverloadError(f"聊天请求失败: {str(e)}", e.reason)
         except Exception as e:
             raise Exception(f"聊天请求失败: {str(e)}")
 
     def stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
-                               **kwargs):
+                               tracker: Optional[StreamUsageTracker] = None,
+                               key_pool: Optional[Tuple] = None, timeout: Optional[float] = None, **kwargs):
         """
         流式聊天完成
+
+        tracker 用于向调用方返回本次请求使用的Key和token用量；key_pool 和 timeout 与 chat_completion 相同
         """
         try:
-            # 使用加权轮询算法选择Key，确保使用次数均衡
-            key = key_rotation.get_key_by_strategy('weighted_round_robin')
-            if not key:
-                raise Exception('没有可用的API Key')
+            tracker = tracker or StreamUsageTracker(model)
+            tracker.prompt_estimate = token_counter.count_messages(messages, model)
+            charged_tokens = tracker.prompt_estimate + (kwargs.get('max_tokens') or 0)
+            key = self.select_key(key_pool, charged_tokens)
 
             # 构建请求数据
             data = {
@@ -170,10 +213,28 @@ class OpenAIService:
             data.update(kwargs)
 
             # 发送请求
-            response = self.make_request('POST', 'chat/completions', data=data, key=key, stream=True)
+            started = time.perf_counter()
+            try:
+                response = self.make_request('POST', 'chat/completions', data=data, key=key, stream=True,
+                                             timeout=timeout, retry=key_pool is None)
+            except Exception:
+                key_rotation.reconcile_tokens(key.id, charged_tokens, 0)
+                raise
+            # 上游接受请求后才把用量记到这个Key上
+            tracker.key_id = key.id
 
-            for chunk in response.iter_content(chunk_size=1024):
-                yield chunk
+            try:
+                for chunk in response.iter_content(chunk_size=1024):
+                    if tracker.ttfb_ms is None:
+                        tracker.ttfb_ms = (time.perf_counter() - started) * 1000
+                    tracker.feed(chunk)
+                    yield chunk
+            finally:
+                # 客户端中途断开时也记录已产生的用量
+                tracker.upstream_ms = (time.perf_counter() - started) * 1000
+                self.record_stream_usage(key, model, tracker, charged_tokens)
+        except UpstreamOverloadError as e:
+            raise UpstreamOverloadError(f"流式聊天请求失败: {str(e)}", e.reason)
         except Exception as e:
             raise Exception(f"流式聊天请求失败: {str(e)}")
     
@@ -183,8 +244,12 @@ class OpenAIService:
         文本完成
         """
         try:
+            # 发送前估算提示token，用于Key额度预扣
+            prompt_tokens = token_counter.count_text(prompt, model)
+            charged_tokens = prompt_tokens + (max_tokens or 0)
+            
             # 使用加权轮询算法选择Key，确保使用次数均衡
-            key = key_rotation.get_key_by_strategy('weighted_round_robin')
+            key = key_rotation.get_key_by_strategy('weighted_round_robin', charged_tokens)
             if not key:
                 raise Exception('没有可用的API Key')
             
@@ -200,18 +265,98 @@ class OpenAIService:
             data.update(kwargs)
             
             # 发送请求
-            response = self.make_request('POST', 'completions', data=data, key=key)
+            try:
+                response = self.make_request('POST', 'completions', data=data, key=key)
+            except Exception:
+                key_rotation.reconcile_tokens(key.id, charged_tokens, 0)
+                raise
             
-            # 计算使用的token数量
-            tokens_used = response.get('usage', {}).get('total_tokens', 0)
+            # 计算使用的token数量，上游未返回usage时使用本地估算
+            completion_text = ''.join(choice.get('text') or '' for choice in response.get('choices', []))
+            usage = self._resolve_usage(response, model, prompt_tokens, completion_text)
+            key_rotation.reconcile_tokens(key.id, charged_tokens, usage['total_tokens'])
+            response['_usage'] = usage
             
             # 更新Key使用统计
-            KeyService.update_key_usage(key.id, model, tokens_used)
+            history_writer.submit_usage(key.id, model, usage['total_tokens'],
+                                        prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
             
             return response
         except Exception as e:
             raise Exception(f"文本完成请求失败: {str(e)}")
     
+    def record_chat_usage(self, key: Key, model: str, response: Dict[str, Any],
+                          prompt_tokens: int, charged_tokens: int) -> Dict[str, Any]:
+        """
+        记录一次聊天请求的用量：修正Key预扣的额度并提交使用统计，返回用量
+        """
+        # 计算使用的token数量，上游未返回usage时使用本地估算
+        completion_text = ''.join(
+            (choice.get('message') or {}).get('content') or ''
+            for choice in response.get('choices', [])
+        )
+        usage = self._resolve_usage(response, model, prompt_tokens, completion_text)
+        key_rotation.reconcile_tokens(key.id, charged_tokens, usage['total_tokens'])
+        
+        # 更新Key使用统计
+        history_writer.submit_usage(key.id, model, usage['total_tokens'],
+                                    prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
+        return usage
+    
+    @staticmethod
+    def record_stream_usage(key: Key, model: str, tracker: StreamUsageTracker, charged_tokens: int):
+        """
+        流式响应结束（或客户端断开）后记录已产生的用量
+        """
+        tracker.finish()
+        usage = tracker.get_usage()
+        if not tracker.estimated:
+            token_counter.reconcile(tracker.prompt_estimate, usage['prompt_tokens'])
+        key_rotation.reconcile_tokens(key.id, charged_tokens, usage['total_tokens'])
+        history_writer.submit_usage(key.id, model, usage['total_tokens'],
+                                    prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
+    
+    @staticmethod
+    def select_key(key_pool: Optional[Tuple], charged_tokens: int) -> Key:
+        """
+        选择本次请求使用的Key，并按估算token数预扣额度
+        """
+        if key_pool is None:
+            # 使用加权轮询算法选择Key，确保使用次数均衡
+            key = key_rotation.get_key_by_strategy('weighted_round_robin', charged_tokens)
+            if not key:
+                raise Exception('没有可用的API Key')
+            return key
+        key = key_rotation.get_pool_key(key_pool, charged_tokens)
+        if not key:
+            raise UpstreamOverloadError('Key池中没有可用或额度充足的Key', 'pool_exhausted')
+        return key
+    
+    @staticmethod
+    def _resolve_usage(response: Dict[str, Any], model: str, prompt_tokens: int,
+                       completion_text: str) -> Dict[str, Any]:
+        """
+        获取本次请求的token用量
+
+        上游返回usage时以实际值为准并记录估算误差，否则使用本地估算值
+        """
+        usage = response.get('usage')
+        if usage:
+            token_counter.reconcile(prompt_tokens, usage.get('prompt_tokens', 0))
+            return {
+                'prompt_tokens': usage.get('prompt_tokens', 0),
+                'completion_tokens': usage.get('completion_tokens', 0),
+                'total_tokens': usage.get('total_tokens', 0),
+                'estimated': False
+            }
+        completion_tokens = token_counter.count_text(completion_text, model)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'estimated': True
+        }
+    
     def test_key(self, key: Key) -> Dict[str, Any]:
         """
         测试Key是否有效
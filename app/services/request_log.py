@@ -0,0 +1,263 @@
+"""
+请求日志服务
+
+每个聊天请求结束时输出一条结构化（JSON）汇总日志：请求ID、Key、模型、耗时和Token数。
+请求线程只创建日志记录并放入队列（QueueHandler），格式化、脱敏和写入由后台监听线程（QueueListener）完成；
+队列满时丢弃日志，不阻塞请求。请求和响应内容按 REQUEST_LOG_BODY_SAMPLE_RATE 抽样记录，写入前脱敏。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Optional, Iterable
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 汇总日志使用的logger，不传递给根logger
+REQUEST_LOGGER_NAME = 'app.requests'
+
+REDACTED = '[REDACTED]'
+
+# OpenAI API Key，出现在内容或上游错误信息中时替换掉
+API_KEY_PATTERN = re.compile(r'sk-[A-Za-z0-9_\-]{8,}')
+
+# 客户端传入的请求ID最多保留的字符数
+MAX_REQUEST_ID_LENGTH = 128
+
+
+def new_request_id(header_value: Optional[str] = None) -> str:
+    """
+    请求ID：优先使用客户端传入的 X-Request-ID，否则生成一个新的
+    """
+    if header_value:
+        return header_value.strip()[:MAX_REQUEST_ID_LENGTH]
+    return uuid.uuid4().hex
+
+
+def redact(value: Any, fields: frozenset) -> Any:
+    """
+    递归替换字段名在 fields 中（不区分大小写）的值，字符串中的API Key替换为 [REDACTED]
+    """
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in fields else redact(v, fields) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(item, fields) for item in value]
+    if isinstance(value, str):
+        return API_KEY_PATTERN.sub(REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    把汇总记录格式化为一行JSON，在监听线程中执行
+    """
+
+    def __init__(self, redact_fields: Iterable[str], body_max_chars: int):
+        super().__init__()
+        self.redact_fields = frozenset(field.strip().lower() for field in redact_fields if field.strip())
+        self.body_max_chars = body_max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = record.msg if isinstance(record.msg, dict) else {'message': record.getMessage()}
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname
+        }
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if name in ('request_body', 'response_body'):
+                value = self.format_body(value)
+            elif name == 'error':
+                value = API_KEY_PATTERN.sub(REDACTED, str(value))
+            elif isinstance(value, float):
+                value = round(value, 3)
+            entry[name] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+    def format_body(self, body: str) -> str:
+        """
+        脱敏并截断请求或响应内容
+        """
+        try:
+            body = json.dumps(redact(json.loads(body), self.redact_fields), ensure_ascii=False)
+        except (TypeError, ValueError):
+            body = API_KEY_PATTERN.sub(REDACTED, str(body))
+        if len(body) > self.body_max_chars:
+            body = body[:self.body_max_chars] + '...'
+        return body
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    只把记录放入队列的QueueHandler：不在调用线程中格式化，队列满时直接丢弃
+    """
+
+    def __init__(self, log_queue: queue.Queue, on_drop):
+        super().__init__(log_queue)
+        self.on_drop = on_drop
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 默认实现会在调用线程中格式化消息，汇总记录在监听线程中格式化
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.on_drop()
+
+
+class RequestLogListener(QueueListener):
+    """
+    后台监听线程，停止时等待队列中的记录写完
+    """
+
+    stop_timeout = 5
+
+    def enqueue_sentinel(self):
+        # 默认实现在队列满时会抛出异常
+        self.queue.put(self._sentinel, timeout=self.stop_timeout)
+
+
+class RequestLogger:
+    """
+    请求日志服务类
+    """
+
+    def __init__(self, app=None):
+        """
+        初始化请求日志服务
+        """
+        self.enabled = Config.REQUEST_LOG_ENABLED
+        self.path = Config.REQUEST_LOG_PATH
+        self.maxsize = Config.REQUEST_LOG_QUEUE_MAXSIZE
+        self.body_sample_rate = Config.REQUEST_LOG_BODY_SAMPLE_RATE
+        self.body_max_chars = Config.REQUEST_LOG_BODY_MAX_CHARS
+        self.redact_fields = Config.REQUEST_LOG_REDACT_FIELDS.split(',')
+
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._handler = NonBlockingQueueHandler(self._queue, self._on_drop)
+        self._output = None
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {'logged': 0, 'sampled': 0, 'dropped': 0}
+
+        self._logger = logging.getLogger(REQUEST_LOGGER_NAME)
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(self._handler)
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        读取配置，监听线程在第一次记录日志时才启动
+        """
+        self.enabled = app.config.get('REQUEST_LOG_ENABLED', self.enabled)
+        self.path = app.config.get('REQUEST_LOG_PATH', self.path)
+        self.body_sample_rate = app.config.get('REQUEST_LOG_BODY_SAMPLE_RATE', self.body_sample_rate)
+        self.body_max_chars = app.config.get('REQUEST_LOG_BODY_MAX_CHARS', self.body_max_chars)
+        if app.config.get('REQUEST_LOG_REDACT_FIELDS'):
+            self.redact_fields = app.config['REQUEST_LOG_REDACT_FIELDS'].split(',')
+
+    def _ensure_started(self):
+        """
+        按需启动监听线程；gunicorn预加载应用后fork出的worker使用新的队列和监听线程
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._queue = queue.Queue(maxsize=self.maxsize)
+                self._handler.queue = self._queue
+            if self._output is None:
+                if self.path:
+                    self._output = logging.FileHandler(self.path, encoding='utf-8')
+                else:
+                    self._output = logging.StreamHandler(sys.stderr)
+                self._output.setFormatter(JsonFormatter(self.redact_fields, self.body_max_chars))
+            self._listener = RequestLogListener(self._queue, self._output)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def _on_drop(self):
+        """
+        队列满时丢弃的记录计数
+        """
+        with self._metrics_lock:
+            self._metrics['dropped'] += 1
+
+    def log_request(self, started: Optional[float] = None, request_body: Optional[str] = None,
+                    response_body: Optional[str] = None, **fields):
+        """
+        提交一条请求汇总记录
+
+        started 为请求开始时的 time.perf_counter()；fields 为请求ID、模型、Key、状态码、耗时和Token数等字段；
+        request_body 和 response_body 为已经序列化的请求和响应内容，只在抽样命中时记录
+        """
+        if not self.enabled:
+            return
+        if started is not None:
+            fields['duration_ms'] = (time.perf_counter() - started) * 1000
+        sampled = self.body_sample_rate > 0 and random.random() < self.body_sample_rate
+        if sampled:
+            fields['request_body'] = request_body
+            fields['response_body'] = response_body
+        self._ensure_started()
+        # 直接创建记录，跳过 logger.info 查找调用位置的开销
+        self._logger.handle(self._logger.makeRecord(REQUEST_LOGGER_NAME, logging.INFO, '', 0, fields, (), None))
+        with self._metrics_lock:
+            self._metrics['logged'] += 1
+            if sampled:
+                self._metrics['sampled'] += 1
+
+    def stop(self):
+        """
+        停止监听线程，退出前写完队列中的记录
+        """
+        with self._start_lock:
+            listener, self._listener = self._listener, None
+            if listener is None or self._pid != os.getpid():
+                return
+            self._pid = None
+        try:
+            listener.stop()
+        except queue.Full:
+            logger.error("请求日志队列已满，未写完的日志被丢弃")
+        if self._output is not None:
+            self._output.flush()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取请求日志的运行指标
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics.update({
+            'enabled': self.enabled,
+            'running': self._listener is not None and self._pid == os.getpid(),
+            'queue_depth': self._queue.qsize(),
+            'queue_maxsize': self.maxsize,
+            'body_sample_rate': self.body_sample_rate,
+            'output': self.path or 'stderr'
+        })
+        return metrics
+
+# 全局请求日志实例
+request_logger = RequestLogger()
@@ -0,0 +1,412 @@
+"""
+使用统计汇总服务
+
+记账路径在写入聊天历史的同一事务中增量更新分钟级和小时级汇总表，
+后台任务把已结束的天合并到天级汇总表，并按保留期清理分钟级和小时级数据。
+统计查询选择能覆盖查询范围的最粗粒度汇总表，查询成本和存储都不随运行时间增长。
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterable
+from sqlalchemy import func, case, select
+from app import db
+from app.config import Config
+from app.models.chat_history import ChatHistory
+from app.models.data_version import DataVersion, STATS_VERSION
+from app.models.usage_rollup import ROLLUP_MODELS, ROLLUP_METRICS, LIVE_GRANULARITIES
+from app.utils.time_buckets import floor_datetime, bucket_expression, parse_bucket, GRANULARITY_DELTAS, validate_granularity
+
+logger = logging.getLogger(__name__)
+
+# 回填时每批写入的汇总行数
+BACKFILL_BATCH_SIZE = 1000
+
+# query_totals 返回的字段与汇总表列的对应关系
+TOTAL_COLUMNS = {
+    'request_count': 'request_count',
+    'tokens_used': 'total_tokens',
+    'prompt_tokens': 'prompt_tokens',
+    'completion_tokens': 'completion_tokens',
+    'cost_nanos': 'cost_nanos'
+}
+
+class RollupService:
+    """
+    使用统计汇总服务类
+    """
+
+    @staticmethod
+    def aggregate_events(events: Iterable[Dict[str, Any]], granularity: str) -> Dict[tuple, Dict[str, int]]:
+        """
+        按 (时间桶, Key, 模型) 汇总聊天事件
+        """
+        rows = {}
+        for event in events:
+            bucket = floor_datetime(event['timestamp'], granularity)
+            row_key = (bucket, event['key_id'], event.get('model_id') or 0)
+            row = rows.get(row_key)
+            if row is None:
+                row = rows[row_key] = dict.fromkeys(ROLLUP_METRICS, 0)
+            row['request_count'] += 1
+            row['prompt_tokens'] += event.get('prompt_tokens') or 0
+            row['completion_tokens'] += event.get('completion_tokens') or 0
+            row['total_tokens'] += event.get('tokens_used') or 0
+            row['error_count'] += 1 if event.get('is_error') else 0
+            row['latency_ms_sum'] += int(event.get('latency_ms') or 0)
+            row['cost_nanos'] += event.get('cost_nanos') or 0
+        return rows
+
+    @staticmethod
+    def record_events(events: List[Dict[str, Any]]):
+        """
+        将一批聊天事件累加到所有汇总表（不提交事务，由调用方统一提交）
+        """
+        if not events:
+            return
+        for granularity in LIVE_GRANULARITIES:
+            rows = RollupService.aggregate_events(events, granularity)
+            RollupService.upsert_rows(ROLLUP_MODELS[granularity], rows)
+
+    @staticmethod
+    def upsert_rows(rollup_model, rows: Dict[tuple, Dict[str, int]], replace: bool = False):
+        """
+        按唯一键写入汇总行，已存在的行在原值上累加（replace=True时直接覆盖）
+        """
+        if not rows:
+            return
+
+        values = [
+            dict(bucket=bucket, key_id=key_id, model_id=model_id, **metrics)
+            for (bucket, key_id, model_id), metrics in rows.items()
+        ]
+        table = rollup_model.__table__
+        dialect_name = db.session.get_bind().dialect.name
+
+        if dialect_name in ('sqlite', 'postgresql'):
+            if dialect_name == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['bucket', 'key_id', 'model_id'],
+                set_={
+                    name: stmt.excluded[name] if replace else table.c[name] + stmt.excluded[name]
+                    for name in ROLLUP_METRICS
+                }
+            )
+            db.session.execute(stmt, values)
+            return
+
+        # 其他数据库：先查询已存在的行再分别更新
+        for value in values:
+            row = rollup_model.query.filter_by(
+                bucket=value['bucket'], key_id=value['key_id'], model_id=value['model_id']
+            ).first()
+            if row is None:
+                db.session.add(rollup_model(**value))
+            else:
+                for name in ROLLUP_METRICS:
+                    setattr(row, name, value[name] if replace else getattr(row, name) + value[name])
+
+    @staticmethod
+    def _history_error_condition():
+        """
+        判断聊天历史是否为失败请求的SQL条件
+        """
+        return ChatHistory.is_error.is_(True)
+
+    @staticmethod
+    def backfill(since: Optional[datetime] = None, granularities: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        从聊天历史重建汇总表
+
+        先删除 since 之后的汇总行，再按时间桶分组聚合聊天历史写入，
+        聚合在数据库中完成，Python端只处理汇总后的行。
+        未指定 since 时从最早的聊天历史开始，已被清理的历史对应的汇总行保持不变。
+        聊天历史不保存延迟，重建的行保留原有的 latency_ms_sum。
+        重建小时级汇总后会重新合并对应的天级汇总。
+        """
+        dialect_name = db.session.get_bind().dialect.name
+        result = {}
+
+        if since is None:
+            since = db.session.query(func.min(ChatHistory.timestamp)).scalar()
+            if since is None:
+                return result
+
+        for granularity in granularities or list(LIVE_GRANULARITIES):
+            rollup_model = ROLLUP_MODELS[granularity]
+            start = floor_datetime(since, granularity)
+
+            latency_sums = {
+                (row.bucket, row.key_id, row.model_id): row.latency_ms_sum
+                for row in db.session.execute(
+                    select(rollup_model.bucket, rollup_model.key_id, rollup_model.model_id, rollup_model.latency_ms_sum)
+                    .where(rollup_model.bucket >= start, rollup_model.latency_ms_sum != 0)
+                )
+            }
+            rollup_model.query.filter(rollup_model.bucket >= start).delete(synchronize_session=False)
+
+            bucket = bucket_expression(ChatHistory.timestamp, granularity, dialect_name).label('bucket')
+            query = select(
+                bucket,
+                ChatHistory.key_id,
+                func.coalesce(ChatHistory.model_id, 0).label('model_id'),
+                func.count(ChatHistory.id).label('request_count'),
+                func.coalesce(func.sum(ChatHistory.tokens_used), 0).label('total_tokens'),
+                func.coalesce(func.sum(ChatHistory.prompt_tokens), 0).label('prompt_tokens'),
+                func.coalesce(func.sum(ChatHistory.completion_tokens), 0).label('completion_tokens'),
+                func.coalesce(func.sum(ChatHistory.cost_nanos), 0).label('cost_nanos'),
+                func.sum(case((RollupService._history_error_condition(), 1), else_=0)).label('error_count')
+            ).where(
+                ChatHistory.timestamp >= start
+            ).group_by(
+                bucket, ChatHistory.key_id, func.coalesce(ChatHistory.model_id, 0)
+            )
+
+            rows = {}
+            written = 0
+            for item in db.session.execute(query.execution_options(yield_per=BACKFILL_BATCH_SIZE)):
+                row_key = (parse_bucket(item.bucket), item.key_id, item.model_id)
+                metrics = dict.fromkeys(ROLLUP_METRICS, 0)
+                metrics.update(
+                    request_count=item.request_count,
+                    total_tokens=item.total_tokens,
+                    prompt_tokens=item.prompt_tokens,
+                    completion_tokens=item.completion_tokens,
+                    cost_nanos=item.cost_nanos,
+                    error_count=item.error_count,
+                    latency_ms_sum=latency_sums.get(row_key, 0)
+                )
+                rows[row_key] = metrics
+                if len(rows) >= BACKFILL_BATCH_SIZE:
+                    RollupService.upsert_rows(rollup_model, rows)
+                    written += len(rows)
+                    rows = {}
+            RollupService.upsert_rows(rollup_model, rows)
+            written += len(rows)
+            DataVersion.bump(STATS_VERSION)
+            db.session.commit()
+
+            result[granularity] = written
+            logger.info(f"{granularity} 汇总表回填完成，写入 {written} 行")
+
+        if 'hour' in result:
+            result['day'] = RollupService.merge_days(since=since)
+
+        return result
+
+    # ------------------------------------------------------------------
+    # 降采样
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def get_merged_until() -> Optional[datetime]:
+        """
+        天级汇总已覆盖到的时间（不含），之后的数据仍在小时级汇总中
+        """
+        rollup_model = ROLLUP_MODELS['day']
+        last_day = db.session.query(func.max(rollup_model.bucket)).scalar()
+        return parse_bucket(last_day) + GRANULARITY_DELTAS['day'] if last_day else None
+
+    @staticmethod
+    def merge_days(since: Optional[datetime] = None) -> int:
+        """
+        把已结束的天从小时级汇总合并到天级汇总
+
+        合并结果直接覆盖天级汇总行，重复执行是幂等的；
+        默认从最后一个已合并的天重新开始，补上合并之后才写入的小时数据。
+        """
+        hour_model = ROLLUP_MODELS['hour']
+        day_model = ROLLUP_MODELS['day']
+
+        if since is None:
+            last_day = db.session.query(func.max(day_model.bucket)).scalar()
+            since = parse_bucket(last_day) if last_day else db.session.query(func.min(hour_model.bucket)).scalar()
+            if since is None:
+                return 0
+        start = floor_datetime(parse_bucket(since), 'day')
+        end = floor_datetime(datetime.utcnow(), 'day')
+        if start >= end:
+            return 0
+
+        dialect_name = db.session.get_bind().dialect.name
+        bucket = bucket_expression(hour_model.bucket, 'day', dialect_name).label('bucket')
+        query = db.session.query(
+            bucket,
+            hour_model.key_id,
+            hour_model.model_id,
+            *[func.sum(getattr(hour_model, name)).label(name) for name in ROLLUP_METRICS]
+        ).filter(
+            hour_model.bucket >= start,
+            hour_model.bucket < end
+        ).group_by(
+            bucket, hour_model.key_id, hour_model.model_id
+        )
+
+        rows = {
+            (parse_bucket(item.bucket), item.key_id, item.model_id): {
+                name: getattr(item, name) or 0 for name in ROLLUP_METRICS
+            } for item in query.all()
+        }
+        RollupService.upsert_rows(day_model, rows, replace=True)
+        db.session.commit()
+        logger.info(f"合并 {len(rows)} 行天级汇总（{start.date()} 至 {end.date()}）")
+        return len(rows)
+
+    @staticmethod
+    def get_retention_cutoffs(now: Optional[datetime] = None) -> Dict[str, datetime]:
+        """
+        各汇总粒度的保留起点，天级汇总永久保留
+        """
+        now = now or datetime.utcnow()
+        return {
+            'minute': floor_datetime(now - timedelta(hours=Config.ROLLUP_MINUTE_RETENTION_HOURS), 'minute'),
+            'hour': floor_datetime(now - timedelta(days=Config.ROLLUP_HOUR_RETENTION_DAYS), 'day')
+        }
+
+    @staticmethod
+    def downsample() -> Dict[str, Any]:
+        """
+        降采样任务：合并天级汇总，然后清理超出保留期的分钟级和小时级汇总
+        """
+        report = {'merged_day_rows': RollupService.merge_days(), 'pruned': {}}
+
+        cutoffs = RollupService.get_retention_cutoffs()
+        merged_until = RollupService.get_merged_until()
+        for granularity, cutoff in cutoffs.items():
+            if granularity == 'hour':
+                # 还没合并到天级汇总的小时数据不能删除
+                cutoff = min(cutoff, merged_until) if merged_until else None
+            if cutoff is None:
+                report['pruned'][granularity] = 0
+                continue
+            rollup_model = ROLLUP_MODELS[granularity]
+            report['pruned'][granularity] = rollup_model.query.filter(
+                rollup_model.bucket < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+        if report['merged_day_rows'] or any(report['pruned'].values()):
+            DataVersion.bump(STATS_VERSION)
+            db.session.commit()
+
+        logger.info(f"汇总表降采样完成: {report}")
+        return report
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def pick_tier(start: datetime, granularity: str, now: Optional[datetime] = None) -> str:
+        """
+        选择能覆盖查询起点、且不细于查询粒度的最粗汇总表
+        """
+        validate_granularity(granularity)
+        cutoffs = RollupService.get_retention_cutoffs(now)
+        candidates = [g for g in ROLLUP_MODELS if GRANULARITY_DELTAS[g] <= GRANULARITY_DELTAS[granularity]]
+        for tier in reversed(candidates):
+            if tier not in cutoffs or start >= cutoffs[tier]:
+                return tier
+        # 查询起点早于所有可用粒度的保留期时，使用最粗的可用粒度
+        return candidates[-1]
+
+    @staticmethod
+    def query_totals(start: datetime, end: Optional[datetime] = None, **filters) -> Dict[str, int]:
+        """
+        汇总时间范围内的请求数、token数和费用（纳美元）
+
+        使用保留期能覆盖起点的最细汇总表，保证范围边界的精度。
+        """
+        end = end or datetime.utcnow() + GRANULARITY_DELTAS['minute']
+        cutoffs = RollupService.get_retention_cutoffs()
+        tier = next((g for g in LIVE_GRANULARITIES if start >= cutoffs[g]), 'day')
+
+        ranges = [(tier, start, end)]
+        if tier == 'day':
+            merged_until = RollupService.get_merged_until() or start
+            ranges = [('day', start, min(end, merged_until)), ('hour', max(start, merged_until), end)]
+
+        totals = dict.fromkeys(TOTAL_COLUMNS, 0)
+        for tier, range_start, range_end in ranges:
+            if range_start >= range_end:
+                continue
+            rollup_model = ROLLUP_MODELS[tier]
+            query = db.session.query(
+                *[func.coalesce(func.sum(getattr(rollup_model, column)), 0).label(name)
+                  for name, column in TOTAL_COLUMNS.items()]
+            ).filter(
+                rollup_model.bucket >= floor_datetime(range_start, tier),
+                rollup_model.bucket < range_end
+            )
+            for name, value in filters.items():
+                query = query.filter(getattr(rollup_model, name) == value)
+            row = query.first()
+            for name in TOTAL_COLUMNS:
+                totals[name] += getattr(row, name)
+        return totals
+
+    @staticmethod
+    def query_series(start: datetime, end: datetime, granularity: str,
+                     group_by: Optional[str] = None, **filters) -> Dict[Any, tuple]:
+        """
+        按粒度分组查询时间序列，返回 {时间桶: (请求数, token数)}
+
+        指定 group_by（key_id 或 model_id）时返回 {(分组值, 时间桶): (请求数, token数)}；
+        过滤条件的值为列表时按 IN 过滤。
+        自动选择最便宜的汇总表；天级汇总尚未合并的部分从小时级汇总补齐。
+        """
+        tier = RollupService.pick_tier(start, granularity)
+        if tier != 'day':
+            return RollupService._query_tier(tier, start, end, granularity, group_by, **filters)
+
+        merged_until = RollupService.get_merged_until()
+        if merged_until is None or merged_until <= start:
+            return RollupService._query_tier('hour', start, end, granularity, group_by, **filters)
+
+        series = RollupService._query_tier('day', start, min(end, merged_until), granularity, group_by, **filters)
+        if merged_until < end:
+            series.update(RollupService._query_tier('hour', merged_until, end, granularity, group_by, **filters))
+        return series
+
+    @staticmethod
+    def _query_tier(tier: str, start: datetime, end: datetime, granularity: str,
+                    group_by: Optional[str] = None, **filters) -> Dict[Any, tuple]:
+        """
+        在指定汇总表上按粒度分组查询
+        """
+        rollup_model = ROLLUP_MODELS[tier]
+        if granularity == tier:
+            bucket = rollup_model.bucket
+        else:
+            dialect_name = db.session.get_bind().dialect.name
+            bucket = bucket_expression(rollup_model.bucket, granularity, dialect_name)
+        bucket = bucket.label('bucket')
+        group_columns = [getattr(rollup_model, group_by).label('group_value')] if group_by else []
+
+        query = db.session.query(
+            *group_columns,
+            bucket,
+            func.sum(rollup_model.request_count).label('request_count'),
+            func.sum(rollup_model.total_tokens).label('tokens_used')
+        ).filter(
+            rollup_model.bucket >= floor_datetime(start, tier),
+            rollup_model.bucket < end
+        )
+        for name, value in filters.items():
+            column = getattr(rollup_model, name)
+            query = query.filter(column.in_(value) if isinstance(value, (list, tuple, set)) else column == value)
+        query = query.group_by(*group_columns, bucket)
+
+        if group_by:
+            return {
+                (item.group_value, parse_bucket(item.bucket)): (item.request_count or 0, item.tokens_used or 0)
+                for item in query.all()
+            }
+        return {
+            parse_bucket(item.bucket): (item.request_count or 0, item.tokens_used or 0)
+            for item in query.all()
+        }
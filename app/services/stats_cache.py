@@ -0,0 +1,209 @@
+"""
+统计结果缓存
+
+按接口和参数缓存统计结果。缓存项在以下情况下视为过期：
+- 统计数据版本号变化（有新的写入）
+- 超过 STATS_CACHE_TIMEOUT（按时间滚动的统计窗口需要定期重算）
+
+过期但未超过 STATS_CACHE_STALE_TIMEOUT 的缓存项直接返回旧值，同时在后台线程重新计算，
+页面加载耗时不受统计查询影响。
+"""
+
+import time
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from typing import Dict, Any, Callable
+from flask import current_app, has_app_context
+from app.config import Config
+from app.models.data_version import DataVersion, STATS_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    """
+    缓存项
+    """
+    __slots__ = ('value', 'version', 'computed_at')
+
+    def __init__(self, value, version: int, computed_at: float):
+        self.value = value
+        self.version = version
+        self.computed_at = computed_at
+
+
+class StatsCache:
+    """
+    带版本号的统计结果缓存
+    """
+
+    def __init__(self):
+        """
+        初始化缓存
+        """
+        self.enabled = Config.STATS_CACHE_ENABLED
+        self.timeout = Config.STATS_CACHE_TIMEOUT
+        self.stale_timeout = Config.STATS_CACHE_STALE_TIMEOUT
+        self.max_entries = Config.STATS_CACHE_MAX_ENTRIES
+
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def cached(self, endpoint: str):
+        """
+        缓存装饰器，按接口名和调用参数缓存结果
+        """
+        def decorator(func: Callable):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.get_or_compute(endpoint, (args, tuple(sorted(kwargs.items()))),
+                                           lambda: func(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def get_or_compute(self, endpoint: str, params, compute: Callable[[], Any]):
+        """
+        读取缓存，未命中时计算，过期时返回旧值并在后台刷新
+        """
+        if not self.enabled or not has_app_context():
+            return compute()
+
+        key = (endpoint, params)
+        version = DataVersion.get(STATS_VERSION)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            age = now - entry.computed_at
+            if entry.version == version and age < self.timeout:
+                self._count(endpoint, 'hits')
+                return entry.value
+            if age < self.stale_timeout:
+                self._count(endpoint, 'stale_hits')
+                self._refresh_in_background(endpoint, key, compute)
+                return entry.value
+
+        self._count(endpoint, 'misses')
+        return self._compute_and_store(endpoint, key, compute, version)
+
+    def _compute_and_store(self, endpoint: str, key, compute: Callable[[], Any], version: int):
+        """
+        计算并写入缓存；版本号在计算前读取，计算期间的写入会在下次读取时触发刷新
+        """
+        started = time.perf_counter()
+        value = compute()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self._entries[key] = _CacheEntry(value, version, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            counters = self._counters.setdefault(endpoint, self._new_counters())
+            counters['computes'] += 1
+            counters['compute_ms_total'] += elapsed_ms
+            counters['last_compute_ms'] = elapsed_ms
+        return value
+
+    def _refresh_in_background(self, endpoint: str, key, compute: Callable[[], Any]):
+        """
+        在后台线程重新计算缓存项，同一缓存项同时只刷新一次
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        app = current_app._get_current_object()
+
+        def refresh():
+            try:
+                with app.app_context():
+                    version = DataVersion.get(STATS_VERSION)
+                    self._compute_and_store(endpoint, key, compute, version)
+                self._count(endpoint, 'refreshes')
+            except Exception as e:
+                self._count(endpoint, 'refresh_errors')
+                logger.error(f"后台刷新统计缓存 {endpoint} 失败: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f'stats-cache-{endpoint}', daemon=True).start()
+
+    @staticmethod
+    def _new_counters() -> Dict[str, Any]:
+        """
+        新建单个接口的计数器
+        """
+        return {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'computes': 0,
+            'compute_ms_total': 0.0,
+            'last_compute_ms': 0.0
+        }
+
+    def _count(self, endpoint: str, name: str):
+        """
+        累加接口计数器
+        """
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, self._new_counters())
+            counters[name] += 1
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存命中统计
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self._counters.items():
+                item = dict(counters)
+                lookups = item['hits'] + item['stale_hits'] + item['misses']
+                compute_ms_total = item.pop('compute_ms_total')
+                item['hit_rate'] = round((item['hits'] + item['stale_hits']) / lookups, 4) if lookups else 0.0
+                item['avg_compute_ms'] = round(compute_ms_total / item['computes'], 3) if item['computes'] else 0.0
+                item['last_compute_ms'] = round(item['last_compute_ms'], 3)
+                endpoints[endpoint] = item
+            entries = len(self._entries)
+            refreshing = len(self._refreshing)
+
+        totals = {
+            name: sum(item[name] for item in endpoints.values())
+            for name in ('hits', 'stale_hits', 'misses', 'refreshes', 'refresh_errors')
+        }
+        lookups = totals['hits'] + totals['stale_hits'] + totals['misses']
+        totals['hit_rate'] = round((totals['hits'] + totals['stale_hits']) / lookups, 4) if lookups else 0.0
+        return {
+            'enabled': self.enabled,
+            'timeout': self.timeout,
+            'stale_timeout': self.stale_timeout,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'refreshing': refreshing,
+            'data_version': DataVersion.get(STATS_VERSION) if has_app_context() else None,
+            'totals': totals,
+            'endpoints': endpoints
+        }
+
+# 全局统计缓存实例
+stats_cache = StatsCache()
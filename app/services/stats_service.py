@@ -4,12 +4,36 @@
 
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select
 from app import db
 from app.models.key import Key
 from app.models.model import Model
 from app.models.usage_stats import UsageStat
 from app.models.chat_history import ChatHistory
+from app.services.rollup_service import RollupService
+from app.services.latency_service import LatencyService
+from app.services.stats_cache import stats_cache
+from app.utils.db_routing import read_only
+from app.utils.time_buckets import floor_datetime, bucket_range, validate_granularity
+from app.utils.latency_histogram import LatencyHistogram
+from app.utils.pricing import format_cost
+
+# 单次趋势查询最多返回的时间桶数量
+MAX_SERIES_BUCKETS = 5000
+
+# 批量统计的分页和排序
+MAX_PAGE_SIZE = 200
+SORT_ORDERS = ('asc', 'desc')
+
+# 延迟统计支持的分组方式
+LATENCY_GROUPS = ('key', 'model')
+
+# 趋势数据的时间桶标签格式
+SERIES_LABEL_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M',
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d'
+}
 
 class StatsService:
     """
@@ -17,24 +41,28 @@ class StatsService:
     """
     
     @staticmethod
+    @read_only
     def get_database_info() -> Dict[str, Any]:
         """
         获取数据库基本信息
         """
         try:
-            info = {
-                'keys_count': Key.query.count(),
-                'models_count': Model.query.count(),
-                'usage_stats_count': UsageStat.query.count(),
-                'chat_history_count': ChatHistory.query.count(),
-                'active_keys_count': Key.query.filter_by(status='active').count(),
-                'total_usage_count': sum(key.usage_count for key in Key.query.all())
-            }
-            return info
+            # 所有计数在一条语句中以标量子查询完成，不加载ORM对象
+            row = db.session.execute(select(
+                select(func.count(Key.id)).scalar_subquery().label('keys_count'),
+                select(func.count(Model.id)).scalar_subquery().label('models_count'),
+                select(func.count(UsageStat.id)).scalar_subquery().label('usage_stats_count'),
+                select(func.count(ChatHistory.id)).scalar_subquery().label('chat_history_count'),
+                select(func.count(Key.id)).where(Key.status == 'active').scalar_subquery().label('active_keys_count'),
+                select(func.coalesce(func.sum(Key.usage_count), 0)).scalar_subquery().label('total_usage_count')
+            )).one()
+            return dict(row._mapping)
         except Exception as e:
             raise Exception(f"获取数据库信息失败: {str(e)}")
     
     @staticmethod
+    @stats_cache.cached('overview')
+    @read_only
     def get_overview_stats() -> Dict[str, Any]:
         """
         获取系统概览统计
@@ -49,9 +77,9 @@ class StatsService:
                 func.sum(UsageStat.usage_count).label('total_usage'),
                 func.sum(UsageStat.total_tokens).label('total_tokens')
             ).join(
-                UsageStat, Model.model_name == UsageStat.model
+                UsageStat, Model.id == UsageStat.model_id
             ).group_by(
-                Model.model_name
+                Model.id, Model.model_name
             ).all()
             
             # 获取每个Key的使用次数
@@ -68,21 +96,11 @@ class StatsService:
             
             # 获取过去24小时的使用统计
             yesterday = datetime.utcnow() - timedelta(days=1)
-            daily_usage = db.session.query(
-                func.count(ChatHistory.id).label('request_count'),
-                func.sum(ChatHistory.tokens_used).label('tokens_used')
-            ).filter(
-                ChatHistory.timestamp >= yesterday
-            ).first()
+            daily_usage = RollupService.query_totals(yesterday)
             
             # 获取过去7天的使用统计
             week_ago = datetime.utcnow() - timedelta(days=7)
-            weekly_usage = db.session.query(
-                func.count(ChatHistory.id).label('request_count'),
-                func.sum(ChatHistory.tokens_used).label('tokens_used')
-            ).filter(
-                ChatHistory.timestamp >= week_ago
-            ).first()
+            weekly_usage = RollupService.query_totals(week_ago)
             
             return {
                 'database_info': db_info,
@@ -104,18 +122,20 @@ class StatsService:
                 ],
                 'recent_chats': [chat.to_dict() for chat in recent_chats],
                 'daily_usage': {
-                    'request_count': daily_usage.request_count or 0,
-                    'tokens_used': daily_usage.tokens_used or 0
+                    'request_count': daily_usage['request_count'],
+                    'tokens_used': daily_usage['tokens_used']
                 },
                 'weekly_usage': {
-                    'request_count': weekly_usage.request_count or 0,
-                    'tokens_used': weekly_usage.tokens_used or 0
+                    'request_count': weekly_usage['request_count'],
+                    'tokens_used': weekly_usage['tokens_used']
                 }
             }
         except Exception as e:
             raise Exception(f"获取系统概览统计失败: {str(e)}")
     
     @staticmethod
+    @stats_cache.cached('usage')
+    @read_only
     def get_usage_stats(period: str = 'all') -> Dict[str, Any]:
         """
         获取使用统计
@@ -125,7 +145,8 @@ class StatsService:
             total_usage = db.session.query(
                 func.sum(UsageStat.usage_count).label('total_usage'),
                 func.sum(UsageStat.total_tokens).label('total_tokens'),
-                func.count(UsageStat.id).label('total_requests')
+                func.count(UsageStat.id).label('total_requests'),
+                *StatsService._cost_columns()
             ).first()
             
             # 获取按模型分组的统计
@@ -133,11 +154,12 @@ class StatsService:
                 Model.model_name,
                 func.sum(UsageStat.usage_count).label('usage_count'),
                 func.sum(UsageStat.total_tokens).label('tokens_used'),
-                func.count(UsageStat.id).label('request_count')
+                func.count(UsageStat.id).label('request_count'),
+                *StatsService._cost_columns()
             ).join(
-                UsageStat, Model.model_name == UsageStat.model
+                UsageStat, Model.id == UsageStat.model_id
             ).group_by(
-                Model.model_name
+                Model.id, Model.model_name
             ).all()
             
             # 获取按Key分组的统计
@@ -146,7 +168,8 @@ class StatsService:
                 Key.name,
                 func.sum(UsageStat.usage_count).label('usage_count'),
                 func.sum(UsageStat.total_tokens).label('tokens_used'),
-                func.count(UsageStat.id).label('request_count')
+                func.count(UsageStat.id).label('request_count'),
+                *StatsService._cost_columns()
             ).join(
                 UsageStat, Key.id == UsageStat.key_id
             ).group_by(
@@ -163,31 +186,31 @@ class StatsService:
                 else:  # monthly
                     start_time = datetime.utcnow() - timedelta(days=30)
                 
-                period_usage = db.session.query(
-                    func.count(ChatHistory.id).label('request_count'),
-                    func.sum(ChatHistory.tokens_used).label('tokens_used')
-                ).filter(
-                    ChatHistory.timestamp >= start_time
-                ).first()
+                period_usage = RollupService.query_totals(start_time)
                 
                 time_stats = {
                     'period': period,
-                    'request_count': period_usage.request_count or 0,
-                    'tokens_used': period_usage.tokens_used or 0
+                    'request_count': period_usage['request_count'],
+                    'tokens_used': period_usage['tokens_used'],
+                    'prompt_tokens': period_usage['prompt_tokens'],
+                    'completion_tokens': period_usage['completion_tokens'],
+                    'cost': format_cost(period_usage['cost_nanos'])
                 }
             
             return {
                 'total_usage': {
                     'total_usage': total_usage.total_usage or 0,
                     'total_tokens': total_usage.total_tokens or 0,
-                    'total_requests': total_usage.total_requests or 0
+                    'total_requests': total_usage.total_requests or 0,
+                    **StatsService._cost_fields(total_usage)
                 },
                 'model_stats': [
                     {
                         'model_name': item.model_name,
                         'usage_count': item.usage_count or 0,
                         'tokens_used': item.tokens_used or 0,
-                        'request_count': item.request_count or 0
+                        'request_count': item.request_count or 0,
+                        **StatsService._cost_fields(item)
                     } for item in model_stats
                 ],
                 'key_stats': [
@@ -196,7 +219,8 @@ class StatsService:
                         'key_name': item.name,
                         'usage_count': item.usage_count or 0,
                         'tokens_used': item.tokens_used or 0,
-                        'request_count': item.request_count or 0
+                        'request_count': item.request_count or 0,
+                        **StatsService._cost_fields(item)
                     } for item in key_stats
                 ],
                 'time_stats': time_stats
@@ -205,6 +229,30 @@ class StatsService:
             raise Exception(f"获取使用统计失败: {str(e)}")
     
     @staticmethod
+    def _cost_columns():
+        """
+        输入输出token和费用的汇总列
+        """
+        return (
+            func.sum(UsageStat.prompt_tokens).label('prompt_tokens'),
+            func.sum(UsageStat.completion_tokens).label('completion_tokens'),
+            func.sum(UsageStat.cost_nanos).label('cost_nanos')
+        )
+    
+    @staticmethod
+    def _cost_fields(row) -> Dict[str, Any]:
+        """
+        从汇总行中取出输入输出token和费用（美元金额字符串）
+        """
+        return {
+            'prompt_tokens': row.prompt_tokens or 0,
+            'completion_tokens': row.completion_tokens or 0,
+            'cost': format_cost(row.cost_nanos)
+        }
+    
+    @staticmethod
+    @stats_cache.cached('key')
+    @read_only
     def get_key_stats(key_id: int) -> Dict[str, Any]:
         """
         获取Key统计
@@ -220,34 +268,13 @@ class StatsService:
                 UsageStat.usage_count,
                 UsageStat.total_tokens
             ).join(
-                UsageStat, Model.model_name == UsageStat.model
+                UsageStat, Model.id == UsageStat.model_id
             ).filter(
                 UsageStat.key_id == key_id
             ).all()
             
             # 获取Key的每日使用趋势
-            daily_trends = []
-            for i in range(7):  # 获取过去7天的数据
-                day_start = datetime.utcnow() - timedelta(days=i+1)
-                day_end = datetime.utcnow() - timedelta(days=i)
-                
-                day_usage = db.session.query(
-                    func.count(ChatHistory.id).label('request_count'),
-                    func.sum(ChatHistory.tokens_used).label('tokens_used')
-                ).filter(
-                    ChatHistory.key_id == key_id,
-                    ChatHistory.timestamp >= day_start,
-                    ChatHistory.timestamp < day_end
-                ).first()
-                
-                daily_trends.append({
-                    'date': day_start.strftime('%Y-%m-%d'),
-                    'request_count': day_usage.request_count or 0,
-                    'tokens_used': day_usage.tokens_used or 0
-                })
-            
-            # 反转列表，使日期从早到晚
-            daily_trends.reverse()
+            daily_trends = StatsService._get_daily_trends(key_id=key_id)
             
             return {
                 'key_info': key.to_dict(),
@@ -264,6 +291,8 @@ class StatsService:
             raise Exception(f"获取Key统计失败: {str(e)}")
     
     @staticmethod
+    @stats_cache.cached('model')
+    @read_only
     def get_model_stats(model_name: str) -> Dict[str, Any]:
         """
         获取模型统计
@@ -282,32 +311,11 @@ class StatsService:
             ).join(
                 UsageStat, Key.id == UsageStat.key_id
             ).filter(
-                UsageStat.model == model_name
+                UsageStat.model_id == model.id
             ).all()
             
             # 获取模型的每日使用趋势
-            daily_trends = []
-            for i in range(7):  # 获取过去7天的数据
-                day_start = datetime.utcnow() - timedelta(days=i+1)
-                day_end = datetime.utcnow() - timedelta(days=i)
-                
-                day_usage = db.session.query(
-                    func.count(ChatHistory.id).label('request_count'),
-                    func.sum(ChatHistory.tokens_used).label('tokens_used')
-                ).filter(
-                    ChatHistory.model == model_name,
-                    ChatHistory.timestamp >= day_start,
-                    ChatHistory.timestamp < day_end
-                ).first()
-                
-                daily_trends.append({
-                    'date': day_start.strftime('%Y-%m-%d'),
-                    'request_count': day_usage.request_count or 0,
-                    'tokens_used': day_usage.tokens_used or 0
-                })
-            
-            # 反转列表，使日期从早到晚
-            daily_trends.reverse()
+            daily_trends = StatsService._get_daily_trends(model_id=model.id)
             
             return {
                 'model_info': model.to_dict(),
@@ -325,38 +333,314 @@ class StatsService:
             raise Exception(f"获取模型统计失败: {str(e)}")
     
     @staticmethod
+    @stats_cache.cached('keys')
+    @read_only
+    def get_all_key_stats(page: int = 1, per_page: int = 50, sort: str = 'id', order: str = 'asc') -> Dict[str, Any]:
+        """
+        分页获取所有Key的统计，查询次数与Key数量无关
+        """
+        tokens_used = db.session.query(
+            UsageStat.key_id,
+            func.sum(UsageStat.total_tokens).label('tokens_used')
+        ).group_by(UsageStat.key_id).subquery()
+        tokens_column = func.coalesce(tokens_used.c.tokens_used, 0)
+        
+        sort_columns = {
+            'id': Key.id,
+            'name': Key.name,
+            'status': Key.status,
+            'usage_count': Key.usage_count,
+            'last_used': Key.last_used,
+            'tokens_used': tokens_column
+        }
+        page, per_page, ordering = StatsService._paging_args(page, per_page, sort, order, sort_columns)
+        
+        total = db.session.query(func.count(Key.id)).scalar()
+        rows = db.session.query(
+            Key, tokens_column.label('tokens_used')
+        ).outerjoin(
+            tokens_used, tokens_used.c.key_id == Key.id
+        ).order_by(
+            ordering, Key.id.asc()
+        ).offset((page - 1) * per_page).limit(per_page).all()
+        key_ids = [key.id for key, _ in rows]
+        
+        # 当前页所有Key的模型使用分布
+        distributions = {key_id: [] for key_id in key_ids}
+        if key_ids:
+            for item in db.session.query(
+                UsageStat.key_id,
+                Model.model_name,
+                UsageStat.usage_count,
+                UsageStat.total_tokens
+            ).join(
+                UsageStat, Model.id == UsageStat.model_id
+            ).filter(
+                UsageStat.key_id.in_(key_ids)
+            ).all():
+                distributions[item.key_id].append({
+                    'model_name': item.model_name,
+                    'usage_count': item.usage_count,
+                    'tokens_used': item.total_tokens
+                })
+        
+        # 当前页所有Key的每日使用趋势
+        trends = StatsService._get_daily_trends_batch('key_id', key_ids)
+        
+        return {
+            'items': [
+                {
+                    'key_info': key.to_dict(),
+                    'tokens_used': tokens,
+                    'model_distribution': distributions[key.id],
+                    'daily_trends': trends[key.id]
+                } for key, tokens in rows
+            ],
+            'pagination': StatsService._pagination(page, per_page, total, sort, order)
+        }
+    
+    @staticmethod
+    @stats_cache.cached('models')
+    @read_only
+    def get_all_model_stats(page: int = 1, per_page: int = 50, sort: str = 'id', order: str = 'asc') -> Dict[str, Any]:
+        """
+        分页获取所有模型的统计，查询次数与模型数量无关
+        """
+        usage = db.session.query(
+            UsageStat.model_id,
+            func.sum(UsageStat.usage_count).label('usage_count'),
+            func.sum(UsageStat.total_tokens).label('tokens_used')
+        ).filter(UsageStat.model_id.isnot(None)).group_by(UsageStat.model_id).subquery()
+        usage_column = func.coalesce(usage.c.usage_count, 0)
+        tokens_column = func.coalesce(usage.c.tokens_used, 0)
+        
+        sort_columns = {
+            'id': Model.id,
+            'model_name': Model.model_name,
+            'usage_count': usage_column,
+            'tokens_used': tokens_column
+        }
+        page, per_page, ordering = StatsService._paging_args(page, per_page, sort, order, sort_columns)
+        
+        total = db.session.query(func.count(Model.id)).scalar()
+        rows = db.session.query(
+            Model, usage_column.label('usage_count'), tokens_column.label('tokens_used')
+        ).outerjoin(
+            usage, usage.c.model_id == Model.id
+        ).order_by(
+            ordering, Model.id.asc()
+        ).offset((page - 1) * per_page).limit(per_page).all()
+        model_ids = [model.id for model, _, _ in rows]
+        
+        # 当前页所有模型的Key使用分布
+        distributions = {model_id: [] for model_id in model_ids}
+        if model_ids:
+            for item in db.session.query(
+                UsageStat.model_id,
+                Key.id,
+                Key.name,
+                UsageStat.usage_count,
+                UsageStat.total_tokens
+            ).join(
+                UsageStat, Key.id == UsageStat.key_id
+            ).filter(
+                UsageStat.model_id.in_(model_ids)
+            ).all():
+                distributions[item.model_id].append({
+                    'key_id': item.id,
+                    'key_name': item.name,
+                    'usage_count': item.usage_count,
+                    'tokens_used': item.total_tokens
+                })
+        
+        # 当前页所有模型的每日使用趋势
+        trends = StatsService._get_daily_trends_batch('model_id', model_ids)
+        
+        return {
+            'items': [
+                {
+                    'model_info': model.to_dict(),
+                    'usage_count': usage_count,
+                    'tokens_used': tokens,
+                    'key_distribution': distributions[model.id],
+                    'daily_trends': trends[model.id]
+                } for model, usage_count, tokens in rows
+            ],
+            'pagination': StatsService._pagination(page, per_page, total, sort, order)
+        }
+    
+    @staticmethod
+    def _paging_args(page: int, per_page: int, sort: str, order: str, sort_columns: Dict[str, Any]):
+        """
+        校验分页和排序参数，返回 (页码, 每页数量, 排序表达式)
+        """
+        if sort not in sort_columns:
+            raise ValueError(f"不支持的排序字段: {sort}，可选: {', '.join(sort_columns)}")
+        if order not in SORT_ORDERS:
+            raise ValueError(f"不支持的排序方向: {order}")
+        page = max(page or 1, 1)
+        per_page = min(max(per_page or 1, 1), MAX_PAGE_SIZE)
+        column = sort_columns[sort]
+        return page, per_page, column.desc() if order == 'desc' else column.asc()
+    
+    @staticmethod
+    def _pagination(page: int, per_page: int, total: int, sort: str, order: str) -> Dict[str, Any]:
+        """
+        生成分页信息
+        """
+        return {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page,
+            'sort': sort,
+            'order': order
+        }
+    
+    @staticmethod
+    @stats_cache.cached('series')
+    @read_only
+    def get_usage_series(start: datetime, end: datetime, granularity: str = 'hour',
+                         key_id: Optional[int] = None, model_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取任意时间范围、任意粒度的使用趋势
+
+        一次分组查询取出有数据的时间桶，再在Python端补齐空桶。
+        """
+        validate_granularity(granularity)
+        if start >= end:
+            raise ValueError("开始时间必须早于结束时间")
+        buckets = bucket_range(start, end, granularity)
+        if len(buckets) > MAX_SERIES_BUCKETS:
+            raise ValueError(f"时间桶数量 {len(buckets)} 超过上限 {MAX_SERIES_BUCKETS}，请使用更粗的粒度")
+        
+        filters = {}
+        if key_id is not None:
+            filters['key_id'] = key_id
+        if model_id is not None:
+            filters['model_id'] = model_id
+        series = RollupService.query_series(start, end, granularity, **filters)
+        
+        label_format = SERIES_LABEL_FORMATS[granularity]
+        result = []
+        for bucket_start in buckets:
+            request_count, tokens_used = series.get(bucket_start, (0, 0))
+            result.append({
+                'bucket': bucket_start.strftime(label_format),
+                'start': bucket_start.isoformat(),
+                'request_count': request_count,
+                'tokens_used': tokens_used
+            })
+        return result
+    
+    @staticmethod
+    @stats_cache.cached('latency')
+    @read_only
+    def get_latency_stats(start: datetime, end: Optional[datetime] = None, key_id: Optional[int] = None,
+                          model_id: Optional[int] = None, group: Optional[str] = None) -> Dict[str, Any]:
+        """
+        获取时间范围内的延迟百分位（上游总耗时、上游首字节耗时、代理自身耗时）
+
+        指定 group（key 或 model）时同时返回每个Key或模型的百分位，一次分组查询完成。
+        """
+        if group is not None and group not in LATENCY_GROUPS:
+            raise ValueError(f"不支持的分组方式: {group}，可选值: {', '.join(LATENCY_GROUPS)}")
+        if end is not None and start >= end:
+            raise ValueError("开始时间必须早于结束时间")
+        
+        filters = {}
+        if key_id is not None:
+            filters['key_id'] = key_id
+        if model_id is not None:
+            filters['model_id'] = model_id
+        
+        if group is None:
+            histograms = LatencyService.get_histograms(start, end, **filters)
+            return {'overall': LatencyService.summarize(histograms)}
+        
+        group_by = f'{group}_id'
+        groups = LatencyService.get_histograms(start, end, group_by=group_by, **filters)
+        
+        # 合并各分组的直方图得到总体百分位
+        overall = {}
+        for histograms in groups.values():
+            for metric, histogram in histograms.items():
+                overall.setdefault(metric, LatencyHistogram()).merge(histogram)
+        
+        if group == 'key':
+            names = dict(db.session.query(Key.id, Key.name).filter(Key.id.in_(groups)).all()) if groups else {}
+        else:
+            names = dict(db.session.query(Model.id, Model.model_name).filter(Model.id.in_(groups)).all()) if groups else {}
+        
+        return {
+            'overall': LatencyService.summarize(overall),
+            'items': [
+                {
+                    group_by: group_id,
+                    'name': names.get(group_id),
+                    'latency': LatencyService.summarize(histograms)
+                } for group_id, histograms in sorted(groups.items())
+            ]
+        }
+    
+    @staticmethod
+    @read_only
     def get_hourly_usage(hours: int = 24) -> List[Dict[str, Any]]:
         """
         获取每小时使用统计
         """
         try:
-            hourly_stats = []
-            now = datetime.utcnow()
-            
-            for i in range(hours):
-                hour_start = now - timedelta(hours=i+1)
-                hour_end = now - timedelta(hours=i)
-                
-                hour_usage = db.session.query(
-                    func.count(ChatHistory.id).label('request_count'),
-                    func.sum(ChatHistory.tokens_used).label('tokens_used')
-                ).filter(
-                    ChatHistory.timestamp >= hour_start,
-                    ChatHistory.timestamp < hour_end
-                ).first()
-                
-                hourly_stats.append({
-                    'hour': hour_start.strftime('%Y-%m-%d %H:00'),
-                    'request_count': hour_usage.request_count or 0,
-                    'tokens_used': hour_usage.tokens_used or 0
-                })
-            
-            # 反转列表，使时间从早到晚
-            hourly_stats.reverse()
+            # 最近hours个小时桶（包含当前小时）
+            end = floor_datetime(datetime.utcnow(), 'hour') + timedelta(hours=1)
+            start = end - timedelta(hours=hours)
             
-            return hourly_stats
+            return [
+                {
+                    'hour': item['bucket'],
+                    'request_count': item['request_count'],
+                    'tokens_used': item['tokens_used']
+                } for item in StatsService.get_usage_series(start, end, 'hour')
+            ]
         except Exception as e:
             raise Exception(f"获取每小时使用统计失败: {str(e)}")
 
+    @staticmethod
+    def _get_daily_trends(days: int = 7, key_id: Optional[int] = None,
+                          model_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取截至今天的每日使用趋势
+        """
+        end = floor_datetime(datetime.utcnow(), 'day') + timedelta(days=1)
+        start = end - timedelta(days=days)
+        return [
+            {
+                'date': item['bucket'],
+                'request_count': item['request_count'],
+                'tokens_used': item['tokens_used']
+            } for item in StatsService.get_usage_series(start, end, 'day', key_id=key_id, model_id=model_id)
+        ]
+
+    @staticmethod
+    def _get_daily_trends_batch(group_by: str, ids: List[int], days: int = 7) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        一次查询获取多个Key或模型截至今天的每日使用趋势
+        """
+        end = floor_datetime(datetime.utcnow(), 'day') + timedelta(days=1)
+        start = end - timedelta(days=days)
+        series = RollupService.query_series(start, end, 'day', group_by=group_by, **{group_by: ids}) if ids else {}
+        
+        buckets = bucket_range(start, end, 'day')
+        trends = {}
+        for group_value in ids:
+            trends[group_value] = []
+            for day_start in buckets:
+                request_count, tokens_used = series.get((group_value, day_start), (0, 0))
+                trends[group_value].append({
+                    'date': day_start.strftime(SERIES_LABEL_FORMATS['day']),
+                    'request_count': request_count,
+                    'tokens_used': tokens_used
+                })
+        return trends
+
 # 全局统计服务实例
 stats_service = StatsService()
\ No newline at end of file
@@ -335,18 +335,24 @@ function loadStatsData(period = 'all') {
             showToast('加载统计数据失败: ' + error.message, 'danger');
         });
     
-    // 加载每小时使用趋势
-    authenticatedFetch('/api/stats/hourly')
+    // 加载使用趋势（按所选时间段选择范围和粒度，一次请求）
+    const seriesParams = {
+        all: 'hours=24&granularity=hour',
+        daily: 'hours=24&granularity=hour',
+        weekly: 'days=7&granularity=hour',
+        monthly: 'days=30&granularity=day'
+    }[period] || 'hours=24&granularity=hour';
+    authenticatedFetch(`/api/stats/series?${seriesParams}`)
         .then(response => response.json())
         .then(data => {
             if (data.success) {
                 loadHourlyUsageChart(data.data);
             } else {
-                showToast('加载每小时使用趋势失败: ' + data.message, 'danger');
+                showToast('加载使用趋势失败: ' + data.message, 'danger');
             }
         })
         .catch(error => {
-            showToast('加载每小时使用趋势失败: ' + error.message, 'danger');
+            showToast('加载使用趋势失败: ' + error.message, 'danger');
         });
 }
 
@@ -395,7 +401,19 @@ function loadChatHistory() {
                         </div>
                     `;
                     item.addEventListener('click', function() {
-                        showChatHistory(chat);
+                        // 列表不包含请求和响应内容，点击时再获取详情
+                        authenticatedFetch(`/api/chat/history/${chat.id}`)
+                            .then(response => response.json())
+                            .then(detail => {
+                                if (detail.success) {
+                                    showChatHistory(detail.data);
+                                } else {
+                                    showToast('获取聊天详情失败: ' + detail.message, 'danger');
+                                }
+                            })
+                            .catch(error => {
+                                showToast('获取聊天详情失败: ' + error.message, 'danger');
+                            });
                     });
                     historyContainer.appendChild(item);
                 });
@@ -650,11 +668,13 @@ function saveModel() {
 function refreshModels() {
     showToast('正在刷新模型列表...', 'info');
     
-    authenticatedFetch('/api/models?refresh=true')
+    authenticatedFetch('/api/models/refresh', {
+        method: 'POST'
+    })
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                showToast('模型列表刷新成功', 'success');
+                showToast(`模型列表刷新成功: 新增 ${data.data.inserted} 个，更新 ${data.data.updated} 个`, 'success');
                 loadModels();
             } else {
                 showToast('模型列表刷新失败: ' + data.message, 'danger');
@@ -677,7 +697,9 @@ function refreshChatModels() {
     const currentModel = modelSelect.value;
     
     // 调用刷新接口，从OpenAI API获取最新模型列表并保存到数据库
-    authenticatedFetch('/api/models/chat?refresh=true')
+    authenticatedFetch('/api/models/refresh', {
+        method: 'POST'
+    })
         .then(response => response.json())
         .then(data => {
             if (data.success) {
@@ -963,9 +985,9 @@ function loadKeyStatsChart(keyStats) {
 }
 
 /**
- * 加载每小时使用趋势图表
+ * 加载使用趋势图表
  */
-function loadHourlyUsageChart(hourlyData) {
+function loadHourlyUsageChart(seriesData) {
     const ctx = document.getElementById('hourly-usage-chart').getContext('2d');
     
     // 销毁旧图表
@@ -973,11 +995,10 @@ function loadHourlyUsageChart(hourlyData) {
         charts.hourlyUsage.destroy();
     }
     
-    const labels = hourlyData.map(item => {
-        const date = new Date(item.hour);
-        return date.getHours() + ':00';
-    });
-    const data = hourlyData.map(item => item.request_count);
+    // 标签为UTC时间桶，跨天时保留日期
+    const multiDay = seriesData.length > 24;
+    const labels = seriesData.map(item => multiDay ? item.bucket.slice(5) : item.bucket.slice(11));
+    const data = seriesData.map(item => item.request_count);
     
     charts.hourlyUsage = new Chart(ctx, {
         type: 'line',
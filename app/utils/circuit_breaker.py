@@ -0,0 +1,90 @@
+"""
+熔断器
+
+上游目标连续失败达到阈值后熔断，熔断期间直接跳过该目标；
+冷却时间过后放行一个试探请求，成功则恢复，失败则继续熔断。
+"""
+
+import time
+import threading
+from typing import Dict, Any, Optional
+from app.config import Config
+
+# 熔断器状态
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    单个上游目标的熔断器
+    """
+
+    def __init__(self, failure_threshold: Optional[int] = None, open_seconds: Optional[float] = None):
+        """
+        初始化熔断器
+        """
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        self.open_seconds = Config.CIRCUIT_OPEN_SECONDS if open_seconds is None else open_seconds
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probing = False
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        是否允许向该目标发送请求，冷却结束后只放行一个试探请求
+
+        试探请求没有报告结果（例如没有真正发出）时，再过一个冷却时间放行下一个试探请求
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == STATE_OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = STATE_HALF_OPEN
+                self._probing = False
+            if self.state == STATE_HALF_OPEN and (not self._probing or now - self._probe_at >= self.open_seconds):
+                self._probing = True
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        """
+        记录一次成功请求
+        """
+        with self._lock:
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, error: Optional[str] = None):
+        """
+        记录一次失败请求，连续失败达到阈值或试探失败时熔断
+        """
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._probing = False
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出熔断器状态
+        """
+        retry_in = 0
+        if self.state == STATE_OPEN:
+            retry_in = max(round(self.open_seconds - (time.monotonic() - self.opened_at), 1), 0)
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': retry_in,
+            'last_error': self.last_error
+        }
@@ -2,27 +2,86 @@
 数据库连接和初始化工具
 """
 
-import os
 import json
-from datetime import datetime
+from typing import List
+from sqlalchemy import inspect
 from app import db
-from app.models.key import Key
-from app.models.usage_stats import UsageStat
-from app.models.model import Model
-from app.models.chat_history import ChatHistory
+from app.config import Config
+# 导入 app.models 注册所有模型的表
+from app.models import Model
+from app.utils.migrations import run_migrations
 
 def init_database():
     """
     初始化数据库，创建所有表
     """
     try:
-        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            # 新建的SQLite数据库开启增量压缩，清理历史后可以逐步释放空闲页
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+                db.metadata.create_all(conn)
+                sync_schema(conn)
+                run_migrations(conn)
+                conn.commit()
+                if Config.SQLITE_WAL:
+                    # WAL模式下只读连接的查询不会阻塞写入（设置会保存在数据库文件中）
+                    conn.exec_driver_sql('PRAGMA journal_mode = WAL')
+        else:
+            with db.engine.begin() as conn:
+                db.metadata.create_all(conn)
+                sync_schema(conn)
+                run_migrations(conn)
         print("数据库表创建成功")
         return True
     except Exception as e:
         print(f"数据库表创建失败: {e}")
         return False
 
+def sync_schema(conn):
+    """
+    为已有的表补充新增的列
+
+    create_all 不会修改已存在的表，升级后新增的列在这里补上；
+    新增的列必须可为空或带有 server_default。
+    """
+    inspector = inspect(conn)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            conn.exec_driver_sql(ddl)
+            added.append(f'{table.name}.{column.name}')
+    if added:
+        print(f"数据库新增列: {', '.join(added)}")
+    return added
+
+def explain_query(statement, parameters=None) -> List[str]:
+    """
+    返回查询语句的执行计划，用于确认查询是否使用了索引
+
+    statement 可以是SQLAlchemy语句，也可以是已编译的SQL字符串（parameters 为对应的驱动参数）。
+    SQLite 使用 EXPLAIN QUERY PLAN，其他数据库使用 EXPLAIN。
+    """
+    conn = db.session.connection()
+    if isinstance(statement, str):
+        sql = statement
+    else:
+        sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    parameters = parameters if parameters is not None else ()
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parameters).all()]
+    return [' '.join(str(value) for value in row) for row in conn.exec_driver_sql(f'EXPLAIN {sql}', parameters).all()]
+
 def seed_database():
     """
     初始化数据库种子数据
@@ -76,9 +135,9 @@ def seed_database():
         for model_data in models_data:
             model = Model(
                 model_name=model_data["model_name"],
-                description=model_data["description"],
-                capabilities=model_data["capabilities"]
+                description=model_data["description"]
             )
+            model.set_capabilities(model_data["capabilities"])
             db.session.add(model)
         
         db.session.commit()
@@ -94,15 +153,8 @@ def get_database_info():
     获取数据库信息
     """
     try:
-        info = {
-            "keys_count": Key.query.count(),
-            "models_count": Model.query.count(),
-            "usage_stats_count": UsageStat.query.count(),
-            "chat_history_count": ChatHistory.query.count(),
-            "active_keys_count": Key.query.filter_by(status='active').count(),
-            "total_usage_count": sum(key.usage_count for key in Key.query.all())
-        }
-        return info
+        from app.services.stats_service import StatsService
+        return StatsService.get_database_info()
     except Exception as e:
         print(f"获取数据库信息失败: {e}")
         return None
@@ -112,16 +164,11 @@ def cleanup_old_records(days=30):
     清理旧记录
     """
     try:
-        from datetime import timedelta
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        from app.services.maintenance_service import MaintenanceService
         
-        # 清理旧的聊天历史记录
-        old_chat_history = ChatHistory.query.filter(ChatHistory.timestamp < cutoff_date).all()
-        for record in old_chat_history:
-            db.session.delete(record)
-        
-        db.session.commit()
-        print(f"清理了 {len(old_chat_history)} 条旧记录")
+        # 按主键范围分批删除旧的聊天历史记录
+        report = MaintenanceService.purge_chat_history(days)
+        print(f"清理了 {report['rows_removed']} 条旧记录")
         return True
     except Exception as e:
         print(f"清理旧记录失败: {e}")
@@ -0,0 +1,97 @@
+"""
+只读查询路由
+
+统计、模型摘要和聊天历史列表这类分析查询走单独的只读引擎，与请求路径上的写入使用不同的连接池：
+SQLite 使用WAL模式下以只读方式打开的同一个数据库文件，读取不会阻塞写入；
+其他数据库可以通过 DATABASE_READ_URL 指向只读副本。
+
+被 read_only 标记的函数中执行的 SELECT 语句走只读引擎，写入和刷新（flush）仍然走主引擎。
+"""
+
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable
+from sqlalchemy.engine import make_url
+from flask_sqlalchemy.session import Session
+from app.config import Config
+
+# 只读引擎的 bind key
+READ_BIND = 'read'
+
+# 当前上下文是否把查询路由到只读引擎
+_read_only = contextvars.ContextVar('read_only', default=False)
+
+
+class RoutingSession(Session):
+    """
+    在 read_only 范围内把 SELECT 语句路由到只读引擎的会话
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _read_only.get() and getattr(clause, 'is_select', False):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def read_only_queries():
+    """
+    在该范围内执行的查询走只读引擎（可以嵌套）
+    """
+    previous = _read_only.get()
+    _read_only.set(True)
+    try:
+        yield
+    finally:
+        # 按值恢复而不是使用token，生成器在不同的上下文中恢复执行时也不会出错
+        _read_only.set(previous)
+
+
+def read_only(func: Callable) -> Callable:
+    """
+    标记函数中的查询走只读引擎
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with read_only_queries():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _read_url(database_url: str) -> Optional[str]:
+    """
+    确定只读引擎的连接地址，没有可用的只读连接时返回None（只读查询走主引擎）
+    """
+    if Config.DATABASE_READ_URL:
+        return Config.DATABASE_READ_URL
+    url = make_url(database_url)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    # 以只读模式打开同一个数据库文件
+    return f'sqlite:///file:{url.database}?mode=ro&uri=true'
+
+
+def engine_config(database_url: str) -> Dict[str, Any]:
+    """
+    生成主引擎和只读引擎的配置，两个连接池分别设置大小
+    """
+    engine_options = {}
+    if Config.DATABASE_POOL_SIZE:
+        engine_options['pool_size'] = Config.DATABASE_POOL_SIZE
+        engine_options['max_overflow'] = Config.DATABASE_MAX_OVERFLOW
+
+    binds = {}
+    read_url = _read_url(database_url) if Config.DATABASE_READ_ENABLED else None
+    if read_url:
+        binds[READ_BIND] = {'url': read_url}
+        if Config.DATABASE_READ_POOL_SIZE:
+            binds[READ_BIND]['pool_size'] = Config.DATABASE_READ_POOL_SIZE
+            binds[READ_BIND]['max_overflow'] = Config.DATABASE_READ_MAX_OVERFLOW
+
+    return {
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+        'SQLALCHEMY_BINDS': binds
+    }
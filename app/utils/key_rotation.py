@@ -2,11 +2,38 @@
 Key轮询工具
 """
 
+import time
 import threading
-from typing import Optional, List
+from typing import Optional, List, Iterable, Union
+from app.config import Config
 from app.models.key import Key
 from app.services.key_service import KeyService
 
+class TokenBucket:
+    """
+    Key的token额度桶，按每分钟额度匀速恢复
+
+    先按估算值扣减，拿到上游实际用量后再补差，余额允许暂时为负。
+    """
+    
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60.0)
+        self.updated_at = now
+    
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+    
+    def charge(self, tokens: int):
+        self._refill()
+        self.tokens -= tokens
+
 class KeyRotation:
     """
     Key轮询管理类
@@ -36,28 +63,45 @@ class KeyRotation:
         self._current_index = 0
         self._keys_cache = []
         self._cache_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
         self._last_refresh_time = 0
         self._cache_ttl = 300  # 缓存有效期5分钟
+        self._tokens_per_minute = Config.KEY_TOKENS_PER_MINUTE
+        self._token_buckets = {}
+        self._bucket_lock = threading.Lock()
         self._initialized = True
-        
-        # 初始化时加载缓存
-        self.force_refresh()
+        # Key缓存在第一次使用时加载：导入模块时还没有应用上下文，不能查询数据库
     
     def refresh_keys_cache(self):
         """
         刷新Key缓存
         """
-        import time
-        current_time = time.time()
-        
         # 只有在缓存过期时才刷新
-        if current_time - self._last_refresh_time > self._cache_ttl:
+        if time.time() - self._last_refresh_time > self._cache_ttl:
+            self._reload_keys()
+    
+    def _reload_keys(self, force: bool = False):
+        """
+        从数据库重新加载Key缓存
+
+        查询数据库时不持有缓存锁：请求线程可能已经持有数据库连接再等待缓存锁，
+        如果查询时持有缓存锁，连接池耗尽后双方会互相等待直到连接池超时。
+        缓存中已有Key时只让一个线程查询，其他线程继续使用旧缓存。
+        """
+        exclusive = bool(self._keys_cache) and not force
+        if exclusive and not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            keys = KeyService.get_active_keys()
             with self._cache_lock:
-                self._keys_cache = KeyService.get_active_keys()
-                self._last_refresh_time = current_time
-                # 如果当前索引超出范围，重置为0
-                if self._current_index >= len(self._keys_cache):
+                self._keys_cache = keys
+                self._last_refresh_time = time.time()
+                # 强制刷新或当前索引超出范围时，重置为0
+                if force or self._current_index >= len(keys):
                     self._current_index = 0
+        finally:
+            if exclusive:
+                self._refresh_lock.release()
     
     def get_next_key(self) -> Optional[Key]:
         """
@@ -100,21 +144,91 @@ class KeyRotation:
         
         return random.choice(self._keys_cache)
     
-    def get_key_by_strategy(self, strategy: str = 'round_robin') -> Optional[Key]:
+    def get_key_by_strategy(self, strategy: str = 'round_robin', estimated_tokens: int = 0) -> Optional[Key]:
         """
         根据策略获取Key
+
+        estimated_tokens 为本次请求预估消耗的token数，启用每分钟额度时
+        会跳过额度不足的Key，并在选中的Key上预先扣减
         """
         if strategy == 'round_robin':
-            return self.get_next_key()
+            key = self.get_next_key()
         elif strategy == 'least_used':
-            return self.get_least_used_key()
+            key = self.get_least_used_key()
         elif strategy == 'random':
-            return self.get_random_key()
+            key = self.get_random_key()
         elif strategy == 'weighted_round_robin':
-            return self.get_weighted_round_robin_key()
+            key = self.get_weighted_round_robin_key()
         else:
             # 默认使用轮询算法
-            return self.get_next_key()
+            key = self.get_next_key()
+        
+        if key and self._tokens_per_minute > 0:
+            if not self.has_token_capacity(key.id, estimated_tokens):
+                # 选中的Key额度不足时，改用剩余额度最多的Key
+                buckets = [(k, self._get_bucket(k.id)) for k in self._keys_cache]
+                with self._bucket_lock:
+                    key = max(buckets, key=lambda item: item[1].available(), default=(key, None))[0]
+            self.charge_tokens(key.id, estimated_tokens)
+        return key
+    
+    def get_pool_key(self, pool: Iterable[Union[int, str]], estimated_tokens: int = 0) -> Optional[Key]:
+        """
+        从Key池中获取Key
+
+        pool 为Key的ID或名称，为空表示所有可用的Key。池中没有可用Key或额度都不足时返回None，
+        调用方可以换下一个Key池，而不是在额度不足的Key上继续请求。
+        """
+        import random
+        self.refresh_keys_cache()
+        pool = set(pool)
+        keys = [k for k in self._keys_cache if not pool or k.id in pool or k.name in pool]
+        if self._tokens_per_minute > 0:
+            keys = [k for k in keys if self.has_token_capacity(k.id, estimated_tokens)]
+        if not keys:
+            return None
+        
+        # 与加权轮询相同，使用次数越少的Key被选中的概率越高
+        total_usage = sum(k.usage_count for k in keys)
+        key = random.choices(keys, weights=[total_usage - k.usage_count + 1 for k in keys])[0]
+        self.charge_tokens(key.id, estimated_tokens)
+        return key
+    
+    def _get_bucket(self, key_id: int) -> TokenBucket:
+        """
+        获取Key的额度桶
+        """
+        bucket = self._token_buckets.get(key_id)
+        if bucket is None:
+            with self._bucket_lock:
+                bucket = self._token_buckets.setdefault(key_id, TokenBucket(self._tokens_per_minute))
+        return bucket
+    
+    def has_token_capacity(self, key_id: int, tokens: int = 0) -> bool:
+        """
+        检查Key的剩余额度是否足够
+        """
+        if self._tokens_per_minute <= 0:
+            return True
+        bucket = self._get_bucket(key_id)
+        with self._bucket_lock:
+            return bucket.available() >= max(tokens, 1)
+    
+    def charge_tokens(self, key_id: int, tokens: int):
+        """
+        按预估token数扣减Key的额度
+        """
+        if self._tokens_per_minute <= 0 or not tokens:
+            return
+        bucket = self._get_bucket(key_id)
+        with self._bucket_lock:
+            bucket.charge(tokens)
+    
+    def reconcile_tokens(self, key_id: int, charged: int, actual: int):
+        """
+        用上游返回的实际用量修正预扣的额度
+        """
+        self.charge_tokens(key_id, actual - charged)
     
     def get_weighted_round_robin_key(self) -> Optional[Key]:
         """
@@ -165,11 +279,7 @@ class KeyRotation:
         """
         强制刷新Key缓存并重置轮询索引
         """
-        import time
-        with self._cache_lock:
-            self._keys_cache = KeyService.get_active_keys()
-            self._last_refresh_time = time.time()
-            self._current_index = 0
+        self._reload_keys(force=True)
 
 # 全局Key轮询实例
 key_rotation = KeyRotation()
\ No newline at end of file
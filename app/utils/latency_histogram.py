@@ -0,0 +1,138 @@
+"""
+对数分桶延迟直方图
+
+桶边界按固定比例增长（每翻倍8个桶，相对误差约4.5%），
+所有直方图的桶边界相同，按桶逐项相加即可合并，适合跨进程、跨时间段汇总。
+"""
+
+import math
+from typing import Dict, List, Optional
+
+# 最小可区分延迟（毫秒），更小的值计入第一个桶
+MIN_LATENCY_MS = 0.1
+# 相邻桶边界的增长比例
+GROWTH_FACTOR = 2 ** (1 / 8)
+# 覆盖到10分钟的桶数量，更大的值计入最后一个桶
+BUCKET_COUNT = int(math.log(600000 / MIN_LATENCY_MS, GROWTH_FACTOR)) + 2
+
+_LOG_GROWTH = math.log(GROWTH_FACTOR)
+
+# 统计的延迟指标
+METRIC_TOTAL = 'total'  # 上游请求总耗时
+METRIC_TTFB = 'ttfb'  # 上游首字节耗时
+METRIC_OVERHEAD = 'overhead'  # 代理自身耗时（总处理时间减去上游耗时）
+LATENCY_METRICS = (METRIC_TOTAL, METRIC_TTFB, METRIC_OVERHEAD)
+
+# 默认输出的百分位
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def bucket_index(value_ms: float) -> int:
+    """
+    计算延迟值所在的桶
+    """
+    if value_ms <= MIN_LATENCY_MS:
+        return 0
+    return min(int(math.log(value_ms / MIN_LATENCY_MS) / _LOG_GROWTH) + 1, BUCKET_COUNT - 1)
+
+
+def bucket_bounds(index: int):
+    """
+    桶的上下边界（毫秒）
+    """
+    if index == 0:
+        return 0.0, MIN_LATENCY_MS
+    return MIN_LATENCY_MS * GROWTH_FACTOR ** (index - 1), MIN_LATENCY_MS * GROWTH_FACTOR ** index
+
+
+def bucket_value(index: int) -> float:
+    """
+    桶的代表值（上下边界的几何中点）
+    """
+    low, high = bucket_bounds(index)
+    return math.sqrt(low * high) if low else high
+
+
+class LatencyHistogram:
+    """
+    定长数组存储的延迟直方图
+    """
+    __slots__ = ('counts', 'count')
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+
+    def record(self, value_ms: float, times: int = 1):
+        """
+        记录一个延迟值
+        """
+        self.counts[bucket_index(value_ms)] += times
+        self.count += times
+
+    def add_bucket(self, index: int, count: int):
+        """
+        直接累加一个桶的计数
+        """
+        self.counts[index] += count
+        self.count += count
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        """
+        合并另一个直方图
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        return self
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        计算百分位延迟（毫秒），没有数据时返回None
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(self.count * percent / 100), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return bucket_value(index)
+        return bucket_value(BUCKET_COUNT - 1)
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES) -> Dict[str, Optional[float]]:
+        """
+        输出请求数和各百分位延迟
+        """
+        result = {'count': self.count}
+        for percent in percentiles:
+            value = self.percentile(percent)
+            result[f'p{percent}'] = round(value, 2) if value is not None else None
+        top = max((index for index, count in enumerate(self.counts) if count), default=None)
+        result['max'] = round(bucket_bounds(top)[1], 2) if top is not None else None
+        return result
+
+    def to_sparse(self) -> Dict[int, int]:
+        """
+        转换为只包含非零桶的字典
+        """
+        return {index: count for index, count in enumerate(self.counts) if count}
+
+    @classmethod
+    def from_sparse(cls, buckets: Dict[int, int]) -> 'LatencyHistogram':
+        """
+        从非零桶字典恢复直方图
+        """
+        histogram = cls()
+        for index, count in buckets.items():
+            histogram.add_bucket(int(index), count)
+        return histogram
+
+    @classmethod
+    def from_values(cls, values: List[float]) -> 'LatencyHistogram':
+        """
+        从一组延迟值构建直方图
+        """
+        histogram = cls()
+        for value in values:
+            histogram.record(value)
+        return histogram
@@ -0,0 +1,135 @@
+"""
+轻量数据库迁移
+
+create_all 只创建缺失的表，不会给已存在的表添加索引或修正数据。
+需要在已有数据库上执行的变更在这里按版本号登记，启动时执行尚未执行过的迁移，
+执行结果记录在 schema_migrations 表中。迁移必须可以在新建的数据库上重复执行而不出错。
+"""
+
+from datetime import datetime
+from typing import List
+from sqlalchemy import select, bindparam
+from app import db
+from app.models.usage_stats import UsageStat
+from app.models.chat_history import ChatHistory
+from app.models.model import Model, parse_capabilities, capability_columns
+from app.models.schema_migration import SchemaMigration
+from app.models.usage_rollup import ROLLUP_MODELS
+
+
+def _create_indexes(*names):
+    """
+    创建模型中声明的索引（已存在的跳过）
+    """
+    def migrate(conn):
+        indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+        for name in names:
+            indexes[name].create(conn, checkfirst=True)
+    return migrate
+
+
+def _link_model_ids(conn):
+    """
+    按模型名称补齐使用统计和聊天历史的 model_id，统计查询改为按模型ID关联
+    """
+    UsageStat.link_model_ids(conn)
+    table = ChatHistory.__table__
+    models = Model.__table__
+    conn.execute(
+        table.update().where(
+            table.c.model_id.is_(None),
+            table.c.model.in_(select(models.c.model_name))
+        ).values(
+            model_id=select(models.c.id).where(models.c.model_name == table.c.model).scalar_subquery()
+        )
+    )
+
+
+def _split_capabilities(conn):
+    """
+    把模型能力JSON中的常用字段写入按列存储的能力字段
+    """
+    table = Model.__table__
+    params = []
+    for row in conn.execute(select(table.c.id, table.c.capabilities)).all():
+        columns = capability_columns(parse_capabilities(row.capabilities))
+        params.append({'b_id': row.id, **{f'b_{name}': value for name, value in columns.items()}})
+    if params:
+        conn.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(
+                # 保留原来的更新时间，不触发 onupdate
+                updated_at=table.c.updated_at,
+                **{name: bindparam(f'b_{name}') for name in capability_columns({})}
+            ),
+            params
+        )
+
+
+def _mark_error_history(conn):
+    """
+    根据响应内容补齐已有聊天历史的 is_error（此前失败的流式请求没有保存响应内容，无法补齐）
+    """
+    table = ChatHistory.__table__
+    conn.execute(
+        table.update().where(table.c.response.like('{"error"%')).values(is_error=True)
+    )
+
+
+# 汇总表中改为 BIGINT 的累加字段
+ROLLUP_BIGINT_COLUMNS = ('prompt_tokens', 'completion_tokens', 'total_tokens', 'latency_ms_sum')
+
+
+def _widen_rollup_sums(conn):
+    """
+    把汇总表的Token和耗时累加字段改为 BIGINT（SQLite的INTEGER本身是64位，不需要修改）
+    """
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        return
+    for model in ROLLUP_MODELS.values():
+        table = model.__tablename__
+        for column in ROLLUP_BIGINT_COLUMNS:
+            if dialect in ('mysql', 'mariadb'):
+                conn.exec_driver_sql(f'ALTER TABLE {table} MODIFY {column} BIGINT NOT NULL')
+            else:
+                conn.exec_driver_sql(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT')
+
+
+# 迁移列表: (版本号, 名称, 迁移函数)，版本号只增不改
+MIGRATIONS = (
+    (1, 'add_hot_path_indexes', _create_indexes(
+        'ix_chat_history_timestamp_id',
+        'ix_chat_history_key_id_timestamp',
+        'ix_chat_history_model_timestamp',
+        'ix_usage_stats_key_id_model',
+        'ix_usage_stats_model_id_key_id',
+        'ix_keys_status'
+    )),
+    (2, 'link_model_ids', _link_model_ids),
+    (3, 'split_model_capabilities', _split_capabilities),
+    (4, 'add_model_capability_indexes', _create_indexes(
+        'ix_models_supports_chat',
+        'ix_models_supports_completion'
+    )),
+    (5, 'mark_error_history', _mark_error_history),
+    (6, 'add_chat_history_status_index', _create_indexes('ix_chat_history_is_error_timestamp')),
+    (7, 'widen_rollup_sums', _widen_rollup_sums),
+)
+
+
+def run_migrations(conn) -> List[int]:
+    """
+    按版本号顺序执行尚未执行的迁移，在调用方的事务中执行，返回本次执行的版本号
+    """
+    table = SchemaMigration.__table__
+    applied = set(conn.execute(select(table.c.version)).scalars())
+    executed = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(conn)
+        conn.execute(table.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        executed.append(version)
+    if executed:
+        print(f"数据库迁移完成: {', '.join(str(version) for version in executed)}")
+    return executed
@@ -0,0 +1,172 @@
+"""
+进程内模型注册表
+
+请求路径上校验模型是否存在、获取模型ID只需查字典，不访问数据库。
+本进程通过 ModelService 修改模型后立即失效；其他worker进程的修改通过 data_versions 表中的
+模型版本号发现，每隔 MODEL_REGISTRY_CHECK_INTERVAL 秒最多检查一次。
+模型列表接口的响应体按版本号缓存，注册表重新加载后才重新生成。
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Mapping, NamedTuple, Callable, Tuple
+from app.config import Config
+from app.models.model import Model, parse_capabilities
+from app.models.data_version import DataVersion, MODELS_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry(NamedTuple):
+    """
+    注册表中的模型信息（不可变）
+    """
+    id: int
+    model_name: str
+    description: Optional[str]
+    capabilities: Mapping[str, Any]
+    supports_chat: bool
+    supports_completion: bool
+    context_window: Optional[int]
+    owned_by: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    @staticmethod
+    def from_model(model: Model) -> 'ModelEntry':
+        """
+        从模型记录创建注册表条目
+        """
+        return ModelEntry(
+            id=model.id,
+            model_name=model.model_name,
+            description=model.description,
+            capabilities=MappingProxyType(parse_capabilities(model.capabilities)),
+            supports_chat=bool(model.supports_chat),
+            supports_completion=bool(model.supports_completion),
+            context_window=model.context_window,
+            owned_by=model.owned_by,
+            created_at=model.created_at,
+            updated_at=model.updated_at
+        )
+
+
+class ModelRegistry:
+    """
+    模型注册表，按名称和ID索引所有模型
+    """
+
+    def __init__(self, check_interval: Optional[float] = None):
+        """
+        初始化注册表，第一次使用时加载
+        """
+        self.check_interval = Config.MODEL_REGISTRY_CHECK_INTERVAL if check_interval is None else check_interval
+        self._by_name: Dict[str, ModelEntry] = {}
+        self._by_id: Dict[int, ModelEntry] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._payloads: Dict[str, Tuple[int, bytes, str]] = {}
+
+    def load(self) -> int:
+        """
+        从数据库加载所有模型，返回加载时的模型版本号
+        """
+        with self._lock:
+            version = DataVersion.get(MODELS_VERSION)
+            entries = [ModelEntry.from_model(model) for model in Model.query.order_by(Model.id).all()]
+            # 整体替换字典，读取方不需要加锁
+            self._by_name = {entry.model_name: entry for entry in entries}
+            self._by_id = {entry.id: entry for entry in entries}
+            self._version = version
+            self._checked_at = time.monotonic()
+            self._stale = False
+            self._loads += 1
+        logger.debug(f"模型注册表已加载 {len(entries)} 个模型（版本 {version}）")
+        return version
+
+    def invalidate(self):
+        """
+        标记注册表过期，下次使用时重新加载
+        """
+        self._stale = True
+
+    def _ensure_fresh(self):
+        """
+        注册表过期或其他进程修改了模型时重新加载
+        """
+        if self._stale:
+            self.load()
+            return
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.monotonic()
+        if DataVersion.get(MODELS_VERSION) != self._version:
+            self.load()
+
+    def get(self, model_name: str) -> Optional[ModelEntry]:
+        """
+        按名称获取模型
+        """
+        self._ensure_fresh()
+        return self._by_name.get(model_name)
+
+    def get_by_id(self, model_id: int) -> Optional[ModelEntry]:
+        """
+        按ID获取模型
+        """
+        self._ensure_fresh()
+        return self._by_id.get(model_id)
+
+    def all(self) -> List[ModelEntry]:
+        """
+        获取所有模型（按ID排序）
+        """
+        self._ensure_fresh()
+        return list(self._by_id.values())
+
+    def payload(self, name: str, build: Callable[[List[ModelEntry]], bytes]) -> Tuple[bytes, str]:
+        """
+        获取按当前版本缓存的响应体和ETag，版本变化后调用 build 重新生成
+        """
+        self._ensure_fresh()
+        cached = self._payloads.get(name)
+        if cached is not None and cached[0] == self._version:
+            return cached[1], cached[2]
+        with self._lock:
+            # 加锁保证响应体和版本号来自同一次加载
+            version = self._version
+            body = build(list(self._by_id.values()))
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            self._payloads[name] = (version, body, etag)
+        return body, etag
+
+    @property
+    def version(self) -> int:
+        """
+        当前加载的模型版本号
+        """
+        self._ensure_fresh()
+        return self._version
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取注册表状态
+        """
+        return {
+            'models': len(self._by_id),
+            'version': self._version,
+            'loads': self._loads,
+            'stale': self._stale,
+            'payloads': sorted(self._payloads),
+            'check_interval': self.check_interval
+        }
+
+# 全局模型注册表实例
+model_registry = ModelRegistry()
@@ -0,0 +1,112 @@
+"""
+模型价格表与费用计算
+
+价格以美元/百万token配置，费用以纳美元（1e-9美元）整数存储和累加，
+汇总结果是精确的十进制金额，不受浮点误差影响。
+"""
+
+import json
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Any, Optional
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 每百万token价格（美元）换算为每token纳美元的倍数: 1e9 / 1e6
+NANOS_PER_PRICE_UNIT = Decimal(1000)
+
+# 1美元对应的纳美元数
+NANOS_PER_DOLLAR = Decimal(10) ** 9
+
+
+def format_cost(cost_nanos: Optional[int]) -> str:
+    """
+    把纳美元整数格式化为美元金额字符串（保留9位小数，避免JSON浮点误差）
+    """
+    return format((Decimal(cost_nanos or 0) / NANOS_PER_DOLLAR).quantize(Decimal('0.000000001')), 'f')
+
+
+class PriceTable:
+    """
+    模型价格表
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化价格表，价格文件在第一次使用时加载
+        """
+        self.path = path or Config.MODEL_PRICES_PATH
+        self._prices = None
+        self._lock = threading.Lock()
+
+    def load(self, path: Optional[str] = None) -> Dict[str, Dict[str, Decimal]]:
+        """
+        加载价格文件，文件不存在或格式错误时使用空价格表
+        """
+        path = path or self.path
+        prices = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for model, item in data.items():
+                if model.startswith('_'):
+                    continue
+                prices[model] = {
+                    'prompt': Decimal(str(item.get('prompt', 0))),
+                    'completion': Decimal(str(item.get('completion', 0)))
+                }
+        except FileNotFoundError:
+            logger.warning(f"模型价格文件 {path} 不存在，费用按0计算")
+        except (ValueError, ArithmeticError, AttributeError) as e:
+            logger.error(f"加载模型价格文件 {path} 失败，费用按0计算: {e}")
+
+        with self._lock:
+            self.path = path
+            self._prices = prices
+        return prices
+
+    def _get_prices(self) -> Dict[str, Dict[str, Decimal]]:
+        """
+        获取已加载的价格表
+        """
+        if self._prices is None:
+            self.load()
+        return self._prices
+
+    def get_price(self, model: str) -> Optional[Dict[str, Decimal]]:
+        """
+        查找模型价格：精确匹配优先，其次按最长前缀匹配（例如带日期后缀的模型版本）
+        """
+        prices = self._get_prices()
+        if model in prices:
+            return prices[model]
+        matches = [name for name in prices if model and model.startswith(name)]
+        return prices[max(matches, key=len)] if matches else None
+
+    def cost_nanos(self, model: str, prompt_tokens: int, completion_tokens: int) -> int:
+        """
+        计算一次请求的费用（纳美元），没有配置价格的模型费用为0
+        """
+        price = self.get_price(model)
+        if not price:
+            return 0
+        cost = (price['prompt'] * (prompt_tokens or 0) + price['completion'] * (completion_tokens or 0)) * NANOS_PER_PRICE_UNIT
+        return int(cost.to_integral_value(rounding=ROUND_HALF_UP))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出价格表
+        """
+        return {
+            'path': self.path,
+            'unit': 'USD / 1M tokens',
+            'prices': {
+                model: {name: str(value) for name, value in price.items()}
+                for model, price in sorted(self._get_prices().items())
+            }
+        }
+
+# 全局价格表实例
+price_table = PriceTable()
@@ -0,0 +1,123 @@
+"""
+模型别名路由表
+
+把客户端使用的模型名称映射为按顺序排列的上游目标，每个目标由上游模型和Key池组成。
+路由表从 MODEL_ROUTES_PATH 指向的JSON文件加载，没有配置别名的模型直接请求同名的上游模型。
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple, Union, NamedTuple
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RouteTarget(NamedTuple):
+    """
+    路由链中的一个上游目标
+    """
+    model: str
+    keys: Tuple[Union[int, str], ...]  # Key池：Key的ID或名称，为空表示使用所有可用的Key
+    latency_budget_ms: Optional[int]  # 该目标的单次请求耗时上限，超时后换下一个目标
+
+    @property
+    def name(self) -> str:
+        """
+        目标名称，同时用作熔断器的标识
+        """
+        pool = ','.join(str(key) for key in self.keys) or '*'
+        return f'{self.model}@{pool}'
+
+
+class ModelRoute(NamedTuple):
+    """
+    一个模型别名的路由链
+    """
+    alias: str
+    targets: Tuple[RouteTarget, ...]
+    deadline_ms: int  # 整个请求（包括换目标重试）的耗时上限
+
+
+class RoutingTable:
+    """
+    模型别名路由表
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化路由表，路由文件在第一次使用时加载
+        """
+        self.path = path or Config.MODEL_ROUTES_PATH
+        self._routes = None
+        self._lock = threading.Lock()
+
+    def load(self, path: Optional[str] = None) -> Dict[str, ModelRoute]:
+        """
+        加载路由文件，文件不存在或格式错误时不使用别名路由
+        """
+        path = path or self.path
+        routes = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for alias, item in data.items():
+                if alias.startswith('_'):
+                    continue
+                targets = tuple(
+                    RouteTarget(
+                        model=target['model'],
+                        keys=tuple(target.get('keys') or ()),
+                        latency_budget_ms=target.get('latency_budget_ms')
+                    )
+                    for target in item.get('targets', [])
+                )
+                if not targets:
+                    logger.warning(f"模型别名 {alias} 没有配置上游目标，已忽略")
+                    continue
+                routes[alias] = ModelRoute(
+                    alias=alias,
+                    targets=targets,
+                    deadline_ms=int(item.get('deadline_ms') or Config.MODEL_ROUTE_DEADLINE_MS)
+                )
+        except FileNotFoundError:
+            logger.info(f"模型路由文件 {path} 不存在，不使用别名路由")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"加载模型路由文件 {path} 失败，不使用别名路由: {e}")
+
+        with self._lock:
+            self.path = path
+            self._routes = routes
+        return routes
+
+    def _get_routes(self) -> Dict[str, ModelRoute]:
+        """
+        获取已加载的路由表
+        """
+        if self._routes is None:
+            self.load()
+        return self._routes
+
+    def get(self, alias: str) -> Optional[ModelRoute]:
+        """
+        获取模型别名的路由链，没有配置时返回None
+        """
+        return self._get_routes().get(alias)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出路由表
+        """
+        return {
+            'path': self.path,
+            'routes': {
+                alias: {
+                    'deadline_ms': route.deadline_ms,
+                    'targets': [target._asdict() for target in route.targets]
+                } for alias, route in sorted(self._get_routes().items())
+            }
+        }
+
+# 全局路由表实例
+routing_table = RoutingTable()
@@ -0,0 +1,104 @@
+"""
+时间分桶工具
+
+统一Python端和SQL端的时间截断规则，供统计汇总表和统计查询使用。
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Union
+from sqlalchemy import func
+
+GRANULARITIES = ('minute', 'hour', 'day')
+
+GRANULARITY_DELTAS = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1)
+}
+
+# SQLite的strftime格式，结果可以直接用 datetime.fromisoformat 解析
+_SQLITE_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00'
+}
+
+# MySQL的date_format格式
+_MYSQL_FORMATS = {
+    'minute': '%Y-%m-%d %H:%i:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00'
+}
+
+
+def parse_time_param(value: str):
+    """
+    解析ISO格式的时间参数，带时区的时间转换为UTC，空值返回None
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"无效的时间格式: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def validate_granularity(granularity: str) -> str:
+    """
+    校验时间粒度
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"不支持的时间粒度: {granularity}")
+    return granularity
+
+
+def floor_datetime(dt: datetime, granularity: str) -> datetime:
+    """
+    将时间截断到指定粒度的起点
+    """
+    if granularity == 'minute':
+        return dt.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"不支持的时间粒度: {granularity}")
+
+
+def bucket_range(start: datetime, end: datetime, granularity: str) -> List[datetime]:
+    """
+    生成 [start, end) 范围内的所有桶起点
+    """
+    step = GRANULARITY_DELTAS[granularity]
+    current = floor_datetime(start, granularity)
+    buckets = []
+    while current < end:
+        buckets.append(current)
+        current += step
+    return buckets
+
+
+def bucket_expression(column, granularity: str, dialect_name: str):
+    """
+    生成按粒度截断时间列的SQL表达式
+    """
+    validate_granularity(granularity)
+    if dialect_name == 'sqlite':
+        return func.strftime(_SQLITE_FORMATS[granularity], column)
+    if dialect_name == 'postgresql':
+        return func.date_trunc(granularity, column)
+    if dialect_name in ('mysql', 'mariadb'):
+        return func.date_format(column, _MYSQL_FORMATS[granularity])
+    raise ValueError(f"不支持的数据库类型: {dialect_name}")
+
+
+def parse_bucket(value: Union[str, datetime]) -> datetime:
+    """
+    将SQL截断表达式的结果转换为datetime
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime.fromisoformat(str(value))
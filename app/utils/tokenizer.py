@@ -0,0 +1,338 @@
+"""
+离线Token估算工具
+
+优先使用随镜像打包的 tiktoken 词表精确计数，词表或 tiktoken 不可用时
+退回到基于正则的快速近似估算。运行时从不访问网络。
+"""
+
+import os
+import re
+import json
+import base64
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 词表下载地址（仅在构建镜像时使用），tiktoken 以 URL 的 sha1 作为缓存文件名
+ENCODING_URLS = {
+    'cl100k_base': 'https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken',
+    'o200k_base': 'https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken'
+}
+
+# 词表的分词正则和特殊token（与 tiktoken_ext.openai_public 相同），用于直接从本地词表文件构建编码
+ENCODING_SPECS = {
+    'cl100k_base': {
+        'pat_str': r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s""",
+        'special_tokens': {
+            '<|endoftext|>': 100257, '<|fim_prefix|>': 100258, '<|fim_middle|>': 100259,
+            '<|fim_suffix|>': 100260, '<|endofprompt|>': 100276
+        }
+    },
+    'o200k_base': {
+        'pat_str': '|'.join([
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""\p{N}{1,3}""",
+            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+            r"""\s*[\r\n]+""",
+            r"""\s+(?!\S)""",
+            r"""\s+"""
+        ]),
+        'special_tokens': {'<|endoftext|>': 199999, '<|endofprompt|>': 200018}
+    }
+}
+
+# 使用 o200k_base 的模型前缀，其余模型使用 cl100k_base
+O200K_MODEL_PREFIXES = ('gpt-4o', 'gpt-4.1', 'gpt-4.5', 'gpt-5', 'o1', 'o3', 'o4', 'chatgpt-4o')
+
+# 聊天消息格式开销（参考 OpenAI 官方计数方法）
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_REPLY_PRIMING = 3
+TOKENS_PER_IMAGE = 85
+
+# 近似估算：常见英文单词一个token，超长单词每10个字符多算一个token；
+# 数字每3位一个token；CJK字符和标点各算一个token
+_APPROX_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"  # CJK字符
+    r"|[A-Za-z\u00c0-\u024f]+"  # 拉丁字母单词
+    r"|\d{1,3}"  # 数字
+    r"|[^\sA-Za-z\d]"  # 标点和其他符号
+)
+_LONG_WORD_PATTERN = re.compile(r"[A-Za-z\u00c0-\u024f]{10,}")
+
+
+def _approx_count(text: str) -> int:
+    """
+    近似估算文本的token数量
+    """
+    count = len(_APPROX_PATTERN.findall(text))
+    for word in _LONG_WORD_PATTERN.findall(text):
+        count += len(word) // 10
+    return count
+
+
+def _load_encoding(name: str, path: str):
+    """
+    直接从本地词表文件构建编码，不经过 tiktoken 的缓存目录（TIKTOKEN_CACHE_DIR），不会访问网络
+    """
+    import tiktoken
+    mergeable_ranks = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                token, rank = line.split()
+                mergeable_ranks[base64.b64decode(token)] = int(rank)
+    spec = ENCODING_SPECS[name]
+    return tiktoken.Encoding(
+        name=name,
+        pat_str=spec['pat_str'],
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=spec['special_tokens']
+    )
+
+
+class TokenCounter:
+    """
+    Token计数器
+    """
+
+    def __init__(self):
+        """
+        初始化Token计数器，词表在第一次使用时加载
+        """
+        self.vocab_dir = Config.TOKENIZER_VOCAB_DIR
+        self._encodings = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'reconciled': 0,
+            'estimated_tokens': 0,
+            'actual_tokens': 0,
+            'abs_error_tokens': 0
+        }
+
+    def _get_encoding(self, name: str):
+        """
+        加载离线词表，不可用时返回None
+        """
+        if name in self._encodings:
+            return self._encodings[name]
+
+        with self._lock:
+            if name in self._encodings:
+                return self._encodings[name]
+
+            encoding = None
+            cache_file = os.path.join(self.vocab_dir, hashlib.sha1(ENCODING_URLS[name].encode()).hexdigest())
+            if os.path.exists(cache_file):
+                try:
+                    encoding = _load_encoding(name, cache_file)
+                except ImportError:
+                    logger.info("未安装tiktoken，使用近似Token估算")
+                except Exception as e:
+                    logger.warning(f"加载词表 {name} 失败，使用近似Token估算: {e}")
+            self._encodings[name] = encoding
+            return encoding
+
+    @staticmethod
+    def encoding_name_for_model(model: str) -> str:
+        """
+        根据模型名称选择词表
+        """
+        model = (model or '').lower()
+        if model.startswith(O200K_MODEL_PREFIXES):
+            return 'o200k_base'
+        return 'cl100k_base'
+
+    def is_exact(self, model: str) -> bool:
+        """
+        当前模型是否使用精确词表计数
+        """
+        return self._get_encoding(self.encoding_name_for_model(model)) is not None
+
+    def count_text(self, text: str, model: str = '') -> int:
+        """
+        计算文本的token数量
+        """
+        if not text:
+            return 0
+        encoding = self._get_encoding(self.encoding_name_for_model(model))
+        if encoding is not None:
+            return len(encoding.encode_ordinary(text))
+        return _approx_count(text)
+
+    def count_messages(self, messages: List[Dict[str, Any]], model: str = '') -> int:
+        """
+        估算聊天消息列表的提示token数量
+        """
+        total = TOKENS_REPLY_PRIMING
+        for message in messages or []:
+            total += TOKENS_PER_MESSAGE
+            for field, value in message.items():
+                if field == 'content':
+                    total += self._count_content(value, model)
+                elif field == 'name':
+                    total += TOKENS_PER_NAME + self.count_text(str(value), model)
+                elif field == 'role':
+                    total += self.count_text(str(value), model)
+                elif field in ('tool_calls', 'function_call'):
+                    total += self.count_text(json.dumps(value, ensure_ascii=False), model)
+        return total
+
+    def _count_content(self, content: Any, model: str) -> int:
+        """
+        计算消息内容的token数量，支持多模态内容列表
+        """
+        if isinstance(content, str):
+            return self.count_text(content, model)
+        if isinstance(content, list):
+            total = 0
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get('type') == 'text':
+                    total += self.count_text(part.get('text', ''), model)
+                elif part.get('type') == 'image_url':
+                    total += TOKENS_PER_IMAGE
+            return total
+        return 0
+
+    def reconcile(self, estimated: int, actual: int):
+        """
+        记录估算值与上游实际值的差异
+        """
+        with self._stats_lock:
+            self._stats['reconciled'] += 1
+            self._stats['estimated_tokens'] += estimated
+            self._stats['actual_tokens'] += actual
+            self._stats['abs_error_tokens'] += abs(actual - estimated)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取估算精度统计
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['mean_abs_error'] = round(stats['abs_error_tokens'] / stats['reconciled'], 2) if stats['reconciled'] else 0
+        stats['error_ratio'] = round(stats['abs_error_tokens'] / stats['actual_tokens'], 4) if stats['actual_tokens'] else 0
+        stats['encodings'] = {
+            name: self._get_encoding(name) is not None for name in ENCODING_URLS
+        }
+        return stats
+
+
+class StreamUsageTracker:
+    """
+    流式响应的用量跟踪器
+
+    解析上游SSE数据，累计增量文本用于估算完成token；
+    如果上游在最后一个分块中返回了usage，则以实际值为准。
+    """
+
+    def __init__(self, model: str, prompt_tokens: int = 0):
+        """
+        初始化跟踪器
+        """
+        self.model = model
+        self.prompt_estimate = prompt_tokens
+        self.key_id = None
+        self.alias = None  # 经过别名路由时为请求的别名
+        self.attempts = 0  # 已尝试的上游目标数（含熔断跳过的目标），与非流式请求的 _route.attempts 相同
+        self.usage = None
+        self.ttfb_ms = None  # 上游首个数据块耗时（毫秒）
+        self.upstream_ms = None  # 上游响应总耗时（毫秒）
+        self._buffer = b''
+        self._parts = []
+
+    def feed(self, chunk: bytes):
+        """
+        处理一个上游数据块
+        """
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            self._handle_line(line.strip())
+
+    def _handle_line(self, line: bytes):
+        """
+        处理一行SSE数据
+        """
+        if not line.startswith(b'data:'):
+            return
+        payload = line[5:].strip()
+        if not payload or payload == b'[DONE]':
+            return
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if data.get('usage'):
+            self.usage = data['usage']
+        for choice in data.get('choices') or []:
+            delta = choice.get('delta') or {}
+            if delta.get('content'):
+                self._parts.append(delta['content'])
+            for tool_call in delta.get('tool_calls') or []:
+                arguments = (tool_call.get('function') or {}).get('arguments')
+                if arguments:
+                    self._parts.append(arguments)
+
+    def finish(self):
+        """
+        处理缓冲区中剩余的数据
+        """
+        if self._buffer:
+            self._handle_line(self._buffer.strip())
+            self._buffer = b''
+
+    @property
+    def estimated(self) -> bool:
+        """
+        用量是否为估算值
+        """
+        return not self.usage
+
+    def get_usage(self) -> Dict[str, int]:
+        """
+        获取用量（上游实际值或本地估算值）
+        """
+        if self.usage:
+            return {
+                'prompt_tokens': self.usage.get('prompt_tokens', 0),
+                'completion_tokens': self.usage.get('completion_tokens', 0),
+                'total_tokens': self.usage.get('total_tokens', 0)
+            }
+        completion_tokens = token_counter.count_text(''.join(self._parts), self.model)
+        return {
+            'prompt_tokens': self.prompt_estimate,
+            'completion_tokens': completion_tokens,
+            'total_tokens': self.prompt_estimate + completion_tokens
+        }
+
+
+def download_vocab_files(vocab_dir: Optional[str] = None):
+    """
+    下载词表到本地目录（构建镜像时执行）
+    """
+    import tiktoken
+    vocab_dir = vocab_dir or Config.TOKENIZER_VOCAB_DIR
+    os.makedirs(vocab_dir, exist_ok=True)
+    os.environ['TIKTOKEN_CACHE_DIR'] = vocab_dir
+    for name in ENCODING_URLS:
+        tiktoken.get_encoding(name)
+        print(f"词表 {name} 已保存到 {vocab_dir}")
+
+# 全局Token计数器实例
+token_counter = TokenCounter()
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'download':
+        download_vocab_files(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        print("用法: python -m app.utils.tokenizer download [词表目录]")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+请求日志性能测试脚本
+
+对比每个聊天请求在请求线程上的日志开销：
+- 原方式：chat_completions 中逐条同步输出的日志（请求内容、完整的上游响应、流式响应的每个数据块），
+  使用 create_app 中 logging.basicConfig 的格式写入文件
+- 汇总日志：app/services/request_log.py，请求线程只把一条汇总记录放入队列，由后台线程格式化和写入
+
+T个线程各自记录N个请求（按比例混合流式和非流式请求），统计请求线程上每个请求的日志耗时，
+以及全部日志写入文件所需的时间。
+
+用法: python benchmarks/bench_logging.py [--requests 2000] [--threads 1,8,32] [--chunks 20] [--stream-ratio 0.5]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_streams import percentile
+
+MESSAGES = [{'role': 'user', 'content': 'Explain the difference between threads and processes. ' * 4}]
+
+
+def make_response(chunks: int):
+    """
+    模拟上游的非流式响应和流式数据块
+    """
+    response = {
+        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'model': 'gpt-3.5-turbo',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'word ' * 200}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 60, 'completion_tokens': 200, 'total_tokens': 260},
+        '_key_info': {'id': 1, 'name': 'bench'}, '_usage': {'prompt_tokens': 60, 'completion_tokens': 200, 'total_tokens': 260}
+    }
+    chunk = 'data: ' + json.dumps({'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk',
+                                   'choices': [{'index': 0, 'delta': {'content': 'word '}}]}) + '\n\n'
+    return response, [chunk] * chunks
+
+
+def original_logging(data: dict, stream: bool, response: dict, chunks, request_json: str, response_json: str):
+    """
+    原 chat_completions 在请求线程上输出的日志
+    """
+    logging.info("Received request for /v1/chat/completions")
+    logging.info(f"Request data: {data}")
+    if stream:
+        logging.info("Streaming response requested")
+        for chunk in chunks:
+            logging.info(f"Streaming chunk: {chunk}")
+    else:
+        logging.info("Calling OpenAI API for chat completion")
+        logging.info(f"OpenAI API response: {response}")
+
+
+def summary_logging(request_logger, data: dict, stream: bool, response: dict, chunks,
+                    request_json: str, response_json: str):
+    """
+    汇总日志：每个请求一条记录，请求和响应内容使用路由中为聊天历史序列化好的字符串
+    """
+    started = time.perf_counter()
+    request_logger.log_request(
+        started,
+        request_id='bench', path='/v1/chat/completions', model=data['model'], stream=stream,
+        request_body=request_json, response_body=None if stream else response_json,
+        status_code=200, key_id=1, served_model=data['model'],
+        prompt_tokens=60, completion_tokens=200, total_tokens=260,
+        latency_ms=500.0, ttfb_ms=80.0, overhead_ms=1.5
+    )
+
+
+def run(log_one, threads: int, requests: int, stream_ratio: float, chunks: int) -> list:
+    """
+    threads 个线程各自记录 requests 个请求，返回每个请求的日志耗时（微秒）
+    """
+    response, stream_chunks = make_response(chunks)
+    response_json = json.dumps(response)
+    timings = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for i in range(requests):
+            stream = (i % 100) < stream_ratio * 100
+            data = {'model': 'gpt-3.5-turbo', 'messages': MESSAGES, 'stream': stream}
+            request_json = json.dumps(data)
+            started = time.perf_counter()
+            log_one(data, stream, response, stream_chunks, request_json, response_json)
+            local.append((time.perf_counter() - started) * 1e6)
+        with lock:
+            timings.extend(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='请求日志性能测试')
+    parser.add_argument('--requests', type=int, default=2000, help='每个线程记录的请求数')
+    parser.add_argument('--threads', default='1,8,32', help='并发线程数（逗号分隔）')
+    parser.add_argument('--chunks', type=int, default=20, help='每个流的数据块数')
+    parser.add_argument('--stream-ratio', type=float, default=0.5, help='流式请求的比例')
+    parser.add_argument('--sample-rate', type=float, default=0.0, help='汇总日志记录请求和响应内容的比例')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench-logging-')
+    os.environ.update({
+        'REQUEST_LOG_PATH': os.path.join(tmp_dir, 'requests.log'),
+        'REQUEST_LOG_BODY_SAMPLE_RATE': str(args.sample_rate),
+        'REQUEST_LOG_QUEUE_MAXSIZE': str(10 ** 7)
+    })
+    from app.services.request_log import request_logger
+
+    # 与 create_app 相同的根logger配置，输出到文件
+    root_handler = logging.FileHandler(os.path.join(tmp_dir, 'app.log'))
+    root_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+    logging.basicConfig(level=logging.INFO, handlers=[root_handler])
+
+    modes = [
+        ('原方式（同步逐条日志）', original_logging, lambda: root_handler.flush()),
+        ('汇总日志（队列+后台线程）', lambda *a: summary_logging(request_logger, *a), request_logger.stop)
+    ]
+    print(f"每个线程 {args.requests} 个请求，流式请求比例 {args.stream_ratio:.0%}，每个流 {args.chunks} 个数据块")
+    print(f"{'方式':<20} {'线程':>4} {'平均':>9} {'p50':>9} {'p99':>9} {'全部写完':>10} {'日志大小':>10}")
+    for label, log_one, finish in modes:
+        for threads in [int(n) for n in args.threads.split(',')]:
+            log_path = root_handler.baseFilename if log_one is original_logging else os.environ['REQUEST_LOG_PATH']
+            size_before = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+            started = time.perf_counter()
+            timings = run(log_one, threads, args.requests, args.stream_ratio, args.chunks)
+            finish()
+            elapsed = time.perf_counter() - started
+            size = (os.path.getsize(log_path) - size_before) / 1024 / 1024
+            print(f"{label:<20} {threads:>4} {sum(timings) / len(timings):>7.1f}us {percentile(timings, 50):>7.1f}us "
+                  f"{percentile(timings, 99):>7.1f}us {elapsed:>8.2f}s {size:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
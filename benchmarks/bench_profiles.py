@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Gunicorn配置性能测试脚本
+
+在模拟上游前分别用 app/gunicorn_conf.py 的各个配置（以及原来的同步worker部署）启动代理服务，
+C个客户端在固定时间内循环发送请求（按比例混合流式和非流式请求），统计吞吐量、延迟百分位和失败数。
+流式请求的延迟按完整读取响应计算。
+
+用法: python benchmarks/bench_profiles.py [--servers flask-sync,gunicorn-gthread,gunicorn-gevent,gunicorn-uvicorn]
+                                        [--concurrency 16,64,256] [--duration 20] [--stream-ratio 0.5]
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks.bench_streams import ROOT, percentile, prepare_database, start_server, stop_server, sample
+
+
+async def run_load(port: int, pid: int, concurrency: int, duration: float, stream_ratio: float) -> dict:
+    """
+    concurrency 个客户端循环发送请求 duration 秒
+    """
+    latencies = {'stream': [], 'json': []}
+    errors = Counter()
+    peak_rss = 0
+    url = f'http://127.0.0.1:{port}/v1/chat/completions'
+    messages = [{'role': 'user', 'content': 'hello'}]
+    stop_at = time.perf_counter() + duration
+
+    async def client_loop(client: httpx.AsyncClient):
+        while time.perf_counter() < stop_at:
+            stream = random.random() < stream_ratio
+            body = {'model': 'gpt-3.5-turbo', 'stream': stream, 'messages': messages}
+            started = time.perf_counter()
+            try:
+                async with client.stream('POST', url, json=body) as response:
+                    content = await response.aread()
+                if response.status_code != 200:
+                    errors[f'HTTP {response.status_code}'] += 1
+                elif b'[DONE]' in content if stream else b'choices' in content:
+                    latencies['stream' if stream else 'json'].append((time.perf_counter() - started) * 1000)
+                else:
+                    errors['bad response'] += 1
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] += 1
+
+    async def sampler():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, sample(pid)[0])
+            await asyncio.sleep(0.2)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(duration + 30)) as client:
+        sampling = asyncio.create_task(sampler())
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        sampling.cancel()
+
+    everything = latencies['stream'] + latencies['json']
+    return {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'error_types': dict(errors),
+        'throughput': len(everything) / elapsed,
+        'p50': percentile(everything, 50),
+        'p99': percentile(everything, 99),
+        'json_p99': percentile(latencies['json'], 99),
+        'stream_p99': percentile(latencies['stream'], 99),
+        'peak_rss': peak_rss
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gunicorn配置性能测试')
+    parser.add_argument('--servers', default='flask-sync,gunicorn-gthread,gunicorn-gevent,gunicorn-uvicorn',
+                        help='要测试的部署方式（逗号分隔），见 bench_streams.SERVERS')
+    parser.add_argument('--concurrency', default='16,64,256', help='并发客户端数（逗号分隔）')
+    parser.add_argument('--duration', type=float, default=20, help='每轮测试时间（秒）')
+    parser.add_argument('--stream-ratio', type=float, default=0.5, help='流式请求的比例')
+    parser.add_argument('--chunks', type=int, default=10, help='每个流的数据块数')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='上游数据块间隔（秒）')
+    parser.add_argument('--delay', type=float, default=0.2, help='上游非流式响应延迟（秒）')
+    parser.add_argument('--port', type=int, default=18210, help='代理端口')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    upstream_port = args.port + 1
+    tmp_dir = tempfile.mkdtemp(prefix='bench-profiles-')
+    upstream = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_upstream.py'),
+                                 str(upstream_port), str(args.chunks), str(args.chunk_delay), str(args.delay)])
+    results = []
+    try:
+        env = prepare_database(tmp_dir, upstream_port)
+        print(f"流式请求比例 {args.stream_ratio:.0%}，每个流约 {args.chunks * args.chunk_delay:.1f} 秒，"
+              f"非流式请求约 {args.delay:.1f} 秒；每轮 {args.duration:.0f} 秒")
+        print(f"{'部署方式':<18} {'并发':>5} {'请求数':>7} {'失败':>5} {'吞吐量':>9} {'p50':>8} {'p99':>8} "
+              f"{'非流式p99':>9} {'流式p99':>8} {'峰值内存MB':>10}")
+        for name in args.servers.split(','):
+            for concurrency in [int(n) for n in args.concurrency.split(',')]:
+                proc = start_server(name, args.port, env, tmp_dir)
+                try:
+                    result = asyncio.run(run_load(args.port, proc.pid, concurrency, args.duration, args.stream_ratio))
+                finally:
+                    stop_server(proc)
+                result.update({'server': name, 'concurrency': concurrency})
+                results.append(result)
+                print(f"{name:<18} {concurrency:>5} {result['requests']:>7} {result['errors']:>5} "
+                      f"{result['throughput']:>7.1f}/s {(result['p50'] or 0):>6.0f}ms {(result['p99'] or 0):>6.0f}ms "
+                      f"{(result['json_p99'] or 0):>7.0f}ms {(result['stream_p99'] or 0):>6.0f}ms "
+                      f"{result['peak_rss'] / 1024 / 1024:>10.1f}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
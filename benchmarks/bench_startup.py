@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+启动性能测试脚本
+
+1. 导入耗时分析：用 python -X importtime 导入 app.main，按模块和顶层包汇总导入耗时
+2. 启动对比：分别用原来的部署方式（gunicorn -w 4，每个worker各自导入应用并初始化数据库）
+   和 app/gunicorn_conf.py（主进程初始化一次数据库并预加载应用）启动服务，
+   统计从启动到第一个请求成功的时间，以及预热后主进程和每个worker的内存
+
+用法: python benchmarks/bench_startup.py [--workers 4] [--rounds 3] [--top 15]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import psutil
+
+from benchmarks.bench_streams import prepare_database, start_server, stop_server
+
+# (说明, bench_streams.SERVERS 中的部署方式, 额外的环境变量)
+MODES = [
+    ('原部署 gunicorn -w 4', 'flask-sync', {}),
+    ('gthread 不预加载', 'gunicorn-gthread', {'GUNICORN_PRELOAD': 'False'}),
+    ('gthread 预加载', 'gunicorn-gthread', {})
+]
+
+
+def import_profile(env: dict, cwd: str):
+    """
+    导入 app.main 并解析 -X importtime 的输出，返回 [(模块, 自身耗时us, 累计耗时us)]
+    """
+    env = dict(env, DATABASE_BOOTSTRAP='False')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app.main'],
+                            env=env, cwd=cwd, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def print_import_profile(modules, top: int):
+    """
+    输出导入耗时报告
+    """
+    total = next((cumulative for name, _, cumulative in modules if name == 'app.main'), 0)
+    print(f"导入 app.main 共 {total / 1000:.0f}ms（不包括数据库初始化）")
+    packages = defaultdict(int)
+    for name, self_us, _ in modules:
+        packages[name.split('.')[0]] += self_us
+    print(f"\n按顶层包汇总（前{top}个）:")
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:<30} {self_us / 1000:>8.1f}ms {self_us / max(total, 1):>6.1%}")
+    print(f"\n应用模块自身耗时（前{top}个）:")
+    own = [m for m in modules if m[0] == 'app' or m[0].startswith('app.')]
+    for name, self_us, cumulative_us in sorted(own, key=lambda m: -m[1])[:top]:
+        print(f"  {name:<40} 自身 {self_us / 1000:>7.1f}ms  累计 {cumulative_us / 1000:>7.1f}ms")
+
+
+def measure_memory(pid: int) -> dict:
+    """
+    统计主进程和worker的内存：RSS、USS（进程独占）和PSS（共享页按进程数分摊）
+    """
+    master = psutil.Process(pid)
+    workers = master.children(recursive=True)
+    info = {proc.pid: proc.memory_full_info() for proc in [master] + workers}
+    return {
+        'workers': len(workers),
+        'master_rss': info[pid].rss,
+        'worker_rss': sum(info[w.pid].rss for w in workers) / max(len(workers), 1),
+        'worker_uss': sum(info[w.pid].uss for w in workers) / max(len(workers), 1),
+        'total_pss': sum(item.pss for item in info.values())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动性能测试')
+    parser.add_argument('--workers', type=int, default=4, help='worker数量')
+    parser.add_argument('--rounds', type=int, default=3, help='每种部署方式启动的次数，取中位数')
+    parser.add_argument('--top', type=int, default=15, help='导入耗时报告中显示的模块数')
+    parser.add_argument('--port', type=int, default=18220, help='代理端口')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    env = prepare_database(tmp_dir, args.port + 1)
+    env['GUNICORN_WORKERS'] = str(args.workers)
+
+    print_import_profile(import_profile(env, tmp_dir), args.top)
+
+    print(f"\n{args.workers} 个worker，每种方式启动 {args.rounds} 次取中位数，预热后统计内存")
+    print(f"{'部署方式':<22} {'首个请求成功':>10} {'主进程RSS':>10} {'worker RSS':>11} {'worker USS':>11} {'总PSS':>9}")
+    for label, name, extra_env in MODES:
+        ready_times, memory = [], []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            proc = start_server(name, args.port, dict(env, **extra_env), tmp_dir)
+            ready_times.append(time.perf_counter() - started)
+            try:
+                # 等待所有worker启动，再让每个worker都处理过请求
+                time.sleep(3)
+                with httpx.Client() as client:
+                    for _ in range(20 * args.workers):
+                        client.get(f'http://127.0.0.1:{args.port}/v1/models', headers={'Connection': 'close'})
+                memory.append(measure_memory(proc.pid))
+            finally:
+                stop_server(proc)
+        ready = sorted(ready_times)[len(ready_times) // 2]
+        mem = sorted(memory, key=lambda m: m['total_pss'])[len(memory) // 2]
+        mb = 1024 * 1024
+        print(f"{label:<22} {ready * 1000:>8.0f}ms {mem['master_rss'] / mb:>8.1f}MB {mem['worker_rss'] / mb:>9.1f}MB "
+              f"{mem['worker_uss'] / mb:>9.1f}MB {mem['total_pss'] / mb:>7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
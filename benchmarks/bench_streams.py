@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+流式并发性能测试脚本
+
+在模拟上游（benchmarks/mock_upstream.py）前分别启动各种部署方式的代理服务，
+同时发起N个流式 /v1/chat/completions 请求，统计同时保持的最大流数、在截止时间内完成的流数、
+首字节耗时，以及服务进程（包括子进程）的内存和线程数，计算每个并发流占用的内存。
+
+用法: python benchmarks/bench_streams.py [--servers flask-sync,asgi,gunicorn-gthread] [--streams 50,200,500]
+"""
+
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUNICORN_CONF = os.path.join(ROOT, 'app', 'gunicorn_conf.py')
+
+# 各部署方式的启动命令，{port} 为代理端口
+SERVERS = {
+    # 原 Dockerfile 的部署方式：gunicorn 4个同步worker
+    'flask-sync': ['gunicorn', '-w', '4', '-b', '127.0.0.1:{port}', 'app.main:app'],
+    # ASGI数据面：单个uvicorn进程
+    'asgi': ['uvicorn', 'app.asgi_main:app', '--host', '127.0.0.1', '--port', '{port}', '--no-access-log'],
+    # app/gunicorn_conf.py 中的各个配置
+    'gunicorn-gthread': ['env', 'GUNICORN_PROFILE=gthread', 'GUNICORN_BIND=127.0.0.1:{port}', 'gunicorn', '-c', GUNICORN_CONF],
+    'gunicorn-gevent': ['env', 'GUNICORN_PROFILE=gevent', 'GUNICORN_BIND=127.0.0.1:{port}', 'gunicorn', '-c', GUNICORN_CONF],
+    'gunicorn-uvicorn': ['env', 'GUNICORN_PROFILE=uvicorn', 'GUNICORN_BIND=127.0.0.1:{port}', 'gunicorn', '-c', GUNICORN_CONF]
+}
+
+
+def percentile(values, percent):
+    """
+    计算百分位数（最近秩法）
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)]
+
+
+def prepare_database(tmp_dir: str, upstream_port: int) -> dict:
+    """
+    初始化测试数据库并添加Key，返回服务进程的环境变量
+    """
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f'sqlite:///{tmp_dir}/app.db',
+        'OPENAI_API_BASE_URL': f'http://127.0.0.1:{upstream_port}/v1',
+        'MAINTENANCE_LOCK_PATH': f'{tmp_dir}/maintenance.lock',
+        'HISTORY_SPILL_PATH': f'{tmp_dir}/spill.jsonl',
+        'HEARTBEAT_AUTO_START': 'False',
+        'DEBUG': 'False',
+        'PYTHONPATH': ROOT
+    })
+    script = (
+        "from app import create_app, db\n"
+        "from app.models.key import Key\n"
+        "app = create_app()\n"
+        "with app.app_context():\n"
+        "    for i in range(4):\n"
+        "        db.session.add(Key(key_value=f'sk-bench-{i:040d}', name=f'bench-{i}'))\n"
+        "    db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, '-c', script], env=env, cwd=tmp_dir, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return env
+
+
+def process_tree(pid: int):
+    """
+    获取服务进程及其所有子进程
+    """
+    try:
+        parent = psutil.Process(pid)
+        return [parent] + parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def sample(pid: int):
+    """
+    统计服务进程树的常驻内存（字节）和线程数
+    """
+    rss = threads = 0
+    for proc in process_tree(pid):
+        try:
+            rss += proc.memory_info().rss
+            threads += proc.num_threads()
+        except psutil.NoSuchProcess:
+            pass
+    return rss, threads
+
+
+def start_server(name: str, port: int, env: dict, cwd: str) -> subprocess.Popen:
+    """
+    启动代理服务并等待就绪
+    """
+    command = [arg.format(port=port) for arg in SERVERS[name]]
+    proc = subprocess.Popen(command, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/v1/models', timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{name} 启动失败')
+
+
+def stop_server(proc: subprocess.Popen):
+    """
+    停止代理服务，主进程退出超时时连同worker一起结束，避免占用端口
+    """
+    children = process_tree(proc.pid)[1:]
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    for child in children:
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(children, timeout=5)
+
+
+async def run_streams(port: int, pid: int, streams: int, deadline: float) -> dict:
+    """
+    同时发起 streams 个流式请求，在 deadline 秒内统计结果
+    """
+    state = {'active': 0, 'max_active': 0, 'peak_rss': 0, 'peak_threads': 0}
+    ttfbs = []
+    completed = 0
+    body = {'model': 'gpt-3.5-turbo', 'stream': True, 'messages': [{'role': 'user', 'content': 'hello'}]}
+
+    async def one(client: httpx.AsyncClient):
+        nonlocal completed
+        started = time.perf_counter()
+        first = True
+        try:
+            async with client.stream('POST', f'http://127.0.0.1:{port}/v1/chat/completions', json=body) as response:
+                async for chunk in response.aiter_raw():
+                    if first and chunk:
+                        first = False
+                        ttfbs.append((time.perf_counter() - started) * 1000)
+                        state['active'] += 1
+                        state['max_active'] = max(state['max_active'], state['active'])
+                    if b'[DONE]' in chunk:
+                        completed += 1
+        except httpx.HTTPError:
+            pass
+        finally:
+            if not first:
+                state['active'] -= 1
+
+    async def sampler():
+        while True:
+            rss, threads = sample(pid)
+            state['peak_rss'] = max(state['peak_rss'], rss)
+            state['peak_threads'] = max(state['peak_threads'], threads)
+            await asyncio.sleep(0.1)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(deadline)) as client:
+        sampling = asyncio.create_task(sampler())
+        tasks = [asyncio.create_task(one(client)) for _ in range(streams)]
+        started = time.perf_counter()
+        await asyncio.wait(tasks, timeout=deadline)
+        elapsed = time.perf_counter() - started
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        sampling.cancel()
+
+    return {
+        'completed': completed,
+        'max_active': state['max_active'],
+        'ttfb_p50': percentile(ttfbs, 50),
+        'ttfb_p99': percentile(ttfbs, 99),
+        'peak_rss': state['peak_rss'],
+        'peak_threads': state['peak_threads'],
+        'elapsed': elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式并发性能测试')
+    parser.add_argument('--servers', default='flask-sync,asgi', help='要测试的部署方式（逗号分隔）')
+    parser.add_argument('--streams', default='50,200,500', help='并发流数（逗号分隔）')
+    parser.add_argument('--chunks', type=int, default=20, help='每个流的数据块数')
+    parser.add_argument('--chunk-delay', type=float, default=0.25, help='上游数据块间隔（秒）')
+    parser.add_argument('--port', type=int, default=18200, help='代理端口')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    stream_seconds = args.chunks * args.chunk_delay
+    deadline = stream_seconds * 3
+    upstream_port = args.port + 1
+    tmp_dir = tempfile.mkdtemp(prefix='bench-streams-')
+    upstream = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_upstream.py'),
+                                 str(upstream_port), str(args.chunks), str(args.chunk_delay)])
+    results = []
+    try:
+        env = prepare_database(tmp_dir, upstream_port)
+        print(f"每个流 {args.chunks} 个数据块，持续约 {stream_seconds:.1f} 秒；截止时间 {deadline:.1f} 秒")
+        print(f"{'部署方式':<14} {'并发流':>6} {'完成':>6} {'最大同时':>8} {'首字节p50':>10} {'首字节p99':>10} "
+              f"{'峰值内存MB':>10} {'每流KB':>8} {'峰值线程':>8}")
+        for name in args.servers.split(','):
+            for streams in [int(n) for n in args.streams.split(',')]:
+                proc = start_server(name, args.port, env, tmp_dir)
+                try:
+                    idle_rss, _ = sample(proc.pid)
+                    result = asyncio.run(run_streams(args.port, proc.pid, streams, deadline))
+                finally:
+                    stop_server(proc)
+                per_stream = (result['peak_rss'] - idle_rss) / max(result['max_active'], 1) / 1024
+                result.update({'server': name, 'streams': streams, 'idle_rss': idle_rss, 'rss_per_stream_kb': per_stream})
+                results.append(result)
+                print(f"{name:<14} {streams:>6} {result['completed']:>6} {result['max_active']:>8} "
+                      f"{(result['ttfb_p50'] or 0):>9.0f}ms {(result['ttfb_p99'] or 0):>9.0f}ms "
+                      f"{result['peak_rss'] / 1024 / 1024:>10.1f} {per_stream:>8.0f} {result['peak_threads']:>8}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Token估算性能测试脚本
+
+在长对话消息列表上测试近似估算和离线词表计数的吞吐量，
+并在词表可用时对比近似估算的误差。
+
+用法: python benchmarks/bench_tokenizer.py [轮数...]
+"""
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.tokenizer import TokenCounter, _approx_count
+
+SAMPLE_TURNS = [
+    ("user", "Can you explain how the weighted round robin key rotation works in this proxy, "
+             "and why keys with fewer requests are picked more often?"),
+    ("assistant", "Sure. Each active key gets a weight of total_usage - key.usage_count + 1, so a key "
+                  "that has served fewer requests has a larger weight and is chosen more frequently."),
+    ("user", "请用中文总结一下上面的内容，并给出一个包含三个Key的计算示例。"),
+    ("assistant", "假设三个Key的使用次数分别为10、5和0，总次数为15，那么权重依次为6、11和16。"),
+    ("user", "Here is the code:\n```python\ndef weight(total, used):\n    return total - used + 1\n```\n"
+             "What happens when total is 0?"),
+    ("assistant", "When total is 0 every key has weight 1, so the proxy falls back to plain round robin "
+                  "using the current index, which is exactly what get_weighted_round_robin_key does."),
+]
+
+
+def build_messages(turns: int):
+    """
+    构建指定轮数的对话消息列表
+    """
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        role, content = SAMPLE_TURNS[i % len(SAMPLE_TURNS)]
+        messages.append({"role": role, "content": f"[{i}] {content}"})
+    return messages
+
+
+def bench(counter, messages, model, repeat):
+    """
+    重复计数并返回 (每秒处理的消息数, 每秒处理的token数, token数)
+    """
+    tokens = counter.count_messages(messages, model)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        counter.count_messages(messages, model)
+    elapsed = time.perf_counter() - start
+    return len(messages) * repeat / elapsed, tokens * repeat / elapsed, tokens
+
+
+def main():
+    turn_counts = [int(arg) for arg in sys.argv[1:]] or [20, 200, 2000]
+    counter = TokenCounter()
+    exact = counter.is_exact('gpt-3.5-turbo')
+
+    approx = TokenCounter()
+    approx._encodings = {'cl100k_base': None, 'o200k_base': None}
+
+    print(f"离线词表: {'可用' if exact else '不可用，仅测试近似估算'}")
+    print(f"{'轮数':>6} {'字符数':>10} {'模式':>6} {'token数':>10} {'消息/秒':>12} {'token/秒':>14} {'误差':>8}")
+    for turns in turn_counts:
+        messages = build_messages(turns)
+        chars = sum(len(m['content']) for m in messages)
+        repeat = max(1, 20000 // turns)
+
+        msg_rate, token_rate, approx_tokens = bench(approx, messages, 'gpt-3.5-turbo', repeat)
+        print(f"{turns:>6} {chars:>10} {'近似':>6} {approx_tokens:>10} {msg_rate:>12.0f} {token_rate:>14.0f} {'-':>8}")
+
+        if exact:
+            msg_rate, token_rate, exact_tokens = bench(counter, messages, 'gpt-3.5-turbo', repeat)
+            error = (approx_tokens - exact_tokens) / exact_tokens
+            print(f"{turns:>6} {chars:>10} {'词表':>6} {exact_tokens:>10} {msg_rate:>12.0f} {token_rate:>14.0f} {error:>8.1%}")
+
+    # 单独测试近似算法对纯文本的处理速度
+    text = ''.join(content for _, content in SAMPLE_TURNS) * 1000
+    start = time.perf_counter()
+    _approx_count(text)
+    elapsed = time.perf_counter() - start
+    print(f"\n近似估算纯文本速度: {len(text) / elapsed / 1024 / 1024:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+性能测试用的模拟OpenAI上游
+
+基于asyncio实现，可以同时保持大量流式连接：流式请求按固定间隔返回若干个SSE数据块，
+非流式请求在固定延迟后返回完整结果，GET /v1/models 返回模型列表。
+
+用法: python benchmarks/mock_upstream.py [端口] [数据块数] [数据块间隔秒数] [非流式延迟秒数]
+"""
+
+import sys
+import json
+import asyncio
+
+MODELS = {'object': 'list', 'data': [
+    {'id': 'gpt-3.5-turbo', 'object': 'model', 'created': 1677610602, 'owned_by': 'openai'},
+    {'id': 'gpt-4', 'object': 'model', 'created': 1687882411, 'owned_by': 'openai'}
+]}
+
+
+class MockUpstream:
+    """
+    模拟上游服务
+    """
+
+    def __init__(self, chunks: int = 20, chunk_delay: float = 0.25, delay: float = 0.05):
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.delay = delay
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        处理一个连接上的请求（支持keep-alive）
+        """
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                method = lines[0].split(' ')[0]
+                headers = {line.split(':', 1)[0].lower(): line.split(':', 1)[1].strip()
+                           for line in lines[1:] if ':' in line}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                if method == 'GET':
+                    await self._send_json(writer, MODELS)
+                    continue
+                data = json.loads(body or b'{}')
+                if data.get('stream'):
+                    await self._send_stream(writer, data)
+                else:
+                    await asyncio.sleep(self.delay)
+                    await self._send_json(writer, {
+                        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'model': data.get('model'),
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'Hello from the mock upstream.'},
+                                     'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': 12, 'completion_tokens': 6, 'total_tokens': 18}
+                    })
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, payload):
+        body = json.dumps(payload).encode()
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, data):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n')
+        events = [{'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk',
+                   'choices': [{'index': 0, 'delta': {'content': f' token{i}'}}]} for i in range(self.chunks)]
+        if (data.get('stream_options') or {}).get('include_usage'):
+            events.append({'choices': [], 'usage': {'prompt_tokens': 12, 'completion_tokens': self.chunks,
+                                                    'total_tokens': 12 + self.chunks}})
+        for event in events:
+            line = f'data: {json.dumps(event)}\n\n'.encode()
+            writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+            await writer.drain()
+            await asyncio.sleep(self.chunk_delay)
+        line = b'data: [DONE]\n\n'
+        writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n0\r\n\r\n')
+        await writer.drain()
+
+
+async def serve(port: int, upstream: MockUpstream):
+    server = await asyncio.start_server(upstream.handle, '127.0.0.1', port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    port = int(args[0]) if len(args) > 0 else 18081
+    upstream = MockUpstream(
+        chunks=int(args[1]) if len(args) > 1 else 20,
+        chunk_delay=float(args[2]) if len(args) > 2 else 0.25,
+        delay=float(args[3]) if len(args) > 3 else 0.05
+    )
+    asyncio.run(serve(port, upstream))
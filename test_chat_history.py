@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+聊天历史列表测试脚本
+
+在临时SQLite数据库上测试 ChatHistoryService 的键集分页：按 (timestamp, id) 倒序翻页不漏行也不重复
+（包括时间相同的行），翻页期间写入的新记录不影响后面的页，过滤条件组合和字段投影，以及无效参数。
+"""
+
+import os
+import sys
+import logging
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app, db
+from app.models.chat_history import ChatHistory
+from app.services.chat_history_service import ChatHistoryService, DEFAULT_LIST_FIELDS, MAX_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+client = app.test_client()
+with client.session_transaction() as session:
+    session['logged_in'] = True
+
+START = datetime(2024, 1, 1)
+
+
+def setup_module(module=None):
+    """写入30条聊天历史，每3条的时间相同，Key在1、2、3之间轮换，每4条有一条失败请求"""
+    with app.app_context():
+        ChatHistory.query.delete()
+        for i in range(30):
+            db.session.add(ChatHistory(
+                key_id=i % 3 + 1, model='gpt-4' if i % 2 else 'gpt-3.5', request=f'request-{i}', response='ok',
+                timestamp=START + timedelta(minutes=i // 3), tokens_used=i, is_error=i % 4 == 0
+            ))
+        db.session.commit()
+
+
+def expected_ids(**conditions):
+    """按列表的排序规则直接查询全部符合条件的id"""
+    with app.app_context():
+        query = ChatHistory.query.filter_by(**conditions)
+        return [row.id for row in query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())]
+
+
+def read_pages(limit, **filters):
+    """按 next_cursor 翻完所有页，返回每页的id"""
+    pages = []
+    cursor = None
+    with app.app_context():
+        while True:
+            page = ChatHistoryService.list_history(limit=limit, cursor=cursor, **filters)
+            pages.append([item['id'] for item in page['items']])
+            cursor = page['pagination']['next_cursor']
+            assert page['pagination']['has_more'] == (cursor is not None)
+            if cursor is None:
+                return pages
+
+
+def test_keyset_pagination():
+    """测试翻页结果与一次查询全部的结果相同，页边界落在时间相同的行中间时也不漏行"""
+    logger.info("测试键集分页...")
+    for limit in (1, 4, 7, 30, 31):
+        pages = read_pages(limit)
+        ids = [history_id for page in pages for history_id in page]
+        assert ids == expected_ids(), f"limit={limit} 时翻页结果与全量查询不同"
+        assert all(len(page) == limit for page in pages[:-1])
+    logger.info("✓ 不同页大小下翻页结果都与全量查询相同")
+
+
+def test_new_rows_do_not_shift_pages():
+    """测试翻页期间写入的新记录不会让后面的页重复或漏掉已有的行"""
+    logger.info("测试翻页期间写入...")
+    with app.app_context():
+        first = ChatHistoryService.list_history(limit=10)
+        db.session.add(ChatHistory(key_id=1, model='m', request='late', timestamp=START + timedelta(days=1)))
+        db.session.commit()
+        late_id = ChatHistory.query.filter_by(request='late').one().id
+        second = ChatHistoryService.list_history(limit=10, cursor=first['pagination']['next_cursor'])
+        ChatHistory.query.filter_by(id=late_id).delete()
+        db.session.commit()
+    ids = [item['id'] for item in first['items'] + second['items']]
+    assert ids == expected_ids()[:20], "翻页期间写入新记录后页面发生了偏移"
+    logger.info("✓ 新记录不影响游标之后的页")
+
+
+def test_filters_and_fields():
+    """测试过滤条件组合和字段投影"""
+    logger.info("测试过滤和字段...")
+    with app.app_context():
+        default = ChatHistoryService.list_history(limit=5)
+        projected = ChatHistoryService.list_history(limit=5, fields=['id', 'request'])
+        end = START + timedelta(minutes=8)
+        filtered = ChatHistoryService.list_history(
+            limit=MAX_PAGE_SIZE, fields=['request'], key_id=2, model='gpt-4', status='success',
+            start=START + timedelta(minutes=2), end=end
+        )
+    assert list(default['items'][0]) == list(DEFAULT_LIST_FIELDS), "默认字段不应包含请求和响应内容"
+    assert list(projected['items'][0]) == ['id', 'request']
+    assert projected['items'][0]['request'].startswith('request-')
+
+    # 第6到23条中 Key 2（i % 3 == 1）、gpt-4（i 为奇数）且成功的请求
+    assert [item['request'] for item in filtered['items']] == ['request-19', 'request-13', 'request-7'], filtered['items']
+    error_ids = [history_id for page in read_pages(3, key_id=1, status='error') for history_id in page]
+    assert error_ids == expected_ids(key_id=1, is_error=True) and error_ids, "Key和状态组合过滤的结果不正确"
+    windowed = [history_id for page in read_pages(4, start=START + timedelta(minutes=2), end=end) for history_id in page]
+    assert len(windowed) == 18, f"时间范围过滤的结果不正确: {len(windowed)}"
+    logger.info("✓ 过滤条件可以组合，只返回指定的字段")
+
+
+def test_invalid_params():
+    """测试无效的游标、页大小、状态和字段返回400"""
+    logger.info("测试无效参数...")
+    with app.app_context():
+        for kwargs in ({'cursor': 'not-a-cursor'}, {'limit': 0}, {'limit': MAX_PAGE_SIZE + 1}, {'status': 'pending'}):
+            try:
+                ChatHistoryService.list_history(**kwargs)
+            except ValueError:
+                continue
+            raise AssertionError(f"{kwargs} 没有抛出 ValueError")
+
+    assert client.get('/api/chat/history?cursor=abc').status_code == 400
+    assert client.get('/api/chat/history?fields=id,secret').status_code == 400
+    response = client.get('/api/chat/history?limit=2&key_id=3&fields=id,key_id')
+    body = response.get_json()
+    assert response.status_code == 200 and [item['key_id'] for item in body['data']] == [3, 3]
+    assert body['pagination']['has_more'] and body['pagination']['next_cursor']
+    logger.info("✓ 无效参数返回400")
+
+
+def run_tests():
+    """运行所有测试"""
+    setup_module()
+    tests = [
+        test_keyset_pagination,
+        test_new_rows_do_not_shift_pages,
+        test_filters_and_fields,
+        test_invalid_params
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)
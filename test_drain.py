@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+优雅停机测试脚本
+
+用单独的Flask应用测试 InFlightMiddleware 和 DrainService：流式响应发送完才算请求结束，
+排空期间新请求返回503，drain 等待正在进行的请求，cancel 通知流式响应停止并等待它们结束。
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask, Response
+from app.services.drain_service import DrainService
+
+logger = logging.getLogger(__name__)
+
+
+def make_app():
+    """创建带一个普通接口和一个流式接口的应用，流式接口在 cancelled 后停止"""
+    app = Flask(__name__)
+    service = DrainService(app)
+    service.timeout = 1
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            for i in range(100):
+                if service.cancelled:
+                    yield 'data: shutdown\n\n'
+                    return
+                yield f'data: {i}\n\n'
+                time.sleep(0.02)
+        return Response(generate(), mimetype='text/event-stream')
+
+    return app, service
+
+
+def test_stream_counts_until_closed():
+    """测试流式响应在发送完或关闭之前一直计为正在进行的请求"""
+    logger.info("测试正在进行的请求计数...")
+    app, service = make_app()
+    client = app.test_client()
+    # WSGI服务器发送完响应后调用 close，测试客户端需要显式关闭
+    response = client.get('/ping')
+    assert response.get_data() == b'pong'
+    response.close()
+    assert service.get_status()['in_flight'] == 0
+
+    response = client.get('/stream', buffered=False)
+    next(iter(response.response))
+    assert service.get_status()['in_flight'] == 1, "流式响应开始后没有计为正在进行的请求"
+    response.close()
+    assert service.get_status()['in_flight'] == 0, "客户端断开后请求没有结束"
+    logger.info("✓ 流式响应关闭后才计为结束")
+
+
+def test_drain_rejects_new_requests():
+    """测试排空期间等待正在进行的请求，新请求返回503"""
+    logger.info("测试排空...")
+    app, service = make_app()
+    client = app.test_client()
+    response = client.get('/stream', buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+
+    assert not service.drain(0.1), "还有正在进行的请求时 drain 不应返回成功"
+    rejected = client.get('/ping')
+    assert rejected.status_code == 503, f"排空期间的新请求没有返回503: {rejected.status_code}"
+    assert rejected.headers.get('Retry-After') == '1'
+    assert rejected.get_json()['error']['code'] == 'draining'
+
+    # 正在进行的流不受影响，发送完后 drain 返回成功
+    threading.Thread(target=lambda: (list(chunks), response.close())).start()
+    assert service.drain(5), "流发送完后 drain 没有返回成功"
+    logger.info("✓ 排空期间拒绝新请求，等待正在进行的流发送完")
+
+
+def test_cancel_stops_streams():
+    """测试 cancel 通知流式响应停止并等待它们结束"""
+    logger.info("测试停止超时的流...")
+    app, service = make_app()
+    client = app.test_client()
+    response = client.get('/stream', buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    received = []
+
+    def consume():
+        received.extend(chunks)
+        response.close()
+    threading.Thread(target=consume).start()
+
+    started = time.monotonic()
+    assert service.cancel(5), "cancel 没有等到流结束"
+    assert time.monotonic() - started < 1, "流没有在 cancel 后尽快停止"
+    assert received and received[-1] == b'data: shutdown\n\n', f"流没有收到停止通知: {received[-1:]}"
+    logger.info(f"✓ cancel 后流在 {(time.monotonic() - started) * 1000:.0f}ms 内停止")
+
+
+def test_track():
+    """测试 track 统计不经过中间件的请求（ASGI的流式响应）"""
+    logger.info("测试 track...")
+    service = DrainService()
+    with service.track():
+        assert service.get_status()['in_flight'] == 1
+        assert not service.drain(0.05)
+    assert service.drain(0.05)
+    logger.info("✓ track 期间 drain 等待，结束后返回成功")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_stream_counts_until_closed,
+        test_drain_rejects_new_requests,
+        test_cancel_stops_streams,
+        test_track
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+数据导出测试脚本
+
+在临时SQLite数据库上测试 ExportService：按主键分批读取不漏行也不重复，NDJSON和CSV的编码与分块，
+天粒度的使用统计导出从小时级汇总补齐尚未合并的天，以及导出接口的流式响应。
+"""
+
+import os
+import sys
+import csv
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from sqlalchemy import select
+from app import create_app, db
+from app.models.chat_history import ChatHistory
+from app.models.usage_rollup import ROLLUP_MODELS
+from app.services import export_service
+from app.services.export_service import ExportService, USAGE_FIELDS
+from app.services.rollup_service import RollupService
+from app.utils.time_buckets import floor_datetime
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+client = app.test_client()
+with client.session_transaction() as session:
+    session['logged_in'] = True
+
+START = datetime(2024, 1, 1)
+
+
+def setup_module(module=None):
+    """写入25条聊天历史，每5条使用同一个Key，第3条起每隔3条为失败请求"""
+    with app.app_context():
+        ChatHistory.query.delete()
+        for i in range(25):
+            db.session.add(ChatHistory(
+                key_id=i // 5 + 1, model='gpt-4' if i % 2 else 'gpt-3.5', request=json.dumps({'i': i}),
+                response='ok, "quoted"\nsecond line', timestamp=START + timedelta(minutes=i),
+                tokens_used=i, cost_nanos=i * 1000, is_error=i % 3 == 2
+            ))
+        db.session.commit()
+
+
+def test_iter_rows_batches():
+    """测试分批读取按主键顺序返回全部行，导出期间新写入的行在最后一批中读到"""
+    logger.info("测试分批读取...")
+    with app.app_context():
+        rows = ExportService.iter_rows(select(ChatHistory.id.label('id')), ChatHistory.id, batch_size=10)
+        ids = [next(rows).id for _ in range(10)]
+        # 第一批读完后连接已释放，写入不受影响
+        db.session.add(ChatHistory(key_id=99, model='m', request='late', timestamp=START))
+        db.session.commit()
+        ids.extend(row.id for row in rows)
+        ChatHistory.query.filter_by(key_id=99).delete()
+        db.session.commit()
+    assert ids == sorted(ids) and len(ids) == len(set(ids)) == 26, f"分批读取漏行或重复: {len(ids)}"
+    logger.info("✓ 分批读取26行，没有遗漏或重复")
+
+
+def test_chat_history_filters_and_fields():
+    """测试聊天历史导出只包含指定的字段，过滤条件与列表相同"""
+    logger.info("测试聊天历史导出的过滤和字段...")
+    fields = ['id', 'model', 'cost', 'is_error']
+    with app.app_context():
+        records = list(ExportService.iter_chat_history(fields, key_id=2, status='error', model='gpt-4'))
+    assert records and all(list(record) == fields for record in records), records
+    assert [record['model'] for record in records] == ['gpt-4'] * len(records)
+    assert all(record['is_error'] for record in records)
+    # key_id=2 对应第5到9条，其中失败且为gpt-4的只有第5条
+    assert [record['cost'] for record in records] == ['0.000005000'], records
+    logger.info(f"✓ 导出 {len(records)} 行，只包含 {fields}")
+
+
+def test_render_formats():
+    """测试NDJSON每行一条记录，CSV带表头并正确转义，输出按大小分块"""
+    logger.info("测试导出编码...")
+    fields = ['id', 'timestamp', 'response', 'prompt_tokens']
+    with app.app_context():
+        ndjson = ''.join(ExportService.render(ExportService.iter_chat_history(fields), fields, 'ndjson'))
+        original_chunk_chars = export_service.EXPORT_CHUNK_CHARS
+        export_service.EXPORT_CHUNK_CHARS = 200
+        try:
+            chunks = list(ExportService.render(ExportService.iter_chat_history(fields), fields, 'csv'))
+        finally:
+            export_service.EXPORT_CHUNK_CHARS = original_chunk_chars
+
+    lines = [json.loads(line) for line in ndjson.splitlines()]
+    assert len(lines) == 25 and lines[0]['timestamp'] == START.isoformat(), lines[0]
+    assert lines[0]['prompt_tokens'] is None
+
+    assert len(chunks) > 1, "输出没有按大小分块"
+    rows = list(csv.reader(''.join(chunks).splitlines(keepends=True)))
+    assert rows[0] == fields and len(rows) == 26, f"CSV行数不正确: {len(rows)}"
+    assert rows[1][2] == 'ok, "quoted"\nsecond line', f"CSV没有正确转义: {rows[1][2]!r}"
+    assert rows[1][3] == '', "空值应输出为空字符串"
+    logger.info(f"✓ NDJSON和CSV编码正确，CSV分为 {len(chunks)} 块")
+
+
+def test_usage_day_export():
+    """测试天粒度导出：已合并的天读取天级汇总，当天从小时级汇总按天聚合补齐"""
+    logger.info("测试使用统计导出...")
+    today = floor_datetime(datetime.utcnow(), 'day')
+    event = {'key_id': 1, 'model_id': 5, 'tokens_used': 10, 'prompt_tokens': 4, 'completion_tokens': 6,
+             'latency_ms': 100, 'cost_nanos': 2500}
+    with app.app_context():
+        for rollup_model in ROLLUP_MODELS.values():
+            rollup_model.query.delete()
+        RollupService.record_events([
+            dict(event, timestamp=today - timedelta(days=2, hours=-3)),
+            dict(event, timestamp=today - timedelta(days=2, hours=-9)),
+            dict(event, timestamp=today + timedelta(seconds=1)),
+            dict(event, timestamp=today + timedelta(seconds=2), key_id=2)
+        ])
+        db.session.commit()
+        RollupService.merge_days()
+        records = list(ExportService.iter_usage(today - timedelta(days=7), today + timedelta(days=1), 'day'))
+        key_records = list(ExportService.iter_usage(today - timedelta(days=7), today + timedelta(days=1), 'day', key_id=2))
+
+    assert all(list(record) == list(USAGE_FIELDS) for record in records)
+    by_bucket = {(record['bucket'], record['key_id']): record for record in records}
+    merged = by_bucket[((today - timedelta(days=2)).isoformat(), 1)]
+    assert merged['request_count'] == 2 and merged['total_tokens'] == 20 and merged['cost'] == '0.000005000', merged
+    assert by_bucket[(today.isoformat(), 1)]['request_count'] == 1, "当天的数据没有从小时级汇总补齐"
+    assert len(records) == 3
+    assert [record['key_id'] for record in key_records] == [2]
+    logger.info("✓ 天级汇总和当天的小时级数据都已导出")
+
+
+def test_export_route_streams():
+    """测试导出接口流式返回，参数错误时返回400"""
+    logger.info("测试导出接口...")
+    response = client.get('/api/chat/history/export?format=csv&fields=id,model&key_id=1', buffered=False)
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert 'chat_history.csv' in response.headers['Content-Disposition']
+    assert response.is_streamed, "导出没有流式返回"
+    rows = list(csv.reader(response.get_data(as_text=True).splitlines()))
+    response.close()
+    assert rows[0] == ['id', 'model'] and len(rows) == 6, rows
+
+    assert client.get('/api/chat/history/export?format=xml').status_code == 400
+    assert client.get('/api/chat/history/export?fields=id,secret').status_code == 400
+    assert client.get('/api/stats/export/usage?start=2024-01-02T00:00:00Z&end=2024-01-01T00:00:00Z').status_code == 400
+    logger.info("✓ 导出接口流式返回，无效参数返回400")
+
+
+def run_tests():
+    """运行所有测试"""
+    setup_module()
+    tests = [
+        test_iter_rows_batches,
+        test_chat_history_filters_and_fields,
+        test_render_formats,
+        test_usage_day_export,
+        test_export_route_streams
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)
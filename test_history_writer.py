@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+历史记录写入队列测试脚本
+
+在临时SQLite数据库上测试队列满时的三种溢出策略（block、drop_metadata、spill）、
+溢出文件的回放（跳过损坏的行、从记录的位置继续）、单条错误事件不影响同批的其他事件，
+以及停止写入线程时写完队列中剩余的事件。
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp_dir, 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app
+from app.models.chat_history import ChatHistory
+from app.services.history_writer import (
+    HistoryWriter, OVERFLOW_BLOCK, OVERFLOW_DROP_METADATA, OVERFLOW_SPILL, EVENT_CHAT
+)
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+
+def make_writer(policy, block_timeout=0.2, maxsize=1):
+    """创建写入器，默认队列长度为1、每批写入1条，方便构造队列已满的情况"""
+    writer = HistoryWriter()
+    writer.maxsize = maxsize
+    writer.batch_size = 1
+    writer.flush_interval = 0.05
+    writer.overflow_policy = policy
+    writer.block_timeout = block_timeout
+    writer.spill_path = os.path.join(_tmp_dir, f'spill-{policy}.jsonl')
+    writer.init_app(app)
+    return writer
+
+
+def stall(writer):
+    """让写入线程在写入前等待，返回放行用的Event"""
+    gate = threading.Event()
+    write_batch = writer._write_batch
+
+    def write(batch):
+        gate.wait(5)
+        write_batch(batch)
+    writer._write_batch = write
+    return gate
+
+
+def fill_queue(writer, tag):
+    """写入线程取走第一条事件并卡住后，再放入一条事件占满队列"""
+    writer.submit_chat(key_id=0, model='m', request=f'{tag}-0')
+    deadline = time.monotonic() + 2
+    while writer.get_metrics()['queue_depth'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.submit_chat(key_id=0, model='m', request=f'{tag}-1')
+    assert writer.get_metrics()['queue_depth'] == 1, "队列没有被占满"
+
+
+def count_rows(tag):
+    """统计请求内容以 tag 开头的聊天历史"""
+    with app.app_context():
+        return ChatHistory.query.filter(ChatHistory.request.like(f'{tag}-%')).count()
+
+
+def wait_for_rows(tag, expected, timeout=5):
+    """等待后台线程写入指定数量的聊天历史"""
+    deadline = time.monotonic() + timeout
+    while count_rows(tag) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return count_rows(tag)
+
+
+def chat_event(tag, i):
+    """构造一条聊天历史事件"""
+    return {
+        'type': EVENT_CHAT, 'key_id': 0, 'model': 'm', 'model_id': None, 'request': f'{tag}-{i}',
+        'response': None, 'tokens_used': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+        'is_error': False, 'latency_ms': 0, 'ttfb_ms': None, 'overhead_ms': None,
+        'timestamp': datetime.utcnow()
+    }
+
+
+def test_block_policy():
+    """测试block策略：队列满时阻塞等待，超时后丢弃"""
+    logger.info("测试block策略...")
+    writer = make_writer(OVERFLOW_BLOCK)
+    gate = stall(writer)
+    fill_queue(writer, 'block')
+
+    started = time.monotonic()
+    accepted = writer.submit_chat(key_id=0, model='m', request='block-2')
+    elapsed = time.monotonic() - started
+    assert not accepted, "队列满且超时后事件仍然被接收"
+    assert elapsed >= 0.2, f"没有阻塞等待 block_timeout（{elapsed:.2f} 秒）"
+    assert writer.get_metrics()['dropped'][EVENT_CHAT] == 1
+
+    gate.set()
+    assert writer.stop(5)
+    assert count_rows('block') == 2, "放行后没有写完队列中的事件"
+    logger.info(f"✓ 队列满时阻塞 {elapsed:.2f} 秒后丢弃，其余事件全部写入")
+
+
+def test_drop_metadata_policy():
+    """测试drop_metadata策略：队列满时立即丢弃聊天历史，使用统计仍然阻塞等待"""
+    logger.info("测试drop_metadata策略...")
+    writer = make_writer(OVERFLOW_DROP_METADATA, block_timeout=2)
+    gate = stall(writer)
+    fill_queue(writer, 'drop')
+
+    started = time.monotonic()
+    assert not writer.submit_chat(key_id=0, model='m', request='drop-2'), "聊天历史事件没有被丢弃"
+    assert time.monotonic() - started < 0.1, "丢弃聊天历史时不应阻塞"
+
+    # 使用统计事件等待队列腾出位置
+    threading.Timer(0.1, gate.set).start()
+    assert writer.submit_usage(key_id=0, model='m', tokens_used=1), "使用统计事件在等待期间被丢弃"
+    metrics = writer.get_metrics()
+    assert metrics['dropped'] == {EVENT_CHAT: 1, 'usage': 0}, metrics['dropped']
+
+    assert writer.stop(5)
+    assert count_rows('drop') == 2
+    logger.info("✓ 队列满时只丢弃聊天历史，使用统计等待写入")
+
+
+def test_spill_policy():
+    """测试spill策略：队列满时写入溢出文件，空闲时回放"""
+    logger.info("测试spill策略...")
+    writer = make_writer(OVERFLOW_SPILL)
+    gate = stall(writer)
+    fill_queue(writer, 'spill')
+
+    assert writer.submit_chat(key_id=0, model='m', request='spill-2'), "队列满时没有写入溢出文件"
+    assert writer.get_metrics()['spilled'] == 1
+    assert os.path.exists(writer.spill_path)
+
+    gate.set()
+    assert wait_for_rows('spill', 3) == 3, "溢出文件中的事件没有被回放"
+    assert writer.stop(5)
+    assert writer.get_metrics()['replayed'] == 1
+    assert not os.path.exists(writer.spill_path) and not os.path.exists(f'{writer.spill_path}.replay')
+    logger.info("✓ 溢出的事件写入文件，队列空闲后回放并删除文件")
+
+
+def test_replay_resumes_and_skips_corrupt_lines():
+    """测试回放跳过损坏的行，中途退出后从记录的位置继续，不重复写入"""
+    logger.info("测试溢出文件回放...")
+    writer = make_writer(OVERFLOW_SPILL)
+    writer.batch_size = 2
+    writer._spill([chat_event('replay', i) for i in range(5)])
+    with open(writer.spill_path, 'a', encoding='utf-8') as f:
+        # 写入溢出文件时进程被杀留下的半行
+        f.write('{"type": "chat", "key_')
+
+    # 模拟上次回放写完第一批（2条）后进程退出
+    replay_path = f'{writer.spill_path}.replay'
+    os.replace(writer.spill_path, replay_path)
+    with open(replay_path, 'rb') as f:
+        first_batch = len(f.readline()) + len(f.readline())
+    writer._write_offset(f'{replay_path}.offset', first_batch)
+
+    with app.app_context():
+        writer._replay_spill()
+    with app.app_context():
+        requests = sorted(row.request for row in ChatHistory.query.filter(ChatHistory.request.like('replay-%')))
+    assert requests == ['replay-2', 'replay-3', 'replay-4'], f"回放的事件不正确: {requests}"
+    assert writer.get_metrics()['corrupt'] == 1
+    assert not os.path.exists(replay_path) and not os.path.exists(f'{replay_path}.offset')
+
+    # 再次回放不会因为上次的损坏行而失败
+    with app.app_context():
+        writer._replay_spill()
+    logger.info("✓ 从上次的位置继续回放，损坏的行计数后跳过")
+
+
+def test_bad_event_isolated():
+    """测试一条无法写入的事件不影响同批的其他事件"""
+    logger.info("测试批次拆分...")
+    writer = make_writer(OVERFLOW_BLOCK)
+    batch = [chat_event('isolate', i) for i in range(4)]
+    batch[2]['request'] = None  # request 不能为空
+    writer._flush(batch)
+    assert count_rows('isolate') == 3, "错误事件导致同批的其他事件没有写入"
+    assert writer.get_metrics()['failed'] == 1
+    logger.info("✓ 只丢弃无法写入的单条事件")
+
+
+def test_stop_drains_queue():
+    """测试停止写入线程时写完队列中剩余的事件（收到SIGTERM后由 drain_service 调用）"""
+    logger.info("测试停止时写完队列...")
+    writer = make_writer(OVERFLOW_BLOCK, maxsize=100)
+    gate = stall(writer)
+    for i in range(20):
+        assert writer.submit_chat(key_id=0, model='m', request=f'stop-{i}')
+    gate.set()
+    assert writer.stop(5), "停止写入线程超时"
+    assert count_rows('stop') == 20, "停止前没有写完队列中的事件"
+    logger.info("✓ 停止前写完队列中的全部事件")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_block_policy,
+        test_drop_metadata_policy,
+        test_spill_policy,
+        test_replay_resumes_and_skips_corrupt_lines,
+        test_bad_event_isolated,
+        test_stop_drains_queue
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+模型列表ETag测试脚本
+
+在临时SQLite数据库上测试 /v1/models 的强ETag：相同的 If-None-Match 返回不带响应体的304，
+模型变化后ETag随之变化；Flask路由和ASGI数据面返回相同的响应体和ETag。
+"""
+
+import os
+import sys
+import logging
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app
+from app.services.model_service import ModelService
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+client = app.test_client()
+
+
+def test_not_modified():
+    """测试相同的ETag返回304"""
+    logger.info("测试304响应...")
+    response = client.get('/v1/models')
+    etag = response.headers.get('ETag')
+    assert response.status_code == 200 and etag, f"没有返回ETag: {response.status_code}"
+    assert not etag.startswith('W/'), f"应为强ETag: {etag}"
+    assert response.get_json()['object'] == 'list'
+
+    cached = client.get('/v1/models', headers={'If-None-Match': etag})
+    assert cached.status_code == 304, f"相同的ETag没有返回304: {cached.status_code}"
+    assert cached.get_data() == b'', "304响应不应带响应体"
+    assert cached.headers.get('ETag') == etag
+
+    # 多个ETag中有一个匹配即可
+    cached = client.get('/v1/models', headers={'If-None-Match': f'"stale", {etag}'})
+    assert cached.status_code == 304
+    stale = client.get('/v1/models', headers={'If-None-Match': '"stale"'})
+    assert stale.status_code == 200 and stale.get_data() == response.get_data()
+    logger.info(f"✓ 相同的ETag返回304，不同的ETag返回完整响应 ({etag})")
+
+
+def test_etag_changes_with_models():
+    """测试模型变化后ETag变化，旧ETag不再返回304"""
+    logger.info("测试模型变化后的ETag...")
+    before = client.get('/v1/models')
+    etag = before.headers['ETag']
+    with app.app_context():
+        ModelService.create_model('etag-test-model', 'ETag测试模型')
+    try:
+        after = client.get('/v1/models', headers={'If-None-Match': etag})
+        assert after.status_code == 200, "模型变化后旧ETag仍然返回304"
+        assert after.headers['ETag'] != etag
+        assert 'etag-test-model' in [model['id'] for model in after.get_json()['data']]
+    finally:
+        with app.app_context():
+            ModelService.delete_model('etag-test-model')
+    logger.info("✓ 模型变化后返回新的响应体和ETag")
+
+
+def test_asgi_matches_flask():
+    """测试ASGI数据面返回与Flask路由相同的响应体、ETag和304"""
+    logger.info("测试ASGI数据面的ETag...")
+    # httpx 和 starlette 只在ASGI部署中需要
+    from starlette.testclient import TestClient
+    from app.asgi import create_asgi_app
+
+    # 不进入 with：跳过lifespan，测试结束时不停止全局的后台线程
+    asgi_client = TestClient(create_asgi_app(app))
+    flask_response = client.get('/v1/models')
+    response = asgi_client.get('/v1/models')
+    etag = response.headers.get('etag')
+    assert response.status_code == 200
+    assert etag == flask_response.headers['ETag'], f"ETag不一致: {etag} != {flask_response.headers['ETag']}"
+    assert response.content == flask_response.get_data(), "响应体不一致"
+
+    cached = asgi_client.get('/v1/models', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.content == b''
+    logger.info("✓ ASGI数据面与Flask路由的响应体和ETag相同，同样返回304")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_not_modified,
+        test_etag_changes_with_models,
+        test_asgi_matches_flask
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+模型别名路由测试脚本
+
+在临时SQLite数据库上用模拟的上游响应测试别名路由：目标失败时换下一个目标、
+连续失败后熔断和冷却后的试探请求、请求截止时间，以及流式请求所有目标都失败时不把用量记到失败的Key上。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp_dir, 'app.db')}"
+os.environ['MODEL_ROUTES_PATH'] = os.path.join(_tmp_dir, 'model_routes.json')
+os.environ['HISTORY_SPILL_PATH'] = os.path.join(_tmp_dir, 'history_spill.jsonl')
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app, db
+from app.config import Config
+from app.models.key import Key
+from app.models.chat_history import ChatHistory
+from app.models.usage_stats import UsageStat
+from app.services.openai_service import openai_service, UpstreamOverloadError
+from app.services.model_router import ModelRouter
+from app.services.history_writer import history_writer
+from app.utils.routing_table import routing_table
+from app.utils.key_rotation import key_rotation
+from app.utils.tokenizer import StreamUsageTracker
+
+logger = logging.getLogger(__name__)
+
+ROUTES = {
+    'fallback': {'targets': [{'model': 'm-down', 'keys': ['a']}, {'model': 'm-ok', 'keys': ['b']}]},
+    'breaker': {'targets': [{'model': 'm-flaky', 'keys': ['a']}, {'model': 'm-ok', 'keys': ['b']}]},
+    'deadline': {'deadline_ms': 300, 'targets': [
+        {'model': 'm-slow', 'keys': ['a'], 'latency_budget_ms': 200},
+        {'model': 'm-slow', 'keys': ['b']},
+        {'model': 'm-ok', 'keys': ['c']}
+    ]},
+    'all-down': {'targets': [{'model': 'm-down', 'keys': ['a']}, {'model': 'm-down', 'keys': ['b']}]}
+}
+
+# 模拟上游：记录每次请求的模型和超时时间，m-flaky 的行为由 flaky_up 控制
+calls = []
+flaky_up = False
+
+class FakeStreamResponse:
+    """模拟上游的流式响应"""
+
+    def iter_content(self, chunk_size=1024):
+        yield b'data: {"choices": [{"index": 0, "delta": {"content": "hello"}}]}\n\n'
+        yield b'data: [DONE]\n\n'
+
+def fake_make_request(method, endpoint, data=None, key=None, stream=False, timeout=None, retry=True):
+    """按模型名称模拟上游的成功、故障和超时"""
+    model = data['model']
+    calls.append((model, timeout))
+    if model == 'm-down' or (model == 'm-flaky' and not flaky_up):
+        raise UpstreamOverloadError('API请求失败: 503 - overloaded', 'upstream_error')
+    if model == 'm-slow':
+        time.sleep(timeout)
+        raise UpstreamOverloadError('请求失败: timed out', 'timeout')
+    if stream:
+        return FakeStreamResponse()
+    return {
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'hello'}}],
+        'usage': {'prompt_tokens': 5, 'completion_tokens': 1, 'total_tokens': 6},
+        '_key_info': {'id': key.id, 'key_value': key.key_value}
+    }
+
+app = create_app()
+
+def setup_module(module=None):
+    """准备Key、路由表和模拟上游（pytest在模块的第一个测试前调用，脚本方式由 run_tests 调用）"""
+    # 熔断阈值和冷却时间调小以便测试；与其他测试一起运行时配置已经导入，不能通过环境变量设置
+    Config.CIRCUIT_FAILURE_THRESHOLD = 2
+    Config.CIRCUIT_OPEN_SECONDS = 0.3
+    with open(os.environ['MODEL_ROUTES_PATH'], 'w', encoding='utf-8') as f:
+        json.dump(ROUTES, f)
+    routing_table.load(os.environ['MODEL_ROUTES_PATH'])
+    # 全局的历史写入服务绑定到最后创建的应用，与其他测试一起收集时需要重新绑定到本模块的应用
+    history_writer.stop(5)
+    history_writer.init_app(app)
+    with app.app_context():
+        for name in ('a', 'b', 'c'):
+            db.session.add(Key(key_value=f'sk-test-router-{name}', name=name))
+        db.session.commit()
+        key_rotation._reload_keys(force=True)
+    openai_service.make_request = fake_make_request
+
+def chat(router, alias):
+    """发送一次非流式请求"""
+    return router.chat_completion(messages=[{'role': 'user', 'content': 'hi'}], model=alias, max_tokens=10)
+
+def test_fallback():
+    """测试目标失败时换下一个目标"""
+    logger.info("测试目标失败时换下一个目标...")
+    with app.app_context():
+        calls.clear()
+        response = chat(ModelRouter(), 'fallback')
+        route = response['_route']
+        assert route['model'] == 'm-ok' and route['attempts'] == 2, f"没有换到下一个目标: {route}"
+        assert [model for model, _ in calls] == ['m-down', 'm-ok'], f"尝试的目标不正确: {calls}"
+        logger.info("✓ 第一个目标失败后由第二个目标返回结果")
+
+def test_circuit_breaker():
+    """测试连续失败后熔断，冷却后放行一个试探请求"""
+    global flaky_up
+    logger.info("测试熔断器...")
+    with app.app_context():
+        router = ModelRouter()
+        flaky_up = False
+        calls.clear()
+        for _ in range(2):
+            chat(router, 'breaker')
+        chat(router, 'breaker')
+        assert [model for model, _ in calls].count('m-flaky') == 2, f"连续失败2次后没有熔断: {calls}"
+
+        # 冷却后放行一个试探请求，试探失败继续熔断
+        time.sleep(0.35)
+        calls.clear()
+        chat(router, 'breaker')
+        chat(router, 'breaker')
+        assert [model for model, _ in calls].count('m-flaky') == 1, f"冷却后应只放行一个试探请求: {calls}"
+
+        # 上游恢复后试探成功，熔断器关闭
+        flaky_up = True
+        time.sleep(0.35)
+        response = chat(router, 'breaker')
+        status = router.get_status()['routes']['breaker']['targets'][0]['circuit']
+        assert response['_route']['model'] == 'm-flaky', f"试探成功后没有使用恢复的目标: {response['_route']}"
+        assert status['state'] == 'closed', f"试探成功后熔断器没有关闭: {status}"
+        logger.info("✓ 连续失败后熔断，冷却后试探，试探成功后恢复")
+
+def test_deadline():
+    """测试目标的耗时上限和请求截止时间"""
+    logger.info("测试请求截止时间...")
+    with app.app_context():
+        calls.clear()
+        started = time.monotonic()
+        try:
+            chat(ModelRouter(), 'deadline')
+            raise AssertionError("超过截止时间后仍然返回了结果")
+        except UpstreamOverloadError as e:
+            elapsed = time.monotonic() - started
+            reason = e.reason
+        timeouts = [timeout for _, timeout in calls]
+        assert reason == 'all_targets_failed', f"错误原因不正确: {reason}"
+        assert 'm-ok' not in [model for model, _ in calls], f"超过截止时间后仍然尝试了下一个目标: {calls}"
+        assert len(timeouts) == 2 and abs(timeouts[0] - 0.2) <= 0.01 and timeouts[1] <= 0.11, \
+            f"单次尝试的超时时间不正确: {timeouts}"
+        assert elapsed <= 0.4, f"请求耗时 {elapsed:.2f} 秒，超过了截止时间"
+        logger.info(f"✓ 第一个目标在200ms上限后放弃，第二个目标只用剩余时间，总耗时 {elapsed * 1000:.0f}ms")
+
+def test_stream_usage_key():
+    """测试流式请求换目标时用量记在实际使用的Key上"""
+    logger.info("测试流式请求的用量归属...")
+    with app.app_context():
+        router = ModelRouter()
+        key_ids = dict(db.session.query(Key.name, Key.id).all())
+        messages = [{'role': 'user', 'content': 'hi'}]
+
+        tracker = StreamUsageTracker('fallback')
+        chunks = list(router.stream_chat_completion(messages=messages, model='fallback', tracker=tracker, max_tokens=10))
+        assert chunks, "换目标后没有返回数据"
+        assert tracker.key_id == key_ids['b'] and tracker.model == 'm-ok', \
+            f"换目标后的Key不正确: {tracker.key_id}, {tracker.model}"
+        assert tracker.alias == 'fallback' and tracker.attempts == 2, \
+            f"别名和尝试次数不正确: {tracker.alias}, {tracker.attempts}"
+
+        tracker = StreamUsageTracker('all-down')
+        try:
+            list(router.stream_chat_completion(messages=messages, model='all-down', tracker=tracker, max_tokens=10))
+            raise AssertionError("所有目标都失败时没有抛出错误")
+        except UpstreamOverloadError:
+            pass
+        assert tracker.key_id is None, f"所有目标都失败后仍然记录了Key {tracker.key_id}"
+
+    # 通过接口发送，失败的请求不计入任何Key的用量
+    history_writer.flush(5)
+    with app.app_context():
+        before = {stat.key_id: stat.total_tokens for stat in UsageStat.query.all()}
+    response = app.test_client().post('/v1/chat/completions', json={
+        'model': 'all-down', 'stream': True, 'messages': messages
+    })
+    body = response.get_data(as_text=True)
+    history_writer.flush(5)
+    with app.app_context():
+        after = {stat.key_id: stat.total_tokens for stat in UsageStat.query.all()}
+        history = ChatHistory.query.order_by(ChatHistory.id.desc()).first()
+        assert 'error' in body, f"流中没有返回错误: {body}"
+        assert history.key_id == 0 and history.tokens_used == 0 and history.is_error, \
+            f"失败的流式请求记录不正确: {history.to_dict()}"
+        # 与非流式请求相同，没有目标接受请求时记录请求的别名，而不是最后一个失败的目标
+        assert history.model == 'all-down', f"失败的流式请求记在了上游模型 {history.model} 上"
+        assert after == before, f"失败的流式请求计入了Key用量: {before} -> {after}"
+    logger.info("✓ 用量记在实际返回数据的Key上，所有目标都失败时不计入任何Key")
+
+def run_tests():
+    """运行所有测试"""
+    setup_module()
+    tests = [
+        test_fallback,
+        test_circuit_breaker,
+        test_deadline,
+        test_stream_usage_key
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+查询索引和数据库迁移测试脚本
+
+在临时SQLite数据库上调用统计、Key、模型和聊天历史服务，记录它们实际执行的查询，
+检查执行计划是否使用了索引；
+并模拟升级前的数据库，确认启动时的迁移会补建索引、关联模型ID、拆分模型能力并标记失败请求。
+"""
+
+import os
+import sys
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from app import create_app, db
+from app.models.key import Key
+from app.models.model import Model
+from app.models.usage_stats import UsageStat
+from app.models.chat_history import ChatHistory
+from app.models.schema_migration import SchemaMigration
+from app.services.chat_history_service import ChatHistoryService, DEFAULT_LIST_FIELDS
+from app.services.stats_service import StatsService
+from app.services.stats_cache import stats_cache
+from app.services.key_service import KeyService
+from app.services.model_service import ModelService
+from app.utils.database import init_database, explain_query
+from app.utils.migrations import MIGRATIONS
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def prepare_data():
+    """准备测试数据"""
+    key = Key(key_value='sk-test-query-plans', name='plan')
+    db.session.add(key)
+    db.session.flush()
+    model = Model.query.filter_by(model_name='gpt-4').first()
+    db.session.add(UsageStat(key_id=key.id, model='gpt-4', model_id=model.id, usage_count=1, total_tokens=10))
+    db.session.add(UsageStat(key_id=key.id, model='gpt-3.5-turbo', usage_count=1, total_tokens=10))
+    db.session.add(ChatHistory(key_id=key.id, model='gpt-4', model_id=model.id, request='{}',
+                               timestamp=datetime.utcnow(), tokens_used=10))
+    db.session.add(ChatHistory(key_id=key.id, model='gpt-4', model_id=model.id, request='{}',
+                               response='{"error": "upstream failed"}', timestamp=datetime.utcnow(), is_error=True))
+    db.session.commit()
+    return key.id, model.id
+
+@contextmanager
+def capture_queries():
+    """记录代码块中执行的SELECT语句及其参数"""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            queries.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+def service_queries(func, *args, **kwargs):
+    """调用服务函数，返回它执行的查询；函数中未提交的写入被回滚"""
+    stats_cache.clear()
+    with capture_queries() as queries:
+        func(*args, **kwargs)
+    db.session.rollback()
+    return queries
+
+def check_plan(name, queries, index_name):
+    """检查查询中至少有一条的执行计划使用了指定的索引"""
+    plans = [explain_query(statement, parameters) for statement, parameters in queries]
+    if any(index_name in line for plan in plans for line in plan):
+        logger.info(f"✓ {name} 使用索引 {index_name}")
+        return True
+    logger.error(f"✗ {name} 没有使用索引 {index_name}: {plans}")
+    return False
+
+def test_query_plans():
+    """测试热点查询的执行计划"""
+    logger.info("测试热点查询的执行计划...")
+    with app.app_context():
+        key_id, model_id = prepare_data()
+        fields = list(DEFAULT_LIST_FIELDS)
+        cursor = ChatHistoryService.encode_cursor(datetime.utcnow(), 100)
+        usage = {'key_id': key_id, 'model': 'gpt-4', 'count': 1, 'tokens': 10, 'last_used': datetime.utcnow()}
+        checks = [
+            ('聊天历史翻页', service_queries(ChatHistoryService.list_history, cursor=cursor, fields=fields),
+             'ix_chat_history_timestamp_id'),
+            ('按Key过滤聊天历史', service_queries(ChatHistoryService.list_history, fields=fields, key_id=key_id),
+             'ix_chat_history_key_id_timestamp'),
+            ('按模型过滤聊天历史', service_queries(ChatHistoryService.list_history, fields=fields, model='gpt-4'),
+             'ix_chat_history_model_timestamp'),
+            ('按状态过滤聊天历史', service_queries(ChatHistoryService.list_history, fields=fields, status='error'),
+             'ix_chat_history_is_error_timestamp'),
+            ('写入时查找使用统计', service_queries(KeyService.record_usage_batch, [usage]),
+             'ix_usage_stats_key_id_model'),
+            ('模型的Key使用分布', service_queries(StatsService.get_model_stats, 'gpt-4'),
+             'ix_usage_stats_model_id_key_id'),
+            ('按模型ID汇总使用统计', service_queries(StatsService.get_all_model_stats),
+             'ix_usage_stats_model_id_key_id'),
+            ('统计活跃Key', service_queries(StatsService.get_database_info), 'ix_keys_status'),
+            ('支持聊天的模型', service_queries(ModelService.get_chat_models), 'ix_models_supports_chat')
+        ]
+        return all([check_plan(name, queries, index_name) for name, queries, index_name in checks])
+
+def test_migrations():
+    """测试升级前的数据库执行迁移"""
+    logger.info("测试升级前的数据库执行迁移...")
+    with app.app_context():
+        # 模拟升级前的数据库：没有索引、没有迁移记录、使用统计没有关联模型ID、模型能力只存在JSON中、
+        # 聊天历史没有记录请求状态
+        index_names = [index.name for table in db.metadata.sorted_tables for index in table.indexes]
+        with db.engine.begin() as conn:
+            for name in index_names:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+            conn.execute(SchemaMigration.__table__.delete())
+            conn.execute(UsageStat.__table__.update().values(model_id=None))
+            conn.execute(Model.__table__.update().values(supports_chat=False, supports_completion=False, context_window=None))
+            conn.execute(ChatHistory.__table__.update().values(is_error=False))
+
+        init_database()
+
+        inspector = inspect(db.engine)
+        existing = {index['name'] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+        missing = [name for name in index_names if name not in existing]
+        versions = [row.version for row in SchemaMigration.query.order_by(SchemaMigration.version).all()]
+        unlinked = UsageStat.query.filter(UsageStat.model_id.is_(None)).count()
+        gpt4 = Model.query.filter_by(model_name='gpt-4').first()
+        errors = ChatHistory.query.filter(ChatHistory.is_error.is_(True)).count()
+
+        if missing:
+            logger.error(f"✗ 迁移后缺少索引: {missing}")
+            return False
+        if versions != [version for version, _, _ in MIGRATIONS]:
+            logger.error(f"✗ 迁移记录不完整: {versions}")
+            return False
+        if unlinked:
+            logger.error(f"✗ 还有 {unlinked} 条使用统计没有关联模型ID")
+            return False
+        if not gpt4.supports_chat or gpt4.context_window != 8192:
+            logger.error(f"✗ 模型能力没有写入能力字段: {gpt4.to_dict()}")
+            return False
+        if errors != 1:
+            logger.error(f"✗ 失败请求的聊天历史没有标记为失败: {errors}")
+            return False
+
+        # 再次启动时不会重复执行迁移
+        init_database()
+        if SchemaMigration.query.count() != len(MIGRATIONS):
+            logger.error("✗ 迁移被重复执行")
+            return False
+
+        logger.info("✓ 迁移补建了索引、关联了模型ID、拆分了模型能力并标记了失败请求")
+        return True
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_query_plans,
+        test_migrations
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+            else:
+                failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+请求日志测试脚本
+
+测试汇总日志的格式、请求和响应内容的抽样记录，以及写入前的脱敏和截断。
+日志写入临时文件，不影响全局的请求日志。
+"""
+
+import os
+import sys
+import json
+import random
+import logging
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.request_log import RequestLogger, REQUEST_LOGGER_NAME, REDACTED, new_request_id
+
+logger = logging.getLogger(__name__)
+
+SECRET_KEY = 'sk-abcdefghijklmnopqrstuvwx'
+
+
+def collect(sample_rate, calls, body_max_chars=2000):
+    """用新的日志服务记录 calls 中的每条汇总，返回写入文件的JSON记录和指标"""
+    path = os.path.join(tempfile.mkdtemp(), 'requests.log')
+    request_logger = RequestLogger()
+    request_logger.path = path
+    request_logger.body_sample_rate = sample_rate
+    request_logger.body_max_chars = body_max_chars
+    try:
+        for fields in calls:
+            request_logger.log_request(**fields)
+        request_logger.stop()
+    finally:
+        logging.getLogger(REQUEST_LOGGER_NAME).removeHandler(request_logger._handler)
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f], request_logger.get_metrics()
+
+
+def test_summary_fields():
+    """测试汇总记录为一行JSON，空字段省略，浮点数保留3位小数"""
+    logger.info("测试汇总记录格式...")
+    entries, metrics = collect(0, [{
+        'request_id': 'req-1', 'path': '/v1/chat/completions', 'status_code': 200,
+        'key_id': None, 'latency_ms': 12.345678, 'error': f'upstream rejected {SECRET_KEY}'
+    }])
+    assert len(entries) == 1 and metrics['logged'] == 1
+    entry = entries[0]
+    assert entry['request_id'] == 'req-1' and entry['status_code'] == 200 and entry['level'] == 'INFO'
+    assert 'key_id' not in entry, "值为空的字段应省略"
+    assert entry['latency_ms'] == 12.346
+    assert SECRET_KEY not in entry['error'] and REDACTED in entry['error'], f"错误信息中的Key没有脱敏: {entry['error']}"
+    assert new_request_id('  client-id ') == 'client-id' and len(new_request_id()) == 32
+    logger.info("✓ 汇总记录格式正确，错误信息中的Key已脱敏")
+
+
+def test_body_sampling():
+    """测试按比例抽样记录请求和响应内容"""
+    logger.info("测试内容抽样...")
+    call = {'request_body': '{"model": "m"}', 'response_body': '{"id": "x"}', 'status_code': 200}
+
+    entries, metrics = collect(0, [call] * 20)
+    assert not any('request_body' in entry for entry in entries) and metrics['sampled'] == 0, "抽样比例为0时记录了内容"
+
+    entries, metrics = collect(1, [call] * 20)
+    assert all(entry.get('request_body') == call['request_body'] for entry in entries) and metrics['sampled'] == 20
+
+    random.seed(7)
+    entries, metrics = collect(0.25, [call] * 400)
+    sampled = sum('request_body' in entry for entry in entries)
+    assert sampled == metrics['sampled'] and 60 <= sampled <= 140, f"抽样数量偏离25%: {sampled}/400"
+    logger.info(f"✓ 抽样比例0、1和0.25分别记录 0、20 和 {sampled}/400 条内容")
+
+
+def test_body_redaction():
+    """测试记录内容时按字段名脱敏、替换内容中的Key并截断"""
+    logger.info("测试内容脱敏...")
+    request_body = json.dumps({
+        'model': 'm',
+        'api_key': 'plain-secret',
+        'headers': {'Authorization': 'Bearer token'},
+        'messages': [{'role': 'user', 'content': f'my key is {SECRET_KEY}'}]
+    })
+    entries, _ = collect(1, [
+        {'request_body': request_body, 'response_body': f'not json {SECRET_KEY}'},
+        {'request_body': json.dumps({'content': 'x' * 100})}
+    ], body_max_chars=60)
+
+    body = entries[0]['request_body']
+    assert 'plain-secret' not in body and 'Bearer token' not in body, f"字段没有脱敏: {body}"
+    assert SECRET_KEY not in body and SECRET_KEY not in entries[0]['response_body'], "内容中的Key没有脱敏"
+    assert len(entries[1]['request_body']) == 63 and entries[1]['request_body'].endswith('...'), "超长内容没有截断"
+    logger.info("✓ 脱敏字段、内容中的Key和超长内容都已处理")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_summary_fields,
+        test_body_sampling,
+        test_body_redaction
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+使用统计汇总测试脚本
+
+在临时SQLite数据库上测试 RollupService：记账时按 (时间桶, Key, 模型) 累加分钟级和小时级汇总，
+从聊天历史回填汇总表（保留原有的 latency_ms_sum），按汇总表查询时间范围内的合计，
+以及把已结束的天合并到天级汇总、清理超出保留期的分钟级和小时级汇总。
+"""
+
+import os
+import sys
+import logging
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app, db
+from app.config import Config
+from app.models.chat_history import ChatHistory
+from app.models.usage_rollup import ROLLUP_MODELS
+from app.services.rollup_service import RollupService
+from app.utils.time_buckets import floor_datetime
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+
+def clear_rollups():
+    """清空聊天历史和所有汇总表，每个测试从空表开始"""
+    ChatHistory.query.delete()
+    for rollup_model in ROLLUP_MODELS.values():
+        rollup_model.query.delete()
+    db.session.commit()
+
+
+def usage_event(timestamp, key_id=1, model_id=5, tokens=10, latency_ms=100, is_error=False):
+    """构造一条记账事件，输入输出token各占一半"""
+    return {
+        'timestamp': timestamp, 'key_id': key_id, 'model_id': model_id,
+        'tokens_used': tokens, 'prompt_tokens': tokens // 2, 'completion_tokens': tokens - tokens // 2,
+        'is_error': is_error, 'latency_ms': latency_ms, 'cost_nanos': tokens * 1000
+    }
+
+
+def rollup_rows(granularity):
+    """按 (时间桶, Key, 模型) 返回汇总表中的全部行"""
+    return {
+        (row.bucket, row.key_id, row.model_id): row.to_dict()
+        for row in ROLLUP_MODELS[granularity].query.all()
+    }
+
+
+def test_record_events_accumulates():
+    """测试多批事件累加到同一汇总行，未知模型记为0，分钟和小时粒度分别分桶"""
+    logger.info("测试汇总行累加...")
+    minute = floor_datetime(datetime.utcnow() - timedelta(minutes=10), 'minute')
+    with app.app_context():
+        clear_rollups()
+        RollupService.record_events([usage_event(minute), usage_event(minute + timedelta(seconds=30), is_error=True)])
+        db.session.commit()
+        # 第二批事件累加到已存在的行
+        RollupService.record_events([
+            usage_event(minute + timedelta(seconds=59), tokens=20, latency_ms=2 ** 31),
+            usage_event(minute, model_id=None),
+            usage_event(minute + timedelta(minutes=1))
+        ])
+        db.session.commit()
+        minute_rows = rollup_rows('minute')
+        hour_rows = rollup_rows('hour')
+
+    row = minute_rows[(minute, 1, 5)]
+    assert row['request_count'] == 3 and row['total_tokens'] == 40, row
+    assert row['prompt_tokens'] + row['completion_tokens'] == 40
+    assert row['error_count'] == 1 and row['cost_nanos'] == 40000
+    assert row['latency_ms_sum'] == 200 + 2 ** 31, f"延迟合计超出32位后不正确: {row['latency_ms_sum']}"
+    assert minute_rows[(minute, 1, 0)]['request_count'] == 1, "未知模型应记为 model_id 0"
+    assert minute_rows[(minute + timedelta(minutes=1), 1, 5)]['request_count'] == 1
+    assert len(minute_rows) == 3
+
+    hour_requests = sum(row['request_count'] for row in hour_rows.values())
+    assert hour_requests == 5, f"小时级汇总的请求数不正确: {hour_requests}"
+    logger.info("✓ 同一时间桶的事件累加到一行，分钟和小时粒度一致")
+
+
+def test_backfill_rebuilds_from_history():
+    """测试从聊天历史回填：请求数和错误数按历史重算，保留原有的 latency_ms_sum"""
+    logger.info("测试回填汇总表...")
+    minute = floor_datetime(datetime.utcnow() - timedelta(minutes=10), 'minute')
+    with app.app_context():
+        clear_rollups()
+        # 记账时写入的汇总行带有延迟，之后被改坏
+        RollupService.record_events([usage_event(minute, latency_ms=700)])
+        ROLLUP_MODELS['minute'].query.update({'request_count': 99})
+        for i, is_error in enumerate((False, False, True)):
+            db.session.add(ChatHistory(
+                key_id=1, model_id=5, model='m', request=f'backfill-{i}', timestamp=minute + timedelta(seconds=i),
+                tokens_used=10, prompt_tokens=4, completion_tokens=6, cost_nanos=1000, is_error=is_error
+            ))
+        db.session.commit()
+
+        result = RollupService.backfill(since=minute)
+        minute_rows = rollup_rows('minute')
+        hour_rows = rollup_rows('hour')
+
+    assert result['minute'] == 1 and result['hour'] == 1, result
+    row = minute_rows[(minute, 1, 5)]
+    assert row['request_count'] == 3 and row['error_count'] == 1, f"回填后请求数或错误数不正确: {row}"
+    assert (row['total_tokens'], row['prompt_tokens'], row['completion_tokens']) == (30, 12, 18)
+    assert row['cost_nanos'] == 3000
+    assert row['latency_ms_sum'] == 700, "回填后丢失了原有的延迟合计"
+    assert hour_rows[(floor_datetime(minute, 'hour'), 1, 5)]['request_count'] == 3
+    logger.info("✓ 回填按聊天历史重算，保留延迟合计")
+
+
+def test_query_totals():
+    """测试按时间范围和Key查询合计"""
+    logger.info("测试查询合计...")
+    minute = floor_datetime(datetime.utcnow() - timedelta(minutes=10), 'minute')
+    with app.app_context():
+        clear_rollups()
+        RollupService.record_events([
+            usage_event(minute, key_id=1),
+            usage_event(minute + timedelta(minutes=2), key_id=1, tokens=30),
+            usage_event(minute + timedelta(minutes=2), key_id=2, tokens=50)
+        ])
+        db.session.commit()
+        everything = RollupService.query_totals(minute - timedelta(hours=1))
+        key_totals = RollupService.query_totals(minute - timedelta(hours=1), key_id=1)
+        later = RollupService.query_totals(minute + timedelta(minutes=1))
+
+    assert everything['request_count'] == 3 and everything['tokens_used'] == 90, everything
+    assert key_totals['request_count'] == 2 and key_totals['tokens_used'] == 40, key_totals
+    assert later['request_count'] == 2 and later['cost_nanos'] == 80000, later
+    logger.info("✓ 按时间范围和Key过滤的合计正确")
+
+
+def test_merge_days():
+    """测试合并已结束的天：重复执行结果不变，合并后写入的小时数据在下次合并时补上"""
+    logger.info("测试合并天级汇总...")
+    day = floor_datetime(datetime.utcnow(), 'day') - timedelta(days=3)
+    with app.app_context():
+        clear_rollups()
+        RollupService.record_events([
+            usage_event(day + timedelta(hours=1)),
+            usage_event(day + timedelta(hours=5), tokens=30),
+            usage_event(day + timedelta(days=3, seconds=1))
+        ])
+        db.session.commit()
+
+        assert RollupService.merge_days() == 1, "只应合并已结束的天"
+        assert RollupService.merge_days() == 1
+        row = rollup_rows('day')[(day, 1, 5)]
+        assert row['request_count'] == 2 and row['total_tokens'] == 40, f"重复合并后天级汇总不正确: {row}"
+        assert len(rollup_rows('day')) == 1, "当天的数据不应合并"
+        assert RollupService.get_merged_until() == day + timedelta(days=1)
+
+        # 合并之后才写入的小时数据（例如回填或延迟的写入）
+        RollupService.record_events([usage_event(day + timedelta(hours=23))])
+        db.session.commit()
+        RollupService.merge_days()
+        row = rollup_rows('day')[(day, 1, 5)]
+    assert row['request_count'] == 3 and row['total_tokens'] == 50, row
+    logger.info("✓ 合并是幂等的，从最后一个已合并的天重新开始")
+
+
+def test_downsample_prunes_expired_rows():
+    """测试降采样后清理超出保留期的数据，查询仍然得到相同的合计"""
+    logger.info("测试降采样...")
+    now = datetime.utcnow()
+    old = floor_datetime(now - timedelta(days=Config.ROLLUP_HOUR_RETENTION_DAYS + 10), 'day') + timedelta(hours=3)
+    expired_minute = now - timedelta(hours=Config.ROLLUP_MINUTE_RETENTION_HOURS + 1)
+    recent = now - timedelta(minutes=5)
+    with app.app_context():
+        clear_rollups()
+        RollupService.record_events([usage_event(old), usage_event(expired_minute, tokens=20), usage_event(recent, tokens=30)])
+        db.session.commit()
+        before = RollupService.query_totals(old - timedelta(days=1))
+
+        report = RollupService.downsample()
+        minute_buckets = {bucket for bucket, _, _ in rollup_rows('minute')}
+        hour_buckets = {bucket for bucket, _, _ in rollup_rows('hour')}
+        after = RollupService.query_totals(old - timedelta(days=1))
+        series = RollupService.query_series(old - timedelta(days=1), now, 'day')
+
+    assert report['pruned']['minute'] == 2 and report['pruned']['hour'] == 1, report
+    assert minute_buckets == {floor_datetime(recent, 'minute')}, "超出保留期的分钟级汇总没有清理"
+    assert floor_datetime(old, 'hour') not in hour_buckets, "超出保留期的小时级汇总没有清理"
+    assert floor_datetime(expired_minute, 'hour') in hour_buckets, "保留期内的小时级汇总被清理"
+    assert before == after and after['request_count'] == 3, f"降采样前后的合计不一致: {before} != {after}"
+    assert series[floor_datetime(old, 'day')] == (1, 10), series
+    assert sum(count for count, _ in series.values()) == 3
+    logger.info(f"✓ 降采样清理 {report['pruned']}，合计和趋势不变")
+
+
+def test_pick_tier():
+    """测试按查询起点和粒度选择汇总表：不细于查询粒度，起点超出保留期时使用最粗的可用粒度"""
+    logger.info("测试选择汇总表...")
+    now = datetime.utcnow()
+    assert RollupService.pick_tier(now - timedelta(hours=1), 'minute', now) == 'minute'
+    assert RollupService.pick_tier(now - timedelta(hours=1), 'hour', now) == 'hour'
+    assert RollupService.pick_tier(now - timedelta(hours=1), 'day', now) == 'day', "按天查询时应使用天级汇总"
+    assert RollupService.pick_tier(now - timedelta(days=365), 'hour', now) == 'hour'
+    logger.info("✓ 选择不细于查询粒度的最粗汇总表")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_record_events_accumulates,
+        test_backfill_rebuilds_from_history,
+        test_query_totals,
+        test_merge_days,
+        test_downsample_prunes_expired_rows,
+        test_pick_tier
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+统计结果缓存测试脚本
+
+在临时SQLite数据库上测试 StatsCache：数据版本号变化后重新计算，超过 timeout 后重新计算，
+过期但未超过 stale_timeout 时返回旧值并在后台刷新，以及按 max_entries 淘汰最久未用的缓存项。
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，不影响正式数据
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ.setdefault('HEARTBEAT_AUTO_START', 'False')
+
+from app import create_app, db
+from app.models.data_version import DataVersion, STATS_VERSION
+from app.services.stats_cache import StatsCache
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+
+def make_cache(timeout=60, stale_timeout=60, max_entries=100):
+    """创建独立的缓存实例，不影响全局的 stats_cache"""
+    cache = StatsCache()
+    cache.enabled = True
+    cache.timeout = timeout
+    cache.stale_timeout = stale_timeout
+    cache.max_entries = max_entries
+    return cache
+
+
+class Counter:
+    """记录计算次数，每次计算返回新的值"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+def bump_version():
+    """模拟一次统计数据的写入"""
+    DataVersion.bump(STATS_VERSION)
+    db.session.commit()
+
+
+def test_version_invalidation():
+    """测试版本号不变时命中缓存，版本号变化后重新计算"""
+    logger.info("测试版本号失效...")
+    cache = make_cache()
+    compute = Counter()
+    with app.app_context():
+        assert cache.get_or_compute('overview', (), compute) == 1
+        assert cache.get_or_compute('overview', (), compute) == 1, "版本号没变时没有命中缓存"
+        assert cache.get_or_compute('overview', ('other',), compute) == 2, "不同参数不应共用缓存项"
+
+        bump_version()
+        # 不返回旧值，直接同步重新计算（后台刷新见 test_stale_while_refresh）
+        cache.stale_timeout = 0
+        assert cache.get_or_compute('overview', (), compute) == 3, "版本号变化后没有重新计算"
+        stats = cache.get_stats()['endpoints']['overview']
+    assert (stats['hits'], stats['misses'], stats['computes']) == (1, 3, 3), stats
+    logger.info("✓ 版本号不变时命中，变化后重新计算")
+
+
+def test_timeout():
+    """测试超过 timeout 且超过 stale_timeout 后同步重新计算"""
+    logger.info("测试缓存超时...")
+    cache = make_cache(timeout=0.05, stale_timeout=0.05)
+    compute = Counter()
+    with app.app_context():
+        assert cache.get_or_compute('usage', (), compute) == 1
+        assert cache.get_or_compute('usage', (), compute) == 1
+        time.sleep(0.1)
+        assert cache.get_or_compute('usage', (), compute) == 2, "超时后没有重新计算"
+    logger.info("✓ 超时后重新计算")
+
+
+def test_stale_while_refresh():
+    """测试过期但未超过 stale_timeout 时返回旧值并在后台刷新"""
+    logger.info("测试后台刷新...")
+    cache = make_cache(timeout=60, stale_timeout=60)
+    compute = Counter()
+    with app.app_context():
+        assert cache.get_or_compute('keys', (), compute) == 1
+        bump_version()
+        assert cache.get_or_compute('keys', (), compute) == 1, "过期的缓存项应先返回旧值"
+
+        deadline = time.monotonic() + 5
+        while cache.get_stats()['endpoints']['keys']['refreshes'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.get_or_compute('keys', (), compute) == 2, "后台刷新后没有返回新值"
+        stats = cache.get_stats()['endpoints']['keys']
+    assert (stats['stale_hits'], stats['refreshes'], stats['hits']) == (1, 1, 1), stats
+    logger.info("✓ 过期时返回旧值，后台刷新后返回新值")
+
+
+def test_eviction():
+    """测试超过 max_entries 时淘汰最久未用的缓存项"""
+    logger.info("测试缓存淘汰...")
+    cache = make_cache(max_entries=2)
+    compute = Counter()
+    with app.app_context():
+        cache.get_or_compute('model', ('a',), compute)
+        cache.get_or_compute('model', ('b',), compute)
+        cache.get_or_compute('model', ('a',), compute)
+        cache.get_or_compute('model', ('c',), compute)
+        assert cache.get_stats()['entries'] == 2
+        assert compute.calls == 3
+        cache.get_or_compute('model', ('a',), compute)
+        assert compute.calls == 3, "最近用过的缓存项被淘汰"
+        cache.get_or_compute('model', ('b',), compute)
+        assert compute.calls == 4, "最久未用的缓存项没有被淘汰"
+    logger.info("✓ 淘汰最久未用的缓存项")
+
+
+def test_disabled():
+    """测试关闭缓存或没有应用上下文时每次都重新计算"""
+    logger.info("测试关闭缓存...")
+    cache = make_cache()
+    compute = Counter()
+    assert cache.get_or_compute('series', (), compute) == 1
+    assert cache.get_or_compute('series', (), compute) == 2, "没有应用上下文时不应缓存"
+    cache.enabled = False
+    with app.app_context():
+        assert cache.get_or_compute('series', (), compute) == 3
+        assert cache.get_or_compute('series', (), compute) == 4, "关闭缓存后仍然返回缓存项"
+    logger.info("✓ 关闭缓存或没有应用上下文时直接计算")
+
+
+def run_tests():
+    """运行所有测试"""
+    tests = [
+        test_version_invalidation,
+        test_timeout,
+        test_stale_while_refresh,
+        test_eviction,
+        test_disabled
+    ]
+
+    passed = 0
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            logger.error(f"✗ {test.__name__}: {e}")
+            failed += 1
+        except Exception as e:
+            logger.error(f"测试 {test.__name__} 执行失败: {e}")
+            failed += 1
+
+    logger.info(f"通过: {passed}，失败: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    success = run_tests()
+    sys.exit(0 if success else 1)